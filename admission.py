@@ -0,0 +1,167 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from config_util import get_config_value
+from metrics import admission_rejections, upstream_in_flight, upstream_queue_depth
+
+admission_enabled = get_config_value('admission', 'admission_enabled', "true").lower() == "true"
+admission_default_deadline = float(get_config_value('admission', 'admission_default_deadline', 30))
+admission_max_deadline = float(get_config_value('admission', 'admission_max_deadline', 300))
+upstream_limits = {
+    upstream: (int(get_config_value('admission', f'{upstream}_max_concurrency', max_concurrency)),
+               int(get_config_value('admission', f'{upstream}_max_queue', max_queue)))
+    for upstream, max_concurrency, max_queue in (("openai", 32, 64), ("bhashini", 64, 128), ("marqo", 32, 64), ("oci", 16, 64))
+}
+
+# Monotonic time by which the current request should be answered, and the rejections of its upstream calls,
+# set by AdmissionMiddleware
+request_deadline: ContextVar = ContextVar("request_deadline", default=None)
+request_rejections: ContextVar = ContextVar("request_rejections", default=None)
+
+
+class UpstreamOverloadedError(Exception):
+    """
+    Raised when a call to an upstream is not admitted: its wait queue is full (429) or the estimated wait
+    exceeds the deadline of the request (503). retry_after is the estimated number of seconds until the
+    upstream has capacity again.
+    """
+
+    def __init__(self, upstream, status_code, reason, retry_after):
+        super().__init__(f"The {upstream} service is overloaded at the moment. Please try again in {retry_after} seconds")
+        self.upstream = upstream
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class UpstreamLimiter:
+    """
+    Limits the calls in flight to an upstream, with a bounded FIFO queue of waiting calls.
+
+    A call which would wait is rejected at once when max_queue calls are already waiting, or when the wait
+    estimated from the queue length and the recent call durations exceeds the remaining deadline of the
+    request. A call whose wait outlasts the deadline is rejected as well. Calls which must not be shed wait
+    for their turn without a bound.
+    """
+
+    def __init__(self, name, max_concurrency, max_queue):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiters = deque()
+        # Exponentially weighted moving average of the call durations
+        self.average_duration = None
+        self.admitted = 0
+        self.rejected = 0
+
+    def has_capacity(self):
+        return self.in_flight < self.max_concurrency and not self.waiters
+
+    def estimated_wait(self):
+        if self.has_capacity():
+            return 0
+        return (len(self.waiters) // self.max_concurrency + 1) * (self.average_duration or 0)
+
+    def reject(self, status_code, reason):
+        self.rejected += 1
+        admission_rejections.labels(self.name, reason).inc()
+        rejections = request_rejections.get()
+        error = UpstreamOverloadedError(self.name, status_code, reason, max(1, math.ceil(self.estimated_wait())))
+        if rejections is not None:
+            rejections.append(error)
+        raise error
+
+    def check(self, deadline):
+        """Raises UpstreamOverloadedError when a call made now would not be admitted."""
+        if self.has_capacity():
+            return
+        if len(self.waiters) >= self.max_queue:
+            self.reject(429, "queue_full")
+        if deadline is not None and self.estimated_wait() > deadline - time.monotonic():
+            self.reject(503, "deadline")
+
+    @asynccontextmanager
+    async def slot(self, shed=True):
+        deadline = request_deadline.get() if shed else None
+        if self.has_capacity():
+            self.in_flight += 1
+        else:
+            if shed:
+                self.check(deadline)
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            upstream_queue_depth.labels(self.name).inc()
+            try:
+                await asyncio.wait_for(waiter, deadline - time.monotonic() if deadline is not None else None)
+            except asyncio.TimeoutError:
+                self.reject(503, "deadline")
+            except BaseException:
+                # The slot may have been handed over just before the caller was cancelled
+                if waiter.done() and not waiter.cancelled():
+                    self.release()
+                raise
+            finally:
+                upstream_queue_depth.labels(self.name).dec()
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        self.admitted += 1
+        in_flight = upstream_in_flight.labels(self.name)
+        in_flight.inc()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start_time
+            self.average_duration = duration if self.average_duration is None else 0.8 * self.average_duration + 0.2 * duration
+            in_flight.dec()
+            self.release()
+
+    def release(self):
+        # The slot is handed over to the first waiting call, if any
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self):
+        return {"max_concurrency": self.max_concurrency, "max_queue": self.max_queue, "in_flight": self.in_flight,
+                "queued": len(self.waiters), "admitted": self.admitted, "rejected": self.rejected,
+                "average_duration": self.average_duration}
+
+
+upstream_limiters = {upstream: UpstreamLimiter(upstream, max_concurrency, max_queue)
+                     for upstream, (max_concurrency, max_queue) in upstream_limits.items()}
+
+
+@asynccontextmanager
+async def upstream_slot(upstream, shed=True):
+    """
+    Holds one of the concurrent call slots of the upstream (openai, bhashini, marqo or oci) around the block.
+    With shed=False the call is never rejected, it waits for a slot regardless of the queue and the deadline.
+    """
+    if not admission_enabled:
+        yield
+        return
+    async with upstream_limiters[upstream].slot(shed):
+        yield
+
+
+def check_admission(upstreams):
+    """
+    Rejects the current request early, raising UpstreamOverloadedError, when one of the upstreams it needs
+    could not admit a call now.
+    """
+    if admission_enabled:
+        for upstream in upstreams:
+            upstream_limiters[upstream].check(request_deadline.get())
+
+
+def get_admission_stats():
+    return {"enabled": admission_enabled, "upstreams": {name: limiter.stats() for name, limiter in upstream_limiters.items()}}
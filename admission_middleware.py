@@ -0,0 +1,47 @@
+import time
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from admission import admission_default_deadline, admission_max_deadline, request_deadline, request_rejections
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware setting the deadline of every API call used by admission control: the number of
+    seconds in the X-Request-Timeout header, or admission_default_deadline.
+
+    Upstream calls rejected by admission control are recorded for the request, and its error response gets a
+    Retry-After header even when the error was handled by the endpoint.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith("/v1/"):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            timeout = float(Headers(scope=scope).get("x-request-timeout") or admission_default_deadline)
+        except ValueError:
+            timeout = admission_default_deadline
+        if not 0 < timeout <= admission_max_deadline:
+            timeout = admission_default_deadline if timeout <= 0 else admission_max_deadline
+        rejections = []
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start" and message["status"] >= 400 and rejections:
+                headers = MutableHeaders(scope=message)
+                if "retry-after" not in headers:
+                    headers["Retry-After"] = str(max(rejection.retry_after for rejection in rejections))
+            await send(message)
+
+        deadline_token = request_deadline.set(time.monotonic() + timeout)
+        rejections_token = request_rejections.set(rejections)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_rejections.reset(rejections_token)
+            request_deadline.reset(deadline_token)
@@ -0,0 +1,76 @@
+import hashlib
+import time
+
+from cache import TTLCache
+from config_util import get_config_value
+from logger import logger
+from utils import normalize_text
+
+answer_cache_enabled = get_config_value('cache', 'answer_cache_enabled', "true").lower() == "true"
+answer_cache_size = int(get_config_value('cache', 'answer_cache_size', 5000))
+answer_cache_ttl = int(get_config_value('cache', 'answer_cache_ttl', 3600))
+answer_cache_index_check_interval = int(get_config_value('cache', 'answer_cache_index_check_interval', 300))
+
+
+class AnswerCache:
+    """
+    In-process cache of English answers of the rstory flow.
+
+    Entries are keyed by (normalized English query, index name, prompt version, model), so changing a prompt
+    or the model naturally stops serving old answers. Changes to the contents of an index are detected by
+    periodically comparing the index statistics and clear the cache.
+    """
+
+    def __init__(self, max_size, ttl, index_check_interval):
+        self.answers = TTLCache(max_size=max_size, ttl=ttl)
+        self.index_check_interval = index_check_interval
+        self.index_fingerprints = {}
+        self.index_checked_at = {}
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(query, namespace):
+        """Builds the cache key of a query; the namespace is "<index name>:<prompt version>:<model>"."""
+        digest = hashlib.sha256(normalize_text(query).encode("utf-8")).hexdigest()
+        return f"{namespace}:{digest}"
+
+    def get(self, key):
+        return self.answers.get(key)
+
+    def set(self, key, answer):
+        self.answers.set(key, answer)
+
+    def needs_index_check(self, index_id):
+        checked_at = self.index_checked_at.get(index_id)
+        return checked_at is None or time.monotonic() - checked_at >= self.index_check_interval
+
+    def update_index_fingerprint(self, index_id, fingerprint):
+        """Records the latest fingerprint of the index and clears the cache if the index has changed.
+
+        A fingerprint of None means the index could not be checked; the previous fingerprint is kept.
+
+        Returns:
+            True if the cache was cleared, else False.
+        """
+        self.index_checked_at[index_id] = time.monotonic()
+        if fingerprint is None:
+            return False
+        previous_fingerprint = self.index_fingerprints.get(index_id)
+        self.index_fingerprints[index_id] = fingerprint
+        if previous_fingerprint is not None and previous_fingerprint != fingerprint:
+            logger.info({"label": "answer_cache_invalidated", "index_id": index_id, "fingerprint": fingerprint})
+            self.invalidations += 1
+            self.answers.clear()
+            return True
+        return False
+
+    def clear(self):
+        self.answers.clear()
+
+    def stats(self):
+        stats = self.answers.stats()
+        stats.update({"enabled": answer_cache_enabled, "invalidations": self.invalidations})
+        return stats
+
+
+answer_cache = AnswerCache(answer_cache_size, answer_cache_ttl, answer_cache_index_check_interval)
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import re
+import struct
+import tempfile
+
+from starlette.concurrency import run_in_threadpool
+
+from config_util import get_config_value
+from logger import logger
+
+ffmpeg_path = get_config_value('audio', 'ffmpeg_path', "ffmpeg")
+asr_sample_rate = int(get_config_value('audio', 'asr_sample_rate', 16000))
+audio_decode_timeout = float(get_config_value('audio', 'audio_decode_timeout', 30))
+audio_seek_buffer_max_bytes = int(get_config_value('audio', 'audio_seek_buffer_max_bytes', 10485760))
+
+WAV_HEADER_SIZE = 44
+# Errors of the MP4 demuxer of ffmpeg reading a file whose moov atom comes after the media data from a pipe
+seek_error_pattern = re.compile(r"moov atom not found|partial file")
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+class AudioInputTooLargeError(AudioDecodeError):
+    pass
+
+
+async def limit_audio_size(chunks, max_bytes):
+    """Passes the chunks of an audio stream through, raising AudioInputTooLargeError once more than max_bytes arrived."""
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            raise AudioInputTooLargeError(f"Audio input exceeds the maximum size of {max_bytes} bytes")
+        yield chunk
+
+
+class SeekBuffer:
+    """
+    Keeps the encoded audio fed to ffmpeg while it may have to be decoded again from a seekable file.
+
+    Only MP4 family containers (MP4/M4A/3GP) with the media data (mdat) before the moov atom need seeking;
+    the top level boxes are inspected as the audio arrives, and any other input is let go as soon as the
+    first boxes show it is not such a file. The buffer is also let go once it exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes=audio_seek_buffer_max_bytes):
+        self.max_bytes = max_bytes
+        self.chunks = []
+        self.size = 0
+        self.active = True
+        self.needs_seeking = False
+
+    def append(self, chunk):
+        if not self.active:
+            return
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.release()
+        elif not self.needs_seeking:
+            self.inspect()
+
+    def inspect(self):
+        head = b"".join(self.chunks)
+        offset = 0
+        while offset + 8 <= len(head):
+            size, box_type = struct.unpack(">I4s", head[offset:offset + 8])
+            if size == 1 and offset + 16 <= len(head):
+                size = struct.unpack(">Q", head[offset + 8:offset + 16])[0]
+            elif size == 1:
+                return
+            if (offset == 0 and box_type != b"ftyp") or box_type == b"moov" or size < 8:
+                self.release()
+                return
+            if box_type == b"mdat":
+                self.needs_seeking = True
+                return
+            offset += size
+
+    def release(self):
+        self.active = False
+        self.chunks = []
+
+    def content(self):
+        """Returns the whole audio when it is kept, else None."""
+        return b"".join(self.chunks) if self.active and self.needs_seeking else None
+
+
+def make_wav_header(pcm_size, sample_rate=asr_sample_rate, channels=1, sample_width=2):
+    """Returns the 44 byte RIFF/WAVE header of a PCM16 stream."""
+    byte_rate = sample_rate * channels * sample_width
+    return struct.pack("<4sI4s4sIHHIIHH4sI",
+                       b"RIFF", WAV_HEADER_SIZE - 8 + pcm_size, b"WAVE",
+                       b"fmt ", 16, 1, channels, sample_rate, byte_rate, channels * sample_width, sample_width * 8,
+                       b"data", pcm_size)
+
+
+async def run_ffmpeg(input_path, audio, seek_buffer, sample_rate):
+    """Runs one ffmpeg decode to raw PCM16, feeding the audio to stdin when given. Returns the return code, PCM chunks and stderr."""
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg_path, "-hide_banner", "-loglevel", "error",
+        "-i", input_path, "-vn", "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "pipe:1",
+        stdin=asyncio.subprocess.PIPE if audio is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+
+    pcm_chunks = []
+
+    async def feed_input():
+        if audio is None:
+            return
+        try:
+            if isinstance(audio, (bytes, bytearray, memoryview)):
+                seek_buffer.append(audio)
+                process.stdin.write(audio)
+                await process.stdin.drain()
+            else:
+                async for chunk in audio:
+                    seek_buffer.append(chunk)
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg stopped reading, the reason is reported on stderr
+            pass
+        finally:
+            process.stdin.close()
+
+    async def read_output():
+        while chunk := await process.stdout.read(65536):
+            pcm_chunks.append(chunk)
+
+    tasks = [asyncio.ensure_future(feed_input()), asyncio.ensure_future(read_output()),
+             asyncio.ensure_future(process.stderr.read())]
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=audio_decode_timeout, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+        if pending:
+            raise AudioDecodeError(f"Decoding the audio input did not finish within {audio_decode_timeout} seconds")
+        stderr = tasks[2].result()
+        await process.wait()
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return process.returncode, pcm_chunks, stderr
+
+
+def write_temp_file(content):
+    with tempfile.NamedTemporaryFile(prefix="audio-", delete=False) as f:
+        f.write(content)
+    return f.name
+
+
+async def decode_to_wav(audio, sample_rate=asr_sample_rate):
+    """
+    Decodes the audio in a single ffmpeg pass to 16 kHz mono PCM16 WAV, over pipes.
+
+    The encoded audio is written to the stdin of ffmpeg while the raw PCM samples are read from its stdout,
+    and the samples are joined with the WAV header once. There is no lossy intermediate encoding, and a
+    streamed input is decoded while it is still arriving. MP4/M4A/3GP files with the moov atom at the end
+    need a seekable input and fail on a pipe; such files (up to audio_seek_buffer_max_bytes) are kept in
+    memory while they are fed to ffmpeg, and decoded again from a temporary file when the pipe fails.
+
+    Args:
+        audio: The encoded audio content (any format ffmpeg can read), either as bytes or as an async
+            iterator of byte chunks.
+
+    Returns:
+        The WAV content, accepted as is by both Bhashini (base64 encoded) and Google speech to text.
+    """
+    seek_buffer = SeekBuffer()
+    return_code, pcm_chunks, stderr = await run_ffmpeg("pipe:0", audio, seek_buffer, sample_rate)
+    pcm_size = sum(len(chunk) for chunk in pcm_chunks)
+    content = seek_buffer.content()
+    if (return_code != 0 or pcm_size == 0) and content is not None and seek_error_pattern.search(stderr.decode(errors="replace")):
+        logger.info({"label": "audio_decode_seek_retry", "return_code": return_code, "size": len(content)})
+        path = await run_in_threadpool(write_temp_file, content)
+        try:
+            return_code, pcm_chunks, stderr = await run_ffmpeg(path, None, None, sample_rate)
+        finally:
+            os.unlink(path)
+        pcm_size = sum(len(chunk) for chunk in pcm_chunks)
+
+    if return_code != 0 or pcm_size == 0:
+        error = stderr.decode(errors="replace").strip()
+        logger.error({"label": "audio_decode_failed", "return_code": return_code, "error": error})
+        raise AudioDecodeError(f"Unable to decode the audio input: {error or 'no audio samples'}")
+    return b"".join([make_wav_header(pcm_size, sample_rate), *pcm_chunks])
@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import upstream_slot
+from cloud_storage_oci import put_object
+from config_util import get_config_value
+from logger import logger
+from metrics import track_stage
+
+audio_upload_wait = get_config_value('tts', 'audio_upload_wait', "false").lower() == "true"
+audio_upload_max_workers = int(get_config_value('tts', 'audio_upload_max_workers', 4))
+audio_upload_max_pending = int(get_config_value('tts', 'audio_upload_max_pending', 64))
+audio_upload_retries = int(get_config_value('tts', 'audio_upload_retries', 3))
+audio_upload_retry_backoff = float(get_config_value('tts', 'audio_upload_retry_backoff', 0.5))
+
+
+class AudioUploader:
+    """
+    Uploads synthesized audio from memory to the OCI bucket on a bounded pool of background threads.
+
+    Uploads of the same object are deduplicated while in flight. Failed uploads are retried with exponential
+    backoff. When more than max_pending uploads are in flight the caller is expected to wait for its upload,
+    which keeps the memory held by queued audio bounded.
+    """
+
+    def __init__(self, max_workers, max_pending, retries, retry_backoff):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="audio-upload")
+        self.max_pending = max_pending
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.pending = {}
+        self.uploaded = 0
+        self.failed = 0
+        self.retried = 0
+        self.deduplicated = 0
+
+    def is_pending(self, object_name):
+        return object_name in self.pending
+
+    def is_saturated(self):
+        return len(self.pending) > self.max_pending
+
+    def put_object_with_retries(self, content, object_name):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            if put_object(content, object_name):
+                return True
+        return False
+
+    async def upload(self, content, object_name, on_uploaded=None):
+        start_time = time.time()
+        loop = asyncio.get_running_loop()
+        with track_stage("oci_upload") as stage:
+            # The URL of the audio may already have been handed out, so the upload is not shed; the queued audio
+            # is bounded by max_pending instead
+            async with upstream_slot("oci", shed=False):
+                # The context is copied so that the upload is traced as part of the request
+                is_uploaded = await loop.run_in_executor(self.executor, contextvars.copy_context().run,
+                                                         self.put_object_with_retries, content, object_name)
+            stage.failed = not is_uploaded
+        if is_uploaded:
+            self.uploaded += 1
+            if on_uploaded is not None:
+                await on_uploaded(object_name)
+        else:
+            self.failed += 1
+        logger.info({"label": "audio_upload", "object_name": object_name, "uploaded": is_uploaded, "size": len(content),
+                     "upload_time": round(time.time() - start_time, 3)})
+        return is_uploaded
+
+    def submit(self, content, object_name, on_uploaded=None):
+        """
+        Starts the upload in the background, or joins the upload of the same object already in flight.
+
+        Returns:
+            A task resolving to True when the object was uploaded, else False.
+        """
+        task = self.pending.get(object_name)
+        if task is not None:
+            self.deduplicated += 1
+            return task
+        task = asyncio.create_task(self.upload(content, object_name, on_uploaded))
+        self.pending[object_name] = task
+        task.add_done_callback(lambda _: self.pending.pop(object_name, None))
+        return task
+
+    async def close(self):
+        """Waits for the uploads still in flight, e.g. on shutdown."""
+        if self.pending:
+            logger.info({"label": "audio_upload_flush", "pending": len(self.pending)})
+            await asyncio.gather(*self.pending.values(), return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    def stats(self):
+        return {"pending": len(self.pending), "uploaded": self.uploaded, "failed": self.failed,
+                "retried": self.retried, "deduplicated": self.deduplicated}
+
+
+audio_uploader = AudioUploader(audio_upload_max_workers, audio_upload_max_pending, audio_upload_retries,
+                               audio_upload_retry_backoff)
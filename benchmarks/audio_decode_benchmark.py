@@ -0,0 +1,124 @@
+"""Compares CPU time and peak memory of the old file based voice input decoding with the in-memory ffmpeg pipe.
+
+The old pipeline (kept below for reference) wrote the input to a temp file, decoded it with pydub, re-encoded
+it to MP3, decoded that MP3 again, wrote a WAV file and read it back. The new pipeline decodes once over
+pipes with audio_transcoder.decode_to_wav. Every measurement runs in a fresh interpreter so that the peak RSS
+of one run does not leak into the next. CPU time includes the ffmpeg child processes, RSS is the one of the
+Python worker.
+
+Clips are 44.1 kHz stereo 128 kbps MP3s generated with ffmpeg, which must be on the PATH.
+
+Usage:
+    python benchmarks/audio_decode_benchmark.py --durations 10 60 300
+"""
+import argparse
+import asyncio
+import base64
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+def legacy_encode_audio(audio_content):
+    from pydub import AudioSegment
+    from utils import generate_temp_filename
+
+    # pydub probes every input with ffprobe; without it the decoder is named explicitly, which makes the
+    # legacy numbers slightly optimistic
+    probe_kwargs = {} if shutil.which("ffprobe") else {"codec": "mp3"}
+    local_filename = generate_temp_filename("mp3")
+    with open(local_filename, "wb") as f:
+        f.write(audio_content)
+    output_file = AudioSegment.from_file(local_filename, **probe_kwargs)
+    mp3_output_file = output_file.export(local_filename, format="mp3")
+    given_audio = AudioSegment.from_file(mp3_output_file, **probe_kwargs)
+    given_audio = given_audio.set_frame_rate(16000)
+    given_audio = given_audio.set_channels(1)
+    tmp_wav_filename = generate_temp_filename("wav")
+    given_audio.export(tmp_wav_filename, format="wav", codec="pcm_s16le")
+    with open(tmp_wav_filename, "rb") as wav_file:
+        wav_file_content = wav_file.read()
+    encoded_string = str(base64.b64encode(wav_file_content), 'ascii', 'ignore')
+    os.remove(local_filename)
+    os.remove(tmp_wav_filename)
+    return encoded_string, wav_file_content
+
+
+def pipe_encode_audio(audio_content):
+    from audio_transcoder import decode_to_wav
+
+    wav_file_content = asyncio.run(decode_to_wav(audio_content))
+    return base64.b64encode(wav_file_content).decode("ascii"), wav_file_content
+
+
+def cpu_seconds():
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def run_worker(pipeline, clip_path):
+    """Decodes the clip once and prints CPU seconds, wall seconds, RSS growth and peak RSS (MB) and the WAV size."""
+    os.chdir(tempfile.mkdtemp())
+    encode_audio = legacy_encode_audio if pipeline == "legacy" else pipe_encode_audio
+    with open(clip_path, "rb") as f:
+        audio_content = f.read()
+    # Import everything before measuring so that only the decoding is counted
+    import pydub  # noqa: F401
+    import audio_transcoder  # noqa: F401
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_cpu, start_time = cpu_seconds(), time.perf_counter()
+    encoded_string, wav_file_content = encode_audio(audio_content)
+    elapsed_cpu, elapsed_time = cpu_seconds() - start_cpu, time.perf_counter() - start_time
+    python_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(elapsed_cpu, elapsed_time, (python_rss - baseline_rss) / 1024, python_rss / 1024, len(wav_file_content))
+
+
+def make_clip(duration, directory):
+    clip_path = os.path.join(directory, f"clip_{duration}s.mp3")
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "lavfi", "-i",
+                    f"sine=frequency=440:sample_rate=44100:duration={duration}", "-ac", "2", "-b:a", "128k", clip_path],
+                   check=True)
+    return clip_path
+
+
+def measure(pipeline, clip_path, repeats):
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", pipeline, "--clip", clip_path],
+                                check=True, capture_output=True, text=True).stdout.split()
+        runs.append([float(value) for value in output])
+    # Report the median run by CPU time
+    return sorted(runs)[len(runs) // 2]
+
+
+def main(args):
+    print(f"{'clip (s)':>8} {'pipeline':>8} {'cpu (s)':>8} {'wall (s)':>9} {'rss growth (MB)':>16} "
+          f"{'peak rss (MB)':>14} {'wav (MB)':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        for duration in args.durations:
+            clip_path = make_clip(duration, directory)
+            for pipeline in ("legacy", "pipe"):
+                cpu, wall, rss_growth, peak_rss, wav_size = measure(pipeline, clip_path, args.repeats)
+                print(f"{duration:>8} {pipeline:>8} {cpu:>8.2f} {wall:>9.2f} {rss_growth:>16.1f} "
+                      f"{peak_rss:>14.1f} {wav_size / 2 ** 20:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--durations", type=int, nargs="+", default=[10, 60, 300], help="clip lengths in seconds")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--worker", choices=["legacy", "pipe"], help=argparse.SUPPRESS)
+    parser.add_argument("--clip", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args.worker, args.clip)
+    else:
+        main(args)
@@ -0,0 +1,63 @@
+"""Measures how many /v1/query_rstory requests a single worker keeps in flight.
+
+Every upstream (Bhashini, Azure OpenAI, Marqo) is replaced by a local stub that sleeps for
+``--latency`` seconds per call. A text query in a regional language makes five upstream calls
+(inbound translation, intent, Marqo search, LLM, outbound translation), so one request takes roughly
+``5 * latency``. With a blocking pipeline N concurrent requests take ``N`` times as long; with the
+async pipeline they overlap and finish in about the time of a single request.
+
+Usage:
+    python benchmarks/concurrency_benchmark.py --latency 0.5 --concurrency 1 10 50 100
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_upstreams import start_stub_server, stub_environment  # noqa: E402
+
+REQUEST_BODY = {
+    "input": {"language": "hi", "text": "story about a monkey and crocodile"},
+    "output": {"format": "text"}
+}
+
+
+async def run_batch(client, concurrency):
+    async def one_request():
+        response = await client.post("/v1/query_rstory", json=REQUEST_BODY)
+        response.raise_for_status()
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[one_request() for _ in range(concurrency)])
+    return time.perf_counter() - start_time
+
+
+async def main(args):
+    base_url = start_stub_server(port=args.port, latency=args.latency)
+    os.environ.update(stub_environment(base_url))
+    os.chdir(ROOT_DIR)
+
+    import httpx
+    from main import app
+
+    async with httpx.AsyncClient(app=app, base_url="http://testserver", timeout=None) as client:
+        single_request_time = await run_batch(client, 1)
+        print(f"upstream latency: {args.latency:.2f}s, single request: {single_request_time:.2f}s")
+        print(f"{'concurrency':>12} {'wall time (s)':>14} {'blocking estimate (s)':>22} {'speedup':>8}")
+        for concurrency in args.concurrency:
+            wall_time = await run_batch(client, concurrency)
+            blocking_estimate = single_request_time * concurrency
+            print(f"{concurrency:>12} {wall_time:>14.2f} {blocking_estimate:>22.2f} {blocking_estimate / wall_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds each stub upstream call takes")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100, 200])
+    parser.add_argument("--port", type=int, default=8899)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,268 @@
+"""Load test of the service running as uvicorn workers against the stub upstreams, without any network access.
+
+The stub upstreams (see stub_upstreams.py) run in their own process with the given latency distributions and
+error rates, and the service is started with ``uvicorn main:app --workers N`` pointed at them. Every workload is
+driven at each concurrency level by that many clients sending requests back to back; throughput, p50/p95/p99
+latency, failed requests, injected upstream errors and the peak RSS of every worker are reported.
+
+Workloads:
+    query-text, rstory-text    text input in --language, text output
+    query-audio, rstory-audio  base64 WAV input (--audio-seconds long), audio output (TTS and OCI upload)
+
+The answer, translation, semantic and TTS caches are disabled and every text query is unique, so each request
+runs the whole pipeline; pass --with-caches to keep the configured caches.
+
+Usage:
+    python benchmarks/load_benchmark.py --workers 2 --concurrency 1 10 50 --requests 200 \\
+        --latency 0.1 --latency openai=lognormal:0.8:0.5 --error-rate bhashini=0.01 --output results.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from stub_upstreams import silent_wav, stub_environment  # noqa: E402
+
+WORKLOADS = {
+    "query-text": ("/v1/query", False),
+    "query-audio": ("/v1/query", True),
+    "rstory-text": ("/v1/query_rstory", False),
+    "rstory-audio": ("/v1/query_rstory", True),
+}
+
+CACHES_DISABLED = {
+    "answer_cache_enabled": "false",
+    "semantic_cache_enabled": "false",
+    "translation_cache_enabled": "false",
+    "tts_cache_enabled": "false",
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def get_rss(pid):
+    """Returns the resident set size of a process in bytes, or None when it has exited."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def get_worker_pids(main_pid):
+    """
+    Returns the uvicorn worker processes, which are spawned by the main process (the main process itself serves
+    requests when there is one worker). Other children, like the multiprocessing resource tracker, are skipped.
+    """
+    workers = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The parent PID is the second field after the parenthesized command name
+                parent_pid = int(f.read().rsplit(")", 1)[1].split()[1])
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                command_line = f.read()
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent_pid == main_pid and b"spawn_main" in command_line:
+            workers.append(int(entry))
+    return sorted(workers) or [main_pid]
+
+
+def wait_until_ready(url, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"{' '.join(process.args)} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    sys.exit(f"{url} did not become ready within {timeout} seconds")
+
+
+def make_request_body(workload, language, audio, request_number):
+    _, is_audio = WORKLOADS[workload]
+    if is_audio:
+        return {"input": {"language": language, "audio": audio}, "output": {"format": "audio"}}
+    return {"input": {"language": language, "text": f"story about a monkey and crocodile number {request_number}"},
+            "output": {"format": "text"}}
+
+
+async def sample_rss(worker_pids, peaks, interval=0.25):
+    while True:
+        for pid in worker_pids:
+            rss = get_rss(pid)
+            if rss is not None:
+                peaks[pid] = max(peaks.get(pid, 0), rss)
+        await asyncio.sleep(interval)
+
+
+async def run_level(client, workload, concurrency, args, audio, worker_pids, request_numbers):
+    path, _ = WORKLOADS[workload]
+    latencies = []
+    failures = {}
+
+    async def send(record):
+        body = make_request_body(workload, args.language, audio, next(request_numbers))
+        start_time = time.perf_counter()
+        try:
+            response = await client.post(path, json=body)
+            status_code = response.status_code
+        except httpx.HTTPError as e:
+            status_code = type(e).__name__
+        if record:
+            if status_code == 200:
+                latencies.append(time.perf_counter() - start_time)
+            else:
+                failures[str(status_code)] = failures.get(str(status_code), 0) + 1
+
+    async def client_loop(count, record):
+        for _ in range(count):
+            await send(record)
+
+    def split(total):
+        return [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+
+    await asyncio.gather(*[client_loop(count, False) for count in split(args.warmup)])
+    stub_stats_before = (await client.get(f"{args.stub_url}/stub/stats")).json()
+    peaks = {}
+    sampler = asyncio.create_task(sample_rss(worker_pids, peaks))
+    start_time = time.perf_counter()
+    await asyncio.gather(*[client_loop(count, True) for count in split(args.requests)])
+    elapsed = time.perf_counter() - start_time
+    sampler.cancel()
+    stub_stats = (await client.get(f"{args.stub_url}/stub/stats")).json()
+    upstream_errors = {upstream: count - stub_stats_before["errors"].get(upstream, 0)
+                       for upstream, count in stub_stats["errors"].items()}
+    return {
+        "workload": workload,
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.5) if latencies else None,
+        "p95": percentile(latencies, 0.95) if latencies else None,
+        "p99": percentile(latencies, 0.99) if latencies else None,
+        "failed": failures,
+        "upstream_errors": {upstream: count for upstream, count in upstream_errors.items() if count},
+        "worker_rss_mb": [round(peaks.get(pid, 0) / 2 ** 20, 1) for pid in worker_pids],
+    }
+
+
+def format_ms(value):
+    return f"{value * 1000:.0f}" if value is not None else "-"
+
+
+def print_result(result):
+    rss = result["worker_rss_mb"]
+    failed = sum(result["failed"].values())
+    print(f"{result['workload']:>13} {result['concurrency']:>5} {result['throughput']:>7.1f} {format_ms(result['p50']):>8} "
+          f"{format_ms(result['p95']):>8} {format_ms(result['p99']):>8} {failed:>7} {sum(result['upstream_errors'].values()):>10} "
+          f"{max(rss):>9.0f} {' '.join(f'{value:.0f}' for value in rss)}", flush=True)
+
+
+async def run_benchmark(args, worker_pids):
+    audio = base64.b64encode(silent_wav(args.audio_seconds, 16000)).decode("ascii")
+    request_numbers = iter(range(10 ** 9))
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    results = []
+    print(f"{'workload':>13} {'conc.':>5} {'req/s':>7} {'p50 (ms)':>8} {'p95 (ms)':>8} {'p99 (ms)':>8} {'failed':>7} "
+          f"{'stub errs':>10} {'max RSS':>9} RSS per worker (MB)")
+    async with httpx.AsyncClient(base_url=args.service_url, timeout=args.timeout, limits=limits) as client:
+        for workload in args.workloads:
+            for concurrency in args.concurrency:
+                result = await run_level(client, workload, concurrency, args, audio, worker_pids, request_numbers)
+                print_result(result)
+                results.append(result)
+    return results
+
+
+def main(args):
+    stub_command = [sys.executable, os.path.join(BENCHMARKS_DIR, "stub_upstreams.py"), "--port", str(args.stub_port),
+                    "--token-latency", str(args.token_latency)]
+    stub_command += [f"--latency={spec}" for spec in args.latency] + [f"--error-rate={rate}" for rate in args.error_rate]
+    if args.seed is not None:
+        stub_command += ["--seed", str(args.seed)]
+    args.stub_url = f"http://127.0.0.1:{args.stub_port}"
+    args.service_url = f"http://127.0.0.1:{args.port}"
+
+    environment = dict(os.environ)
+    environment.update(stub_environment(args.stub_url))
+    if not args.with_caches:
+        environment.update(CACHES_DISABLED)
+    service_command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+                       "--workers", str(args.workers), "--log-level", "warning"]
+
+    stub = subprocess.Popen(stub_command, cwd=ROOT_DIR)
+    service = None
+    service_log = open(args.service_log, "w")
+    try:
+        wait_until_ready(f"{args.stub_url}/stub/stats", stub)
+        # The service logs every failed request, which would drown the results
+        service = subprocess.Popen(service_command, cwd=ROOT_DIR, env=environment, stdout=service_log, stderr=subprocess.STDOUT)
+        wait_until_ready(f"{args.service_url}/health", service)
+        # All workers serve /health once they have started, give the last ones a moment
+        time.sleep(2)
+        worker_pids = get_worker_pids(service.pid)
+        print(f"{len(worker_pids)} worker(s), upstream latency {' '.join(args.latency) or '0.5'}, "
+              f"error rates {' '.join(args.error_rate) or 'none'}, caches {'on' if args.with_caches else 'off'}, "
+              f"service log {args.service_log}")
+        results = asyncio.run(run_benchmark(args, worker_pids))
+    finally:
+        for process in (service, stub):
+            if process is not None:
+                process.terminate()
+                try:
+                    process.wait(30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        service_log.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"arguments": {key: value for key, value in vars(args).items()}, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), default=["rstory-text", "rstory-audio"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per workload and concurrency level")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests before every level")
+    parser.add_argument("--workers", type=int, default=2, help="uvicorn worker processes of the service")
+    parser.add_argument("--language", default="hi")
+    parser.add_argument("--audio-seconds", type=float, default=5.0, help="length of the audio input")
+    parser.add_argument("--latency", action="append", default=[],
+                        help="latency spec of all upstreams, or <upstream>=<spec> for one of them, see stub_upstreams.py")
+    parser.add_argument("--error-rate", action="append", default=[], help="<upstream>=<fraction of calls failing>")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="seconds between streamed LLM tokens")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--with-caches", action="store_true", help="keep the caches configured in config.ini")
+    parser.add_argument("--timeout", type=float, default=300, help="client timeout per request in seconds")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--stub-port", type=int, default=8899)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--service-log", default=os.path.join(tempfile.gettempdir(), "load_benchmark_service.log"),
+                        help="file the output of the service is written to")
+    main(parser.parse_args())
@@ -0,0 +1,117 @@
+"""Measures the semantic cache: lookup latency and memory at different sizes, and hit rates on real queries.
+
+Lookup mode (default): the cache is filled with random unit vectors standing in for query embeddings (384
+dimensions, the size of all-MiniLM-L6-v2) and looked up with other random vectors. No embedding model is
+loaded; only the nearest-neighbour lookup latency and the size of the embedding matrix are reported, as
+random vectors say nothing about how often real paraphrases hit.
+
+Pairs mode (--pairs): the queries of a labelled TSV file (label, cached_query, query) are embedded with the
+configured model (cache.semantic_cache_model, requires sentence-transformers). Every cached_query is added
+to the cache, and every query is looked up at each threshold. A label 1 pair is a paraphrase which should
+be answered from the cache, a label 0 pair a different request which must not be; both are reported, with
+the embedding latency. benchmarks/paraphrase_pairs.tsv holds story requests of both kinds.
+
+Usage:
+    python benchmarks/semantic_cache_benchmark.py --sizes 10000 100000 1000000
+    python benchmarks/semantic_cache_benchmark.py --pairs benchmarks/paraphrase_pairs.tsv --thresholds 0.85 0.9 0.92 0.95
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.chdir(ROOT_DIR)
+
+from semantic_cache import SemanticCache, semantic_cache_model  # noqa: E402
+
+NAMESPACE = "sakhi_rstory:benchmark:gpt4"
+
+
+def random_unit_vectors(rng, count, dimension):
+    vectors = rng.standard_normal((count, dimension), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def run_lookups(size, args, rng):
+    cache = SemanticCache(size, args.threshold, ttl=3600, dimension=args.dimension)
+    for index, vector in enumerate(random_unit_vectors(rng, size, args.dimension)):
+        cache.add(vector, NAMESPACE, f"answer-{index}")
+
+    latencies = []
+    for query in random_unit_vectors(rng, args.lookups, args.dimension):
+        start_time = time.perf_counter()
+        cache.lookup(query, NAMESPACE)
+        latencies.append(time.perf_counter() - start_time)
+
+    latencies_ms = np.array(latencies) * 1000
+    print(f"{size:>10} {np.percentile(latencies_ms, 50):>10.3f} {np.percentile(latencies_ms, 99):>10.3f} "
+          f"{cache.embeddings.nbytes / 2 ** 20:>12.0f}")
+
+
+def read_pairs(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(int(row["label"]), row["cached_query"], row["query"]) for row in csv.DictReader(f, delimiter="\t")]
+
+
+def run_pairs(args):
+    pairs = read_pairs(args.pairs)
+    encoder = SemanticCache(1, 1.0, ttl=3600, model_name=args.model)
+    # The first call loads the model and is not measured
+    encoder.encode(pairs[0][1])
+    texts = list(dict.fromkeys(text for _, cached_query, query in pairs for text in (cached_query, query)))
+    embeddings = {}
+    latencies = []
+    for text in texts:
+        start_time = time.perf_counter()
+        embeddings[text] = encoder.encode(text)
+        latencies.append(time.perf_counter() - start_time)
+    latencies_ms = np.array(latencies) * 1000
+    paraphrases = sum(label == 1 for label, _, _ in pairs)
+    print(f"{len(pairs)} pairs ({paraphrases} paraphrases), model {args.model}, embedding latency "
+          f"p50 {np.percentile(latencies_ms, 50):.1f} ms, p99 {np.percentile(latencies_ms, 99):.1f} ms")
+
+    cached_queries = list(dict.fromkeys(cached_query for _, cached_query, _ in pairs))
+    print(f"{'threshold':>10} {'paraphrase hit':>15} {'wrong answer':>13} {'false hit':>10}")
+    for threshold in args.thresholds:
+        cache = SemanticCache(len(cached_queries), threshold, ttl=3600, dimension=len(embeddings[texts[0]]))
+        for cached_query in cached_queries:
+            cache.add(embeddings[cached_query], NAMESPACE, cached_query)
+        correct_hits = wrong_answers = false_hits = 0
+        for label, cached_query, query in pairs:
+            answer = cache.lookup(embeddings[query], NAMESPACE)
+            if answer is None:
+                continue
+            if label == 0:
+                false_hits += 1
+            elif answer == cached_query:
+                correct_hits += 1
+            else:
+                wrong_answers += 1
+        print(f"{threshold:>10.2f} {correct_hits / max(paraphrases, 1):>15.1%} {wrong_answers / max(paraphrases, 1):>13.1%} "
+              f"{false_hits / max(len(pairs) - paraphrases, 1):>10.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--threshold", type=float, default=0.92)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--pairs", help="TSV file of labelled query pairs, switches to the pairs mode")
+    parser.add_argument("--model", default=semantic_cache_model)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.85, 0.9, 0.92, 0.95])
+    args = parser.parse_args()
+
+    if args.pairs:
+        run_pairs(args)
+    else:
+        rng = np.random.default_rng(0)
+        print(f"{'entries':>10} {'p50 (ms)':>10} {'p99 (ms)':>10} {'matrix (MiB)':>12}")
+        for size in args.sizes:
+            run_lookups(size, args, rng)
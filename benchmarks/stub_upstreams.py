@@ -0,0 +1,252 @@
+"""Local stand-ins for the upstream services used by the Story API Service.
+
+The stub server answers Bhashini pipeline requests (asr/translation/tts), Azure OpenAI chat
+completions, Marqo search, OCI (S3 compatible) object uploads and telemetry batches. Every response is delayed by a
+configurable latency so the service can be benchmarked on a laptop without any network access.
+
+The latency of each upstream can also be drawn from a distribution, and a fraction of its calls can fail with
+HTTP 503, e.g. ``--latency openai=lognormal:0.8:0.5 --error-rate bhashini=0.02``. Latency specs are
+``<seconds>``, ``uniform:<min>:<max>``, ``exponential:<mean>`` or ``lognormal:<median>:<sigma>``. Calls and
+injected errors per upstream are counted at ``GET /stub/stats``.
+
+Run standalone (e.g. for benchmarks/load_benchmark.py):
+    python benchmarks/stub_upstreams.py --port 8899 --latency 0.2 --latency openai=lognormal:0.8:0.5
+"""
+import argparse
+import asyncio
+import base64
+import gzip
+import io
+import json
+import random
+import threading
+import time
+import wave
+from collections import Counter
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+
+def silent_wav(duration_seconds=0.1, sample_rate=22050):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(b"\x00\x00" * int(duration_seconds * sample_rate))
+    return buffer.getvalue()
+
+
+STORY = "Once upon a time, a clever monkey lived on a tree by the river. What would you do if you met the crocodile?"
+UPSTREAMS = ["bhashini", "openai", "marqo", "oci"]
+
+
+def parse_latency(spec):
+    """Returns a function drawing a latency in seconds from the spec, see the module docstring."""
+    kind, _, params = str(spec).partition(":")
+    if not params:
+        value = float(kind)
+        return lambda rng: value
+    values = [float(value) for value in params.split(":")]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1 / values[0])
+    if kind == "lognormal":
+        # Parameterized by the median, which is exp(mu)
+        return lambda rng: values[0] * rng.lognormvariate(0, values[1])
+    raise ValueError(f"Unknown latency distribution {kind}")
+
+
+def create_stub_app(latency=0.5, token_latency=0.02, tts_latency_per_char=0.0, telemetry_latency=0.0, latencies=None,
+                    error_rates=None, seed=None):
+    """
+    Args:
+        latency: Seconds every upstream call takes, unless the upstream has an entry in latencies.
+        latencies: Latency spec per upstream (bhashini, openai, marqo, oci).
+        error_rates: Fraction of the calls per upstream answered with HTTP 503.
+        seed: Seed of the random latencies and errors, for reproducible runs.
+    """
+    tts_audio = base64.b64encode(silent_wav()).decode("ascii")
+    rng = random.Random(seed)
+    samplers = {upstream: parse_latency((latencies or {}).get(upstream, latency)) for upstream in UPSTREAMS}
+    error_rates = error_rates or {}
+    calls = Counter()
+    errors = Counter()
+
+    async def delay(upstream, extra=0.0):
+        """Waits for the latency of the upstream and returns True when the call should fail."""
+        calls[upstream] += 1
+        await asyncio.sleep(samplers[upstream](rng) + extra)
+        if rng.random() < error_rates.get(upstream, 0.0):
+            errors[upstream] += 1
+            return True
+        return False
+
+    def error_response():
+        return JSONResponse({"error": {"code": "503", "message": "Injected stub error"}}, status_code=503)
+
+    async def bhashini(request: Request):
+        payload = await request.json()
+        pipeline_response = []
+        inputs = payload["inputData"].get("input") or [{"source": ""}]
+        task_types = [task["taskType"] for task in payload["pipelineTasks"]]
+        # Synthesis time grows with the length of the text, like the GPU backed Bhashini TTS models
+        tts_chars = sum(len(item["source"]) for item in inputs) if "tts" in task_types else 0
+        if await delay("bhashini", tts_latency_per_char * tts_chars):
+            return error_response()
+        # Every task of a chained pipeline takes the output of the previous one
+        texts = [item["source"] for item in inputs]
+        for task in payload["pipelineTasks"]:
+            task_type = task["taskType"]
+            if task_type == "asr":
+                texts = ["story about a monkey and crocodile"]
+                pipeline_response.append({"taskType": "asr", "output": [{"source": text} for text in texts]})
+            elif task_type == "translation":
+                pipeline_response.append({"taskType": "translation", "output": [{"source": text, "target": text} for text in texts]})
+            elif task_type == "tts":
+                pipeline_response.append({"taskType": "tts", "audio": [{"audioContent": tts_audio} for _ in texts]})
+        return JSONResponse({"pipelineResponse": pipeline_response})
+
+    async def stream_chat_completion(model):
+        for token in STORY.split(" "):
+            await asyncio.sleep(token_latency)
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": None, "delta": {"content": token + " "}}]
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    async def chat_completions(request: Request):
+        if await delay("openai"):
+            return error_response()
+        payload = await request.json()
+        if payload.get("stream"):
+            return StreamingResponse(stream_chat_completion(request.path_params["model"]), media_type="text/event-stream")
+        return JSONResponse({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.path_params["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": STORY}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        })
+
+    async def marqo_search(request: Request):
+        if await delay("marqo"):
+            return error_response()
+        hits = [{
+            "_id": str(i),
+            "_score": 0.9 - i * 0.1,
+            "text": STORY,
+            "metadata": '{"file_name": "panchatantra.pdf", "page_label": "%d"}' % (i + 1)
+        } for i in range(3)]
+        return JSONResponse({"hits": hits})
+
+    async def marqo_index_stats(request: Request):
+        if await delay("marqo"):
+            return error_response()
+        return JSONResponse({"numberOfDocuments": 3, "numberOfVectors": 3})
+
+    stored_objects = set()
+
+    async def object_storage(request: Request):
+        if await delay("oci"):
+            return Response(status_code=503)
+        path = request.path_params["path"]
+        if request.method == "PUT":
+            await request.body()
+            stored_objects.add(path)
+        elif path not in stored_objects:
+            return Response(status_code=404)
+        return Response(status_code=200, headers={"ETag": '"stub"'})
+
+    async def telemetry(request: Request):
+        body = await request.body()
+        if request.headers.get("content-encoding") == "gzip":
+            body = gzip.decompress(body)
+        events = len(json.loads(body)["events"])
+        await asyncio.sleep(telemetry_latency)
+        return JSONResponse({"id": "api.djp.telemetry", "params": {"status": "successful"}, "result": {"events": events}})
+
+    async def stub_stats(request: Request):
+        return JSONResponse({"calls": dict(calls), "errors": dict(errors)})
+
+    return Starlette(routes=[
+        Route("/bhashini", bhashini, methods=["POST"]),
+        Route("/openai/deployments/{model}/chat/completions", chat_completions, methods=["POST"]),
+        Route("/indexes/{index}/search", marqo_search, methods=["POST"]),
+        Route("/indexes/{index}/stats", marqo_index_stats, methods=["GET"]),
+        Route("/oci/{path:path}", object_storage, methods=["PUT", "HEAD", "GET"]),
+        Route("/v1/telemetry", telemetry, methods=["POST"]),
+        Route("/stub/stats", stub_stats, methods=["GET"]),
+    ])
+
+
+def start_stub_server(port=8899, latency=0.5, token_latency=0.02, tts_latency_per_char=0.0, telemetry_latency=0.0,
+                      latencies=None, error_rates=None, seed=None):
+    """Starts the stub server in a daemon thread and returns its base URL once it accepts requests."""
+    app = create_stub_app(latency, token_latency, tts_latency_per_char, telemetry_latency, latencies, error_rates, seed)
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def stub_environment(base_url):
+    """Environment variables that point the service at the stub server."""
+    return {
+        "LOG_LEVEL": "WARNING",
+        "BHASHINI_ENDPOINT_URL": f"{base_url}/bhashini",
+        "BHASHINI_API_KEY": "stub",
+        "OPENAI_API_BASE": base_url,
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_API_VERSION": "2023-05-15",
+        "MARQO_URL": base_url,
+        "OCI_ENDPOINT_URL": f"{base_url}/oci/",
+        "OCI_REGION_NAME": "stub",
+        "OCI_BUCKET_NAME": "stub",
+        "OCI_SECRET_ACCESS_KEY": "stub",
+        "OCI_ACCESS_KEY_ID": "stub",
+        "TELEMETRY_ENDPOINT_URL": base_url,
+        "telemetry_log_enabled": "false",
+    }
+
+
+def parse_upstream_values(values, convert):
+    """Parses ``<upstream>=<value>`` arguments into a dict."""
+    parsed = {}
+    for value in values:
+        upstream, _, setting = value.partition("=")
+        if upstream not in UPSTREAMS:
+            raise argparse.ArgumentTypeError(f"Unknown upstream {upstream}, expected one of {', '.join(UPSTREAMS)}")
+        parsed[upstream] = convert(setting)
+    return parsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--latency", action="append", default=[],
+                        help="latency spec of all upstreams, or <upstream>=<spec> for one of them (repeatable)")
+    parser.add_argument("--error-rate", action="append", default=[], help="<upstream>=<fraction of calls failing> (repeatable)")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="seconds between streamed LLM tokens")
+    parser.add_argument("--tts-latency-per-char", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    default_latency = next((spec for spec in args.latency if "=" not in spec), "0.5")
+    app = create_stub_app(default_latency, args.token_latency, args.tts_latency_per_char,
+                          latencies=parse_upstream_values([spec for spec in args.latency if "=" in spec], str),
+                          error_rates=parse_upstream_values(args.error_rate, float), seed=args.seed)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
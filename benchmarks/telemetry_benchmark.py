@@ -0,0 +1,135 @@
+"""Shows that request latency does not depend on the health of the telemetry service.
+
+/v1/query_rstory is driven with a fixed number of concurrent clients against the stub upstreams, once per
+telemetry scenario: telemetry disabled, a healthy telemetry endpoint, a slow one (``--slow-latency`` seconds
+per batch) and one that is down (connection refused). Each scenario runs in a fresh interpreter, because the
+telemetry settings are read at import time. Every request produces several telemetry events (API access
+plus one per Bhashini call), so with a small events_threshold batches are sent continuously. The events
+still queued when the load ends are sent (or given up) on shutdown; sent/failed/dropped are counted after it.
+
+The scenarios are run ``--repeats`` times, interleaved so that a drift of the machine affects all of them
+alike. Latencies and throughput are reported as the mean and the standard deviation over the runs; the
+telemetry counters and the shutdown time are those of the last run.
+
+Usage:
+    python benchmarks/telemetry_benchmark.py --requests 400 --concurrency 20 --repeats 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_upstreams import start_stub_server, stub_environment  # noqa: E402
+
+REQUEST_BODY = {
+    "input": {"language": "hi", "text": "story about a monkey and crocodile"},
+    "output": {"format": "text"}
+}
+
+SCENARIOS = ["disabled", "healthy", "slow", "down"]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+async def run_scenario(args):
+    base_url = start_stub_server(port=args.port, latency=args.latency, telemetry_latency=args.slow_latency if args.worker == "slow" else 0.0)
+    environment = stub_environment(base_url)
+    environment.update({
+        "telemetry_log_enabled": "false" if args.worker == "disabled" else "true",
+        "TELEMETRY_ENDPOINT_URL": "http://127.0.0.1:9" if args.worker == "down" else base_url,
+        "events_threshold": "5",
+        "telemetry_flush_interval": "1",
+        "answer_cache_enabled": "false",
+    })
+    os.environ.update(environment)
+    os.chdir(ROOT_DIR)
+
+    import httpx
+    from main import app, shutdown_event
+    from telemetry_logger import telemetry_exporter
+
+    latencies = []
+    async with httpx.AsyncClient(app=app, base_url="http://test", timeout=120) as client:
+        queue = asyncio.Queue()
+        for _ in range(args.requests):
+            queue.put_nowait(None)
+
+        async def client_loop():
+            while not queue.empty():
+                queue.get_nowait()
+                start_time = time.perf_counter()
+                response = await client.post("/v1/query_rstory", json=REQUEST_BODY)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*[client_loop() for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - start_time
+        queued = telemetry_exporter.stats()["queued"]
+    start_shutdown = time.perf_counter()
+    await shutdown_event()
+    shutdown_time = time.perf_counter() - start_shutdown
+    print(json.dumps({"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95), "p99": percentile(latencies, 0.99),
+                      "throughput": len(latencies) / elapsed, "queued": queued, "telemetry": telemetry_exporter.stats(),
+                      "shutdown": shutdown_time}))
+
+
+def run_worker(scenario, args):
+    command = [sys.executable, os.path.abspath(__file__), "--worker", scenario, "--requests", str(args.requests),
+               "--concurrency", str(args.concurrency), "--latency", str(args.latency),
+               "--slow-latency", str(args.slow_latency), "--port", str(args.port)]
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        sys.exit(f"{scenario} run failed:\n{process.stderr[-3000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def spread(results, key, scale=1):
+    values = [result[key] * scale for result in results]
+    deviation = statistics.stdev(values) if len(values) > 1 else 0.0
+    return f"{statistics.mean(values):.1f} ± {deviation:.1f}"
+
+
+def main(args):
+    results = {scenario: [] for scenario in SCENARIOS}
+    for _ in range(args.repeats):
+        for scenario in SCENARIOS:
+            results[scenario].append(run_worker(scenario, args))
+
+    print(f"{args.repeats} runs per scenario, mean ± standard deviation")
+    print(f"{'telemetry':>9} {'p50 (ms)':>14} {'p95 (ms)':>14} {'p99 (ms)':>14} {'req/s':>14} {'queued at end':>14} "
+          f"{'sent':>6} {'failed':>7} {'dropped':>8} {'shutdown (s)':>13}")
+    for scenario in SCENARIOS:
+        last = results[scenario][-1]
+        telemetry = last["telemetry"]
+        print(f"{scenario:>9} {spread(results[scenario], 'p50', 1000):>14} {spread(results[scenario], 'p95', 1000):>14} "
+              f"{spread(results[scenario], 'p99', 1000):>14} {spread(results[scenario], 'throughput'):>14} "
+              f"{last['queued']:>14} {telemetry['sent']:>6} {telemetry['failed']:>7} {telemetry['dropped']:>8} "
+              f"{last['shutdown']:>13.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per stub upstream call")
+    parser.add_argument("--slow-latency", type=float, default=3.0, help="seconds per batch of the slow telemetry endpoint")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--repeats", type=int, default=3, help="runs per scenario")
+    parser.add_argument("--worker", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        asyncio.run(run_scenario(args))
+    else:
+        main(args)
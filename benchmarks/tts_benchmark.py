@@ -0,0 +1,61 @@
+"""Compares wall time of single-shot and sentence-chunked text to speech at different story lengths.
+
+The Bhashini stub sleeps ``--latency`` seconds plus ``--latency-per-char`` seconds for every character to
+synthesize, so a single request for a whole story takes longer the longer the story is. The chunked path
+splits the story into sentence chunks, synthesizes them concurrently and joins them into one MP3 (which
+needs ffmpeg on the PATH).
+
+Usage:
+    python benchmarks/tts_benchmark.py --words 50 100 200 250
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_upstreams import start_stub_server, stub_environment  # noqa: E402
+
+SENTENCE = "एक बार की बात है, नदी के किनारे एक चतुर बंदर रहता था।"
+
+
+def make_story(words):
+    sentence_words = len(SENTENCE.split())
+    return " ".join([SENTENCE] * max(1, words // sentence_words))
+
+
+async def timed(coroutine):
+    start_time = time.perf_counter()
+    audio = await coroutine
+    if audio is None:
+        raise RuntimeError("text to speech failed")
+    return time.perf_counter() - start_time
+
+
+async def main(args):
+    base_url = start_stub_server(port=args.port, latency=args.latency, tts_latency_per_char=args.latency_per_char)
+    os.environ.update(stub_environment(base_url))
+    os.chdir(ROOT_DIR)
+
+    from speech_synthesis import synthesize_speech, split_speech_chunks
+    from translator import text_to_speech
+
+    print(f"{'words':>6} {'chunks':>7} {'single-shot (s)':>16} {'chunked (s)':>12} {'speedup':>8}")
+    for words in args.words:
+        story = make_story(words)
+        single_shot = await timed(text_to_speech(language="hi", text=story))
+        chunked = await timed(synthesize_speech(language="hi", text=story))
+        print(f"{words:>6} {len(split_speech_chunks(story)):>7} {single_shot:>16.2f} {chunked:>12.2f} {single_shot / chunked:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", type=int, nargs="+", default=[50, 100, 200, 250])
+    parser.add_argument("--latency", type=float, default=0.3, help="fixed seconds per stub TTS request")
+    parser.add_argument("--latency-per-char", type=float, default=0.004, help="seconds per synthesized character")
+    parser.add_argument("--port", type=int, default=8899)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,137 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from logger import logger
+
+
+class TTLCache:
+    """
+    An in-process LRU cache whose entries expire after a fixed time-to-live.
+    """
+
+    def __init__(self, max_size=1024, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+class SQLiteCache:
+    """
+    A persistent key/value cache stored in a SQLite file, so that entries survive worker restarts
+    and are shared between the uvicorn workers of a host.
+
+    Calls block on disk I/O and should be run in the threadpool from async code. Expired rows are
+    purged every purge_interval writes, which keeps the file bounded by the entries written within a TTL.
+    """
+
+    def __init__(self, db_path, table, ttl=7 * 24 * 3600, purge_interval=1000):
+        self.db_path = db_path
+        self.table = table
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.purged = 0
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+        self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)")
+        self.connection.commit()
+        # Rows left behind by earlier runs
+        self.purge_expired()
+
+    def get(self, key):
+        try:
+            with self.lock:
+                row = self.connection.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Exception reading from cache {self.db_path}: {e}", exc_info=True)
+            row = None
+        if row is not None and row[1] > time.time():
+            self.hits += 1
+            return row[0]
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        try:
+            with self.lock:
+                self.connection.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)", (key, value, time.time() + self.ttl))
+                self.connection.commit()
+                self.writes += 1
+        except sqlite3.Error as e:
+            logger.error(f"Exception writing to cache {self.db_path}: {e}", exc_info=True)
+            return
+        if self.purge_interval and self.writes % self.purge_interval == 0:
+            self.purge_expired()
+
+    def purge_expired(self):
+        """Deletes the expired rows, which are otherwise only skipped when read."""
+        try:
+            with self.lock:
+                cursor = self.connection.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),))
+                self.connection.commit()
+                self.purged += cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Exception purging cache {self.db_path}: {e}", exc_info=True)
+
+    def delete(self, key):
+        try:
+            with self.lock:
+                self.connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.connection.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Exception deleting from cache {self.db_path}: {e}", exc_info=True)
+
+    def stats(self):
+        return {
+            "db_path": self.db_path,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "purged": self.purged
+        }
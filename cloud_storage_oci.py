@@ -1,7 +1,8 @@
 import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 import os
 from logger import logger
+from tracing import span
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -39,6 +40,44 @@ def upload_file_object(file_name, object_name=None):
     return True
 
 
+def put_object(content, object_name, content_type="audio/mpeg"):
+    """Upload in-memory content to an OCI bucket
+
+    :param content: Bytes to upload
+    :param object_name: S3 object name
+    :param content_type: MIME type of the content
+    :return: True if the content was uploaded, else False
+    """
+    try:
+        with span("oci_put_object", object_name=object_name, size=len(content)):
+            s3_client.put_object(Body=content, Bucket=bucket_name, Key=object_name, ACL='public-read', ContentType=content_type)
+        logger.info(f"Object {object_name} uploaded to OCI Object Storage bucket: {bucket_name}")
+    except (BotoCoreError, ClientError) as e:
+        logger.error(f"Exception uploading an object: {e}", exc_info=True)
+        return False
+    return True
+
+
+def object_exists(object_name):
+    """Check whether an object exists in the OCI bucket
+
+    :param object_name: S3 object name
+    :return: True if the object exists, else False
+    """
+    with span("oci_head_object", object_name=object_name):
+        try:
+            s3_client.head_object(Bucket=bucket_name, Key=object_name)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+                logger.error(f"Exception checking a file: {e}", exc_info=True)
+            return False
+        except BotoCoreError as e:
+            # E.g. the endpoint is unreachable: the audio is synthesized and uploaded again
+            logger.error(f"Exception checking a file: {e}", exc_info=True)
+            return False
+    return True
+
+
 def download_file_object(file_name, object_name=None):
     """Download a file to an OCI bucket
 
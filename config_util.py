@@ -12,7 +12,7 @@ config.read(config_file_path)
 
 def get_config_value(section, key, default=None):
     # Check if the key exists in the environment variables
-    value = os.getenv(key, default)
+    value = os.getenv(key)
 
     # If the key is not in the environment variables, try reading from a config file
     if value is None or value == "":
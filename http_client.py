@@ -0,0 +1,67 @@
+import httpx
+
+from config_util import get_config_value
+from logger import logger
+
+max_connections = int(get_config_value('http', 'max_connections', 100))
+max_keepalive_connections = int(get_config_value('http', 'max_keepalive_connections', 20))
+keepalive_expiry = float(get_config_value('http', 'keepalive_expiry', 60))
+connect_timeout = float(get_config_value('http', 'connect_timeout', 5))
+read_timeout = float(get_config_value('http', 'read_timeout', 60))
+pool_timeout = float(get_config_value('http', 'pool_timeout', 10))
+http2_enabled = str(get_config_value('http', 'http2_enabled', "false")).lower() == "true"
+
+if http2_enabled:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("http2_enabled is set but the 'h2' package is not installed, falling back to HTTP/1.1")
+        http2_enabled = False
+
+requests_sent = 0
+
+
+async def count_request(request: httpx.Request):
+    global requests_sent
+    requests_sent += 1
+
+
+# Shared async HTTP client used for all outbound calls (Bhashini, Marqo). One client per worker keeps
+# a pool of keep-alive connections so that repeated calls to the same upstream skip the TCP and TLS
+# handshake.
+http_client = httpx.AsyncClient(
+    http2=http2_enabled,
+    limits=httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry
+    ),
+    timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=pool_timeout),
+    event_hooks={"request": [count_request]}
+)
+
+
+def get_pool_stats():
+    """
+    Returns a snapshot of the shared connection pool, used to size the pool limits.
+
+    Returns:
+        A dictionary with the configured limits and the current connection counts.
+    """
+    pool = getattr(http_client._transport, "_pool", None)
+    connections = list(pool.connections) if pool is not None else []
+    idle_connections = sum(1 for connection in connections if connection.is_idle())
+    return {
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive_connections,
+        "keepalive_expiry": keepalive_expiry,
+        "http2_enabled": http2_enabled,
+        "connections": len(connections),
+        "idle_connections": idle_connections,
+        "active_connections": len(connections) - idle_connections,
+        "requests_sent": requests_sent
+    }
+
+
+async def close_http_client():
+    await http_client.aclose()
@@ -0,0 +1,98 @@
+import os
+import re
+
+from config_util import get_config_value
+from logger import logger
+
+intent_classifier_enabled = get_config_value('llm', 'intent_classifier_enabled', "true").lower() == "true"
+intent_classifier_model_path = get_config_value('llm', 'intent_classifier_model_path', "models/intent_classifier.joblib")
+intent_classifier_threshold = float(get_config_value('llm', 'intent_classifier_threshold', 0.85))
+
+# Questions about the bot itself. A match, in a query which does not mention stories, is treated as a
+# confident "Yes".
+bot_intent_patterns = [re.compile(pattern) for pattern in [
+    r"\bkatha\s*sakhi\b",
+    r"\bwho\s+(are|r)\s+(you|u)\b",
+    r"\bwhat\s+(are|r)\s+(you|u)\b",
+    r"\bwhat(\s+is|'s)\s+your\s+(name|purpose|knowledge\s+base)\b",
+    r"\bwho\s+(made|created|built|developed|owns|operates|trained)\s+(you|this)\b",
+    r"\bare\s+you\s+(a|an)?\s*(bot|robot|ai|human|machine|chatbot|virtual\s+assistant|real)\b",
+    r"\bwhat\s+can\s+you\s+do\b",
+    r"\b(introduce|tell\s+me\s+about)\s+yourself\b",
+    r"\b(are|were)\s+you\s+trained\b",
+    r"\bhow\s+do\s+you\s+work\b",
+]]
+
+# Requests for a story. A match is treated as a confident "No".
+story_request_patterns = [re.compile(pattern) for pattern in [
+    r"^\s*(please\s+)?(tell|write|create|make|narrate|give|generate)(\s+me|\s+us)?\s+(a|an|one|the|any)?\s*(short\s+|funny\s+|bedtime\s+|new\s+)?(story|tale)\b",
+    r"^\s*(a\s+)?(short\s+|funny\s+|bedtime\s+|moral\s+)?(story|tale)\s+(about|of|on|for|with)\b",
+]]
+
+# Queries matching a bot pattern and mentioning stories ("who are you in the story of the lion") are left
+# to the LLM.
+story_keyword_pattern = re.compile(r"\b(story|stories|tale|tales)\b")
+
+
+class IntentClassifier:
+    """
+    Local, CPU only classifier answering the intent question "is the query about the bot (Katha Sakhi)?".
+
+    Regular expressions catch the common phrasings first; the remaining queries are scored by a scikit-learn
+    text classifier trained with train_intent_classifier.py. Only predictions below the confidence threshold
+    are left to the LLM intent prompt.
+    """
+
+    def __init__(self, model_path, threshold):
+        self.threshold = threshold
+        self.model = None
+        self.local_decisions = 0
+        self.llm_fallbacks = 0
+        if model_path and os.path.exists(model_path):
+            try:
+                import joblib
+                self.model = joblib.load(model_path)
+            except Exception as e:
+                logger.error(f"Exception loading intent classifier model {model_path}: {e}", exc_info=True)
+        elif model_path:
+            logger.warning(f"Intent classifier model {model_path} not found, only rule based intents are detected locally")
+
+    def classify(self, query):
+        """
+        Returns:
+            "Yes" or "No" and the confidence of the prediction, or (None, confidence) when the prediction
+            is not confident enough and the LLM should decide.
+        """
+        text = query.strip().lower()
+        if any(pattern.search(text) for pattern in story_request_patterns):
+            self.local_decisions += 1
+            return "No", 1.0
+        if any(pattern.search(text) for pattern in bot_intent_patterns):
+            if story_keyword_pattern.search(text) is not None:
+                self.llm_fallbacks += 1
+                return None, 0.0
+            self.local_decisions += 1
+            return "Yes", 1.0
+        if self.model is not None:
+            probabilities = self.model.predict_proba([text])[0]
+            best = probabilities.argmax()
+            confidence = float(probabilities[best])
+            if confidence >= self.threshold:
+                self.local_decisions += 1
+                return str(self.model.classes_[best]), confidence
+            self.llm_fallbacks += 1
+            return None, confidence
+        self.llm_fallbacks += 1
+        return None, 0.0
+
+    def stats(self):
+        return {
+            "enabled": intent_classifier_enabled,
+            "model_loaded": self.model is not None,
+            "threshold": self.threshold,
+            "local_decisions": self.local_decisions,
+            "llm_fallbacks": self.llm_fallbacks
+        }
+
+
+intent_classifier = IntentClassifier(intent_classifier_model_path, intent_classifier_threshold)
@@ -1,17 +1,32 @@
+import asyncio
+
+from audio_transcoder import AudioInputTooLargeError
+from audio_uploader import audio_uploader, audio_upload_wait
+from cloud_storage_oci import give_public_url
 from logger import logger
+from metrics import track_stage
+from request_audio import MissingAudioFieldError
+from tracing import span
+from speech_synthesis import is_chainable_speech, synthesize_speech, synthesize_translated_speech
 from translator import *
-import time
+from translation_cache import translation_cache, translation_cache_enabled
+from tts_audio_cache import tts_audio_cache, tts_cache_enabled
+
 
-def process_incoming_voice(file_url, input_language):
+async def process_incoming_voice(file_url, input_language):
     error_message = None
     try:
-        regional_text = audio_input_to_text(file_url, input_language)
-        try:
-            english_text = indic_translation(text=regional_text, source=input_language, destination='en')
-        except Exception as e:
-            error_message = "Indic translation to English failed"
-            logger.error(f"Exception occurred: {e}", exc_info=True)
-            english_text = None
+        regional_text, english_text = await audio_input_to_english(file_url, input_language)
+        if english_text is None:
+            try:
+                with track_stage("translation_inbound"):
+                    english_text = await indic_translation(text=regional_text, source=input_language, destination='en')
+            except Exception as e:
+                error_message = "Indic translation to English failed"
+                logger.error(f"Exception occurred: {e}", exc_info=True)
+                english_text = None
+    except (AudioInputTooLargeError, MissingAudioFieldError):
+        raise
     except Exception as e:
         error_message = "Speech to text conversion API failed"
         logger.error(f"Exception occurred: {e}", exc_info=True)
@@ -20,10 +35,11 @@ def process_incoming_voice(file_url, input_language):
     return regional_text, english_text, error_message
 
 
-def process_incoming_text(regional_text, input_language):
+async def process_incoming_text(regional_text, input_language):
     error_message = None
     try:
-        english_text = indic_translation(text=regional_text, source=input_language, destination='en')
+        with track_stage("translation_inbound"):
+            english_text = await indic_translation(text=regional_text, source=input_language, destination='en')
     except Exception as e:
         error_message = "Indic translation to English failed"
         english_text = None
@@ -31,10 +47,11 @@ def process_incoming_text(regional_text, input_language):
     return english_text, error_message
 
 
-def process_outgoing_text(english_text, input_language):
+async def process_outgoing_text(english_text, input_language):
     error_message = None
     try:
-        regional_text = indic_translation(text=english_text, source='en', destination=input_language)
+        with track_stage("translation_outbound"):
+            regional_text = await indic_translation(text=english_text, source='en', destination=input_language)
     except Exception as e:
         error_message = "English translation to indic language failed"
         logger.error(f"Exception occurred: {e}", exc_info=True)
@@ -42,17 +59,107 @@ def process_outgoing_text(english_text, input_language):
     return regional_text, error_message
 
 
-def process_outgoing_voice(message, input_language):
+async def process_incoming_text_batch(regional_texts, input_language):
+    """Batch variant of process_incoming_text for texts in the same language."""
+    error_message = None
+    try:
+        with track_stage("translation_inbound"):
+            english_texts = await indic_translation_batch(regional_texts, source=input_language, destination='en')
+    except Exception as e:
+        error_message = "Indic translation to English failed"
+        english_texts = None
+        logger.error(f"Exception occurred: {e}", exc_info=True)
+    return english_texts, error_message
+
+
+async def process_outgoing_text_batch(english_texts, input_language):
+    """Batch variant of process_outgoing_text for texts translated to the same language."""
     error_message = None
-    decoded_audio_content = text_to_speech(language=input_language, text=message)
+    try:
+        with track_stage("translation_outbound"):
+            regional_texts = await indic_translation_batch(english_texts, source='en', destination=input_language)
+    except Exception as e:
+        error_message = "English translation to indic language failed"
+        logger.error(f"Exception occurred: {e}", exc_info=True)
+        regional_texts = None
+    return regional_texts, error_message
+
+
+async def process_outgoing_voice(message, input_language):
+    error_message = None
+    with track_stage("tts") as stage:
+        decoded_audio_content = await synthesize_speech(language=input_language, text=message)
+        stage.failed = decoded_audio_content is None
     if decoded_audio_content is not None:
-        logger.info("Creating output MP3 file")
-        time_stamp = time.strftime("%Y%m%d-%H%M%S")
-        filename = "audio-output-" + time_stamp + ".mp3"
-        output_mp3_file = open(filename, "wb")
-        output_mp3_file.write(decoded_audio_content)
-        logger.info("Audio Response is saved as a MP3 file.")
-        return output_mp3_file, error_message
+        return decoded_audio_content, error_message
     error_message = "Text to Audio conversion failed"
     logger.error(error_message)
     return None, error_message
+
+
+async def process_outgoing_voice_url(message, input_language, gender='female'):
+    """
+    Converts the message to speech and returns the public URL of the audio in OCI object storage.
+
+    The audio object is named after a hash of its content, so when the same message was synthesized
+    before, the existing object is reused without calling TTS or uploading again. New audio is uploaded
+    from memory in the background and its deterministic URL is returned at once, unless audio_upload_wait
+    is set or too many uploads are in flight, in which case the upload is awaited.
+    """
+    object_name = tts_audio_cache.object_name(message, input_language, gender, tts_mapping[input_language])
+    with span("tts_cache_lookup") as cache_span:
+        is_cached = audio_uploader.is_pending(object_name) or (tts_cache_enabled and await tts_audio_cache.exists(object_name))
+        if cache_span is not None:
+            cache_span.attributes["hit"] = is_cached
+    if is_cached:
+        logger.info({"label": "tts_cache_hit", "object_name": object_name})
+        return give_public_url(object_name)
+
+    audio_content, error_message = await process_outgoing_voice(message, input_language)
+    if audio_content is None:
+        return None, error_message
+    return await upload_voice(audio_content, object_name)
+
+
+async def upload_voice(audio_content, object_name):
+    """Uploads synthesized audio to OCI object storage, see process_outgoing_voice_url, and returns its public URL."""
+    upload = audio_uploader.submit(audio_content, object_name, on_uploaded=tts_audio_cache.add)
+    if audio_upload_wait or audio_uploader.is_saturated():
+        # Shielded so that a client disconnect does not abort an upload other requests may share
+        if not await asyncio.shield(upload):
+            return None, "Audio upload to object storage failed"
+    return give_public_url(object_name)
+
+
+async def process_outgoing_text_and_voice_url(english_text, input_language, gender='female'):
+    """
+    Translates the answer and converts the translation to speech.
+
+    When Bhashini chaining is enabled and the translation is not cached, the translation and the speech are
+    done by the same chained pipeline requests (one per paragraph, see synthesize_translated_speech), saving
+    a round trip. If they fail, or the text has markup which must not be spoken, they are done by separate
+    requests as in process_outgoing_text and process_outgoing_voice_url.
+
+    Returns:
+        The regional text (None on failure), the public URL of the audio (None on failure) and the error message.
+    """
+    if bhashini_chaining_enabled and input_language != 'en' and is_chainable_speech(english_text) \
+            and not await is_translation_cached(english_text, 'en', input_language):
+        try:
+            with track_stage("translation_tts"):
+                regional_text, audio_content, is_whole_text = await synthesize_translated_speech(english_text, input_language, gender)
+        except Exception as e:
+            logger.warning(f"Chained translation and TTS failed, falling back to separate requests: {e!r}")
+        else:
+            # A text translated in parts is not cached as the translation of the whole text
+            if translation_cache_enabled and is_whole_text:
+                await translation_cache.set(english_text, 'en', input_language, regional_text)
+            object_name = tts_audio_cache.object_name(regional_text, input_language, gender, tts_mapping[input_language])
+            audio_output_url, error_message = await upload_voice(audio_content, object_name)
+            return regional_text, audio_output_url, error_message
+
+    regional_text, error_message = await process_outgoing_text(english_text, input_language)
+    if regional_text is None:
+        return None, None, error_message
+    audio_output_url, error_message = await process_outgoing_voice_url(regional_text, input_language, gender)
+    return regional_text, audio_output_url, error_message
@@ -1,15 +1,37 @@
-import os.path
-from enum import Enum
+import asyncio
+from typing import List
 
-from fastapi import FastAPI, HTTPException, status, Header
+from fastapi import FastAPI, HTTPException, status, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
+from admission import UpstreamOverloadedError, check_admission, get_admission_stats
+from admission_middleware import AdmissionMiddleware
+from answer_cache import answer_cache
+from audio_transcoder import AudioInputTooLargeError
+from audio_uploader import audio_uploader
 from cloud_storage_oci import *
+from http_client import close_http_client, get_pool_stats
+from intent_classifier import intent_classifier
 from io_processing import *
+from metrics import generate_metrics, mark_worker_stopped, set_request_language
+from metrics_middleware import MetricsMiddleware
 from query_with_langchain import *
+from request_audio import audio_upload_max_bytes, get_audio_fetch_stats, get_request_audio, MissingAudioFieldError, UnsupportedAudioUploadError
+from resilience import get_resilience_stats
+from semantic_cache import semantic_cache
+from settings import get_settings, get_settings_stats, start_settings_watcher
+from streaming import stream_answer_events
+from telemetry_logger import telemetry_exporter
 from telemetry_middleware import TelemetryMiddleware
-from config_util import get_config_value
+from tracing import set_trace_attributes, trace_exporter
+from tracing_middleware import TracingMiddleware
+from translation_cache import translation_cache
+from translator import translation_batcher
+from tts_audio_cache import tts_audio_cache
 from utils import *
 
 api_description = """
@@ -68,8 +90,49 @@ class QueryModel(BaseModel):
     output: QueryOuputModel
 
 
+class BatchQueryModel(BaseModel):
+    queries: List[QueryModel]
+
+
+class BatchResultResponse(BaseModel):
+    output: OutputResponse = None
+    status_code: int = 200
+    error: str = None
+
+
+class ResponseForBatchQuery(BaseModel):
+    results: List[BatchResultResponse]
+
+
 # Telemetry API logs middleware
 app.add_middleware(TelemetryMiddleware)
+# Prometheus request and pipeline stage metrics, see /metrics
+app.add_middleware(MetricsMiddleware)
+# Deadline of API calls for admission control
+app.add_middleware(AdmissionMiddleware)
+# Request ID and tracing spans of API calls
+app.add_middleware(TracingMiddleware)
+
+
+@app.exception_handler(UpstreamOverloadedError)
+async def upstream_overloaded_exception_handler(request: Request, exc: UpstreamOverloadedError):
+    logger.warning({"label": "admission_rejected", "upstream": exc.upstream, "reason": exc.reason, "status_code": exc.status_code,
+                    "retry_after": exc.retry_after, "path": request.url.path})
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.on_event("startup")
+async def startup_event():
+    start_settings_watcher()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await audio_uploader.close()
+    await close_http_client()
+    await run_in_threadpool(telemetry_exporter.close)
+    await run_in_threadpool(trace_exporter.close)
+    mark_worker_stopped()
 
 
 @app.get("/")
@@ -99,36 +162,68 @@ def get_health() -> HealthCheck:
     return HealthCheck(status="OK")
 
 
-@app.post("/v1/query", tags=["Q&A over Document Store"])
-async def query(request: QueryModel) -> ResponseForQuery:
-    load_dotenv()
+@app.get("/stats", tags=["Health Check"], summary="Worker statistics", include_in_schema=True)
+async def get_stats():
+    """
+    Returns runtime statistics of the worker that served the request, e.g. the outbound HTTP connection pool usage
+    and cache hit/miss counters.
+    """
+    return {"http_pool": get_pool_stats(), "translation_cache": translation_cache.stats(),
+            "tts_audio_cache": tts_audio_cache.stats(), "answer_cache": answer_cache.stats(),
+            "semantic_cache": semantic_cache.stats(), "intent_classifier": intent_classifier.stats(),
+            "audio_upload": audio_uploader.stats(), "audio_fetch": get_audio_fetch_stats(),
+            "telemetry": telemetry_exporter.stats(), "settings": get_settings_stats(),
+            "tracing": trace_exporter.stats(), "translation_batching": translation_batcher.stats(),
+            "resilience": get_resilience_stats(), "admission": get_admission_stats()}
 
-    language_code_list = get_config_value('request', 'supported_lang_codes', None).split(",")
-    if language_code_list is None:
-        raise HTTPException(status_code=422, detail="supported_lang_codes not configured!")
 
-    language = request.input.language.strip().lower()
-    if language is None or language == "" or language not in language_code_list:
-        raise HTTPException(status_code=422, detail="Unsupported language code entered!")
+@app.get("/metrics", tags=["Health Check"], summary="Prometheus metrics", include_in_schema=True)
+async def get_metrics():
+    """
+    Returns request and per pipeline stage latency histograms, stage error counters and in-flight gauges in
+    the Prometheus text format, aggregated over all uvicorn workers.
+    """
+    return Response(content=await run_in_threadpool(generate_metrics), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
 
-    output_format_list = get_config_value('request', 'support_response_format', None).split(",")
-    if output_format_list is None:
-        raise HTTPException(status_code=422, detail="support_response_format not configured!")
+def validate_language_and_format(language, output_format, label_request=True):
+    """
+    Validates the language and output format of a query request.
+
+    Args:
+        label_request: Whether to set the language as the label of the request metrics and trace.
+
+    Returns:
+        The normalized language and output format.
+    """
+    settings = get_settings()
+    language = language.strip().lower()
+    if language is None or language == "" or language not in settings.supported_lang_codes:
+        raise HTTPException(status_code=422, detail="Unsupported language code entered!")
 
-    output_format = request.output.format.strip().lower()
+    output_format = output_format.strip().lower()
 
-    if output_format is None or output_format == "" or output_format not in output_format_list:
+    if output_format is None or output_format == "" or output_format not in settings.supported_response_formats:
         raise HTTPException(status_code=422, detail="Invalid output format!")
+    if label_request:
+        set_request_language(language)
+        set_trace_attributes(language=language, output_format=output_format)
+    return language, output_format
+
+
+def validate_query_request(request: QueryModel, index_id=None):
+    """
+    Validates the language, output format and text/audio inputs of a query request.
+
+    Returns:
+        The language, output format, query text and audio input of the request.
+    """
+    language, output_format = validate_language_and_format(request.input.language, request.output.format)
 
     audio_url = request.input.audio
     query_text = request.input.text
-    is_audio = False
-    text = None
-    regional_answer = None
-    answer = None
-    audio_output_url = None
-    source_text = None
-    logger.info({"label": "query", "query_text": query_text, "input_language": language, "output_format": output_format, "audio_url": audio_url})
+    log_context = {"index_id": index_id} if index_id is not None else {}
+    logger.info({"label": "query", "query_text": query_text, **log_context, "input_language": language, "output_format": output_format, "audio_url": audio_url})
 
     if query_text is None and audio_url is None:
         raise HTTPException(status_code=422, detail="Either 'text' or 'audio' should be present!")
@@ -138,36 +233,113 @@ async def query(request: QueryModel) -> ResponseForQuery:
         raise HTTPException(status_code=422, detail="Both 'text' and 'audio' cannot be taken as input! Either 'text' "
                                                     "or 'audio' is allowed.")
 
+    if query_text is None and not is_url(audio_url) and not is_base64(audio_url):
+        logger.error({**log_context, "query": query_text, "input_language": language, "output_format": output_format, "audio_url": audio_url, "status_code": status.HTTP_422_UNPROCESSABLE_ENTITY, "error_message": "Invalid audio input!"})
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid audio input!")
+
+    check_admission(get_query_upstreams(language, output_format, query_text is None, index_id is not None))
+    return language, output_format, query_text, audio_url
+
+
+def get_query_upstreams(language, output_format, is_audio_input, uses_retrieval):
+    """
+    Returns the upstream services a query needs, which are checked by admission control before the query is
+    processed so that it is rejected early, with a Retry-After header, when one of them is overloaded.
+    """
+    is_audio_output = is_audio_input or output_format == "audio"
+    upstreams = ["openai"]
+    if uses_retrieval:
+        upstreams.append("marqo")
+    if language != "en" or is_audio_output:
+        upstreams.append("bhashini")
+    if is_audio_output:
+        upstreams.append("oci")
+    return upstreams
+
+
+async def process_incoming_query(query_text, audio_url, language, output_format):
+    """
+    Converts the text or audio input of a query to English text.
+
+    Returns:
+        The regional query text, the English text (None on failure), whether the answer should be
+        returned as audio and the error message.
+    """
+    is_audio = False
     if query_text is not None:
-        text, error_message = process_incoming_text(query_text, language)
+        text, error_message = await process_incoming_text(query_text, language)
         if output_format == "audio":
             is_audio = True
     else:
-        if not is_url(audio_url) and not is_base64(audio_url):
-            logger.error({"query": query_text, "input_language": language, "output_format": output_format, "audio_url": audio_url, "status_code": status.HTTP_422_UNPROCESSABLE_ENTITY, "error_message": "Invalid audio input!"})
-            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid audio input!")
-        query_text, text, error_message = process_incoming_voice(audio_url, language)
+        try:
+            query_text, text, error_message = await process_incoming_voice(audio_url, language)
+        except AudioInputTooLargeError as e:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+        except MissingAudioFieldError as e:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
         is_audio = True
+    return query_text, text, is_audio, error_message
+
+
+async def process_uploaded_query_audio(request: Request, language):
+    """
+    Converts the audio uploaded in the body of the request to English text while it is being received.
+
+    Returns:
+        The regional query text, the English text (None on failure), whether the answer should be
+        returned as audio and the error message.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > audio_upload_max_bytes:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Audio input exceeds the maximum size of {audio_upload_max_bytes} bytes")
+    try:
+        audio = get_request_audio(request)
+    except UnsupportedAudioUploadError as e:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+    return await process_incoming_query(None, audio, language, "audio")
+
+
+@app.post("/v1/query", tags=["Q&A over Document Store"])
+async def query(request: QueryModel) -> ResponseForQuery:
+    language, output_format, query_text, audio_url = validate_query_request(request)
+    query_text, text, is_audio, error_message = await process_incoming_query(query_text, audio_url, language, output_format)
+    return await answer_query(query_text, text, is_audio, error_message, language, output_format, audio_url)
+
+
+@app.post("/v1/query/audio", tags=["Q&A over Document Store"], include_in_schema=True)
+async def query_audio(request: Request, language: str = Query(...), output_format: str = Query("audio", alias="format")) -> ResponseForQuery:
+    """
+    Variant of `/v1/query` for voice input sent as a raw `audio/*` body, or as the `audio` field of a
+    `multipart/form-data` body, instead of base64 encoded in JSON. The audio is decoded while it is received.
+    """
+    language, output_format = validate_language_and_format(language, output_format)
+    check_admission(get_query_upstreams(language, output_format, True, False))
+    logger.info({"label": "query_audio", "input_language": language, "output_format": output_format, "content_type": request.headers.get("content-type")})
+    query_text, text, is_audio, error_message = await process_uploaded_query_audio(request, language)
+    return await answer_query(query_text, text, is_audio, error_message, language, output_format)
+
+
+async def answer_query(query_text, text, is_audio, error_message, language, output_format, audio_url=None) -> ResponseForQuery:
+    regional_answer = None
+    answer = None
+    audio_output_url = None
+    source_text = None
 
     if text is not None:
-        answer, source_text, paraphrased_query, error_message, status_code = querying_with_langchain_gpt4(text)
+        answer, source_text, paraphrased_query, error_message, status_code = await querying_with_langchain_gpt4(text)
         if answer is not None:
-            regional_answer, error_message = process_outgoing_text(answer, language)
-            if regional_answer is not None:
-                if is_audio:
-                    output_file, error_message = process_outgoing_voice(regional_answer, language)
-                    if output_file is not None:
-                        upload_file_object(output_file.name)
-                        audio_output_url, error_message = give_public_url(output_file.name)
-                        logger.debug(f"Audio Ouput URL ===> {audio_output_url}")
-                        output_file.close()
-                        os.remove(output_file.name)
-                    else:
-                        status_code = 503
+            if is_audio:
+                regional_answer, audio_output_url, error_message = await process_outgoing_text_and_voice_url(answer, language)
+                if audio_output_url is not None:
+                    logger.debug(f"Audio Ouput URL ===> {audio_output_url}")
                 else:
-                    audio_output_url = None
+                    status_code = 503
             else:
-                status_code = 503
+                regional_answer, error_message = await process_outgoing_text(answer, language)
+                audio_output_url = None
+                if regional_answer is None:
+                    status_code = 503
     else:
         status_code = 503
 
@@ -182,75 +354,46 @@ async def query(request: QueryModel) -> ResponseForQuery:
 
 @app.post("/v1/query_rstory", tags=["Q&A over Document Store"], include_in_schema=True)
 async def query_rstory(request: QueryModel, x_request_id: str = Header(None, alias="X-Request-ID")) -> ResponseForQuery:
-    load_dotenv()
-    index_id = get_config_value('database', 'index_name', None)
+    index_id = get_settings().index_name
+    language, output_format, query_text, audio_url = validate_query_request(request, index_id)
+    query_text, text, is_audio, error_message = await process_incoming_query(query_text, audio_url, language, output_format)
+    return await answer_rstory_query(index_id, query_text, text, is_audio, error_message, language, output_format, audio_url, x_request_id)
 
-    language_code_list = get_config_value('request', 'supported_lang_codes', None).split(",")
-    if language_code_list is None:
-        raise HTTPException(status_code=422, detail="supported_lang_codes not configured!")
-
-    language = request.input.language.strip().lower()
-    if language is None or language == "" or language not in language_code_list:
-        raise HTTPException(status_code=422, detail="Unsupported language code entered!")
 
-    output_format_list = get_config_value('request', 'support_response_format', None).split(",")
-    if output_format_list is None:
-        raise HTTPException(status_code=422, detail="support_response_format not configured!")
-
-    output_format = request.output.format.strip().lower()
-
-    if output_format is None or output_format == "" or output_format not in output_format_list:
-        raise HTTPException(status_code=422, detail="Invalid output format!")
+@app.post("/v1/query_rstory/audio", tags=["Q&A over Document Store"], include_in_schema=True)
+async def query_rstory_audio(request: Request, language: str = Query(...), output_format: str = Query("audio", alias="format"),
+                             x_request_id: str = Header(None, alias="X-Request-ID")) -> ResponseForQuery:
+    """
+    Variant of `/v1/query_rstory` for voice input sent as a raw `audio/*` body, or as the `audio` field of a
+    `multipart/form-data` body, instead of base64 encoded in JSON. The audio is decoded while it is received.
+    """
+    index_id = get_settings().index_name
+    language, output_format = validate_language_and_format(language, output_format)
+    check_admission(get_query_upstreams(language, output_format, True, True))
+    logger.info({"label": "query_rstory_audio", "index_id": index_id, "input_language": language, "output_format": output_format, "content_type": request.headers.get("content-type")})
+    query_text, text, is_audio, error_message = await process_uploaded_query_audio(request, language)
+    return await answer_rstory_query(index_id, query_text, text, is_audio, error_message, language, output_format, None, x_request_id)
 
-    audio_url = request.input.audio
-    query_text = request.input.text
 
-    is_audio = False
-    text = None
+async def answer_rstory_query(index_id, query_text, text, is_audio, error_message, language, output_format, audio_url, x_request_id) -> ResponseForQuery:
     regional_answer = None
     answer = None
     audio_output_url = None
-    logger.info({"label": "query", "query_text": query_text, "index_id": index_id, "input_language": language, "output_format": output_format, "audio_url": audio_url})
-
-    if query_text is None and audio_url is None:
-        raise HTTPException(status_code=422, detail="Either 'text' or 'audio' should be present!")
-    elif (query_text is None or query_text == "") and (audio_url is None or audio_url == ""):
-        raise HTTPException(status_code=422, detail="Either 'text' or 'audio' should be present!")
-    elif query_text is not None and audio_url is not None and query_text != "" and audio_url != "":
-        raise HTTPException(status_code=422, detail="Both 'text' and 'audio' cannot be taken as input! Either 'text' "
-                                                    "or 'audio' is allowed.")
-
-    if query_text is not None:
-        text, error_message = process_incoming_text(query_text, language)
-        if output_format == "audio":
-            is_audio = True
-    else:
-        if not is_url(audio_url) and not is_base64(audio_url):
-            logger.error(
-                {"index_id": index_id, "query": query_text, "input_language": language, "output_format": output_format, "audio_url": audio_url, "status_code": status.HTTP_422_UNPROCESSABLE_ENTITY, "error_message": "Invalid audio input!"})
-            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid audio input!")
-        query_text, text, error_message = process_incoming_voice(audio_url, language)
-        is_audio = True
 
     if text is not None:
-        answer, error_message, status_code = query_rstory_gpt3(index_id, text)
+        answer, error_message, status_code = await query_rstory_gpt3(index_id, text)
         if len(answer) != 0:
-            regional_answer, error_message = process_outgoing_text(answer, language)
-            if regional_answer is not None:
-                if is_audio:
-                    output_file, error_message = process_outgoing_voice(regional_answer, language)
-                    if output_file is not None:
-                        upload_file_object(output_file.name)
-                        audio_output_url, error_message = give_public_url(output_file.name)
-                        logger.info(f"Audio Ouput URL ===> {audio_output_url}")
-                        output_file.close()
-                        os.remove(output_file.name)
-                    else:
-                        status_code = 503
+            if is_audio:
+                regional_answer, audio_output_url, error_message = await process_outgoing_text_and_voice_url(answer, language)
+                if audio_output_url is not None:
+                    logger.info(f"Audio Ouput URL ===> {audio_output_url}")
                 else:
-                    audio_output_url = ""
+                    status_code = 503
             else:
-                status_code = 503
+                regional_answer, error_message = await process_outgoing_text(answer, language)
+                audio_output_url = ""
+                if regional_answer is None:
+                    status_code = 503
     else:
         status_code = 503
 
@@ -261,3 +404,153 @@ async def query_rstory(request: QueryModel, x_request_id: str = Header(None, ali
     response = ResponseForQuery(output=OutputResponse(text=regional_answer, audio=audio_output_url, language=language, format=output_format.lower()))
     logger.info({"x_request_id": x_request_id, "query": query_text, "text": text, "response": response})
     return response
+
+
+@app.post("/v1/query_rstory/batch", tags=["Q&A over Document Store"], include_in_schema=True)
+async def query_rstory_batch(request: BatchQueryModel, x_request_id: str = Header(None, alias="X-Request-ID")) -> ResponseForBatchQuery:
+    """
+    Batch variant of `/v1/query_rstory` for text queries. The translations of the queries, and of their answers,
+    in the same language are sent to Bhashini together, and the stories are generated concurrently (at most
+    `batch_concurrency` at a time, once per distinct English query). The results are returned in the order of
+    the queries; a query which fails has the status code and error in its result and does not fail the others.
+    """
+    settings = get_settings()
+    if len(request.queries) == 0:
+        raise HTTPException(status_code=422, detail="At least one query should be present!")
+    if len(request.queries) > settings.batch_max_queries:
+        raise HTTPException(status_code=422, detail=f"At most {settings.batch_max_queries} queries are allowed in a batch!")
+
+    index_id = settings.index_name
+    results = [None] * len(request.queries)
+    items = {}
+    for position, batch_query in enumerate(request.queries):
+        try:
+            language, output_format = validate_language_and_format(batch_query.input.language or "", batch_query.output.format or "",
+                                                                   label_request=False)
+            if batch_query.input.text is None or batch_query.input.text == "" or batch_query.input.audio:
+                raise HTTPException(status_code=422, detail="Only 'text' queries are supported in a batch!")
+        except HTTPException as e:
+            results[position] = BatchResultResponse(status_code=e.status_code, error=e.detail)
+            continue
+        items[position] = {"query": batch_query.input.text, "language": language, "format": output_format}
+
+    check_admission(dict.fromkeys(upstream for item in items.values()
+                                  for upstream in get_query_upstreams(item["language"], item["format"], False, True)))
+    languages = {item["language"] for item in items.values()}
+    set_request_language(languages.pop() if len(languages) == 1 else "mixed")
+    set_trace_attributes(queries=len(request.queries))
+    logger.info({"x_request_id": x_request_id, "label": "query_rstory_batch", "index_id": index_id, "queries": len(request.queries), "valid_queries": len(items)})
+
+    def fail(position, status_code, error_message):
+        results[position] = BatchResultResponse(status_code=status_code, error=error_message)
+        del items[position]
+
+    def fail_with_exception(position, exception):
+        # An overloaded upstream is unavailable for this query only, anything else is a bug
+        if isinstance(exception, UpstreamOverloadedError):
+            fail(position, 503, str(exception))
+        else:
+            logger.error({"x_request_id": x_request_id, "label": "query_rstory_batch", "position": position, "error": repr(exception)},
+                         exc_info=exception)
+            fail(position, 500, "Internal server error")
+
+    async def translate_items(translate_batch, source_key, target_key):
+        # One batch per language, the languages being translated concurrently
+        positions_by_language = {}
+        for position, item in items.items():
+            positions_by_language.setdefault(item["language"], []).append(position)
+        translations = await asyncio.gather(*[translate_batch([items[position][source_key] for position in positions], language)
+                                              for language, positions in positions_by_language.items()], return_exceptions=True)
+        for positions, translation in zip(positions_by_language.values(), translations):
+            if isinstance(translation, Exception):
+                for position in positions:
+                    fail_with_exception(position, translation)
+                continue
+            texts, error_message = translation
+            for index, position in enumerate(positions):
+                if texts is None:
+                    fail(position, 503, error_message)
+                else:
+                    items[position][target_key] = texts[index]
+
+    semaphore = asyncio.Semaphore(settings.batch_concurrency)
+
+    async def generate_story(text):
+        async with semaphore:
+            return await query_rstory_gpt3(index_id, text)
+
+    async def generate_audio(regional_answer, language):
+        async with semaphore:
+            return await process_outgoing_voice_url(regional_answer, language)
+
+    await translate_items(process_incoming_text_batch, "query", "text")
+
+    # The same query in several languages is usually the same English text, its story is generated once
+    texts = list(dict.fromkeys(item["text"] for item in items.values()))
+    stories = dict(zip(texts, await asyncio.gather(*[generate_story(text) for text in texts], return_exceptions=True)))
+    for position, item in list(items.items()):
+        story = stories[item["text"]]
+        if isinstance(story, Exception):
+            fail_with_exception(position, story)
+            continue
+        answer, error_message, status_code = story
+        if status_code != 200 or len(answer) == 0:
+            fail(position, status_code if status_code != 200 else 503, error_message)
+        else:
+            item["answer"] = answer
+
+    await translate_items(process_outgoing_text_batch, "answer", "regional_answer")
+
+    audio_positions = [position for position, item in items.items() if item["format"] == "audio"]
+    audio_outputs = await asyncio.gather(*[generate_audio(items[position]["regional_answer"], items[position]["language"])
+                                           for position in audio_positions], return_exceptions=True)
+    for position, audio_output in zip(audio_positions, audio_outputs):
+        if isinstance(audio_output, Exception):
+            fail_with_exception(position, audio_output)
+            continue
+        audio_output_url, error_message = audio_output
+        if audio_output_url is None:
+            fail(position, 503, error_message)
+        else:
+            items[position]["audio"] = audio_output_url
+
+    for position, item in items.items():
+        results[position] = BatchResultResponse(output=OutputResponse(text=item["regional_answer"], audio=item.get("audio", ""),
+                                                                      language=item["language"], format=item["format"]))
+    failed = [{"position": position, "status_code": result.status_code, "error_message": result.error}
+              for position, result in enumerate(results) if result.status_code != 200]
+    if failed:
+        logger.error({"x_request_id": x_request_id, "label": "query_rstory_batch", "index_id": index_id, "failed": failed})
+    return ResponseForBatchQuery(results=results)
+
+
+@app.post("/v1/query/stream", tags=["Q&A over Document Store"], include_in_schema=True)
+async def query_stream(request: QueryModel):
+    """
+    Streaming variant of `/v1/query`. The answer is returned as Server-Sent Events while the LLM generates it.
+    """
+    language, output_format, query_text, audio_url = validate_query_request(request)
+    query_text, text, is_audio, error_message = await process_incoming_query(query_text, audio_url, language, output_format)
+    if text is None:
+        logger.error({"query": query_text, "input_language": language, "output_format": output_format, "audio_url": audio_url, "status_code": 503, "error_message": error_message})
+        raise HTTPException(status_code=503, detail=error_message)
+
+    events = stream_answer_events(stream_querying_with_langchain_gpt4(text), language, is_audio)
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/v1/query_rstory/stream", tags=["Q&A over Document Store"], include_in_schema=True)
+async def query_rstory_stream(request: QueryModel, x_request_id: str = Header(None, alias="X-Request-ID")):
+    """
+    Streaming variant of `/v1/query_rstory`. The story is returned as Server-Sent Events while the LLM generates it.
+    """
+    index_id = get_settings().index_name
+    language, output_format, query_text, audio_url = validate_query_request(request, index_id)
+    query_text, text, is_audio, error_message = await process_incoming_query(query_text, audio_url, language, output_format)
+    if text is None:
+        logger.error({"index_id": index_id, "query": query_text, "input_language": language, "output_format": output_format, "audio_url": audio_url, "status_code": 503, "error_message": error_message})
+        raise HTTPException(status_code=503, detail=error_message)
+
+    logger.info({"x_request_id": x_request_id, "query": query_text, "text": text, "label": "query_rstory_stream"})
+    events = stream_answer_events(stream_query_rstory_gpt3(index_id, text), language, is_audio)
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+from tracing import span
+
+# Set by script.sh: the uvicorn workers write their samples to files in this directory and /metrics
+# aggregates them, so that a scrape covers all workers and not just the one serving it
+multiprocess_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+request_duration = Histogram("story_api_request_duration_seconds", "Duration of API requests",
+                             ["endpoint", "language", "status"], buckets=LATENCY_BUCKETS)
+requests_in_flight = Gauge("story_api_requests_in_flight", "API requests being processed",
+                           ["endpoint"], multiprocess_mode="livesum")
+stage_duration = Histogram("story_api_stage_duration_seconds", "Duration of a pipeline stage of a request",
+                           ["stage", "endpoint", "language"], buckets=LATENCY_BUCKETS)
+stage_errors = Counter("story_api_stage_errors_total", "Pipeline stages that failed",
+                       ["stage", "endpoint", "language"])
+stages_in_flight = Gauge("story_api_stage_in_flight", "Pipeline stages being processed",
+                         ["stage", "endpoint"], multiprocess_mode="livesum")
+translation_batch_size = Histogram("story_api_translation_batch_size", "Texts sent in one Bhashini request by the translation micro-batcher",
+                                   buckets=(1, 2, 3, 4, 6, 8, 12, 16, 25, 50, 100))
+translation_batch_queue_delay = Histogram("story_api_translation_batch_queue_delay_seconds",
+                                          "Time a translation waited for its batch to be sent",
+                                          buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+circuit_breaker_state = Gauge("story_api_circuit_breaker_state", "State of the circuit breaker of an upstream: 0 closed, 1 half open, 2 open",
+                              ["upstream"], multiprocess_mode="livemax")
+upstream_fallbacks = Counter("story_api_upstream_fallbacks_total", "Upstream calls answered by the fallback upstream",
+                             ["upstream", "reason"])
+upstream_hedges = Counter("story_api_upstream_hedges_total", "Hedged fallback calls started because an upstream was slow",
+                          ["upstream"])
+upstream_in_flight = Gauge("story_api_upstream_in_flight", "Calls in flight to an upstream, see admission control",
+                           ["upstream"], multiprocess_mode="livesum")
+upstream_queue_depth = Gauge("story_api_upstream_queue_depth", "Calls waiting for a free slot of an upstream",
+                             ["upstream"], multiprocess_mode="livesum")
+admission_rejections = Counter("story_api_admission_rejections_total", "Upstream calls rejected by admission control",
+                               ["upstream", "reason"])
+
+# Labels of the request being processed, set by MetricsMiddleware. The dict is shared with the tasks the
+# request spawns, so the language set once the request is validated is seen by all of them.
+request_labels: ContextVar = ContextVar("request_labels", default=None)
+
+
+def get_request_labels():
+    labels = request_labels.get()
+    return labels if labels is not None else {"endpoint": "", "language": ""}
+
+
+def set_request_language(language):
+    labels = request_labels.get()
+    if labels is not None:
+        labels["language"] = language
+
+
+class StageResult:
+    def __init__(self):
+        self.failed = False
+
+
+@contextmanager
+def track_stage(stage):
+    """
+    Measures a pipeline stage of the current request and records it as a tracing span. A stage fails when it
+    raises, or when the caller sets ``failed`` on the yielded result, e.g. for functions reporting errors as
+    return values. Cancelled stages, such as a discarded speculative retrieval, are timed but not counted as
+    failed.
+    """
+    labels = get_request_labels()
+    in_flight = stages_in_flight.labels(stage, labels["endpoint"])
+    in_flight.inc()
+    result = StageResult()
+    start_time = time.perf_counter()
+    try:
+        with span(stage) as stage_span:
+            yield result
+            if result.failed and stage_span is not None:
+                stage_span.error = "failed"
+    except (asyncio.CancelledError, GeneratorExit):
+        raise
+    except BaseException:
+        result.failed = True
+        raise
+    finally:
+        in_flight.dec()
+        stage_duration.labels(stage, labels["endpoint"], labels["language"]).observe(time.perf_counter() - start_time)
+        if result.failed:
+            stage_errors.labels(stage, labels["endpoint"], labels["language"]).inc()
+
+
+def generate_metrics():
+    """Renders the metrics of all workers in the Prometheus text format."""
+    if multiprocess_dir:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_worker_stopped():
+    """Drops the in-flight gauges of this worker from the aggregate, e.g. on shutdown."""
+    if multiprocess_dir:
+        multiprocess.mark_process_dead(os.getpid())
+
@@ -0,0 +1,49 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from metrics import request_duration, request_labels, requests_in_flight
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware measuring the duration and the number of in-flight API requests.
+
+    It also sets the labels of the request (endpoint, and the language once the endpoint has validated it)
+    used by the stage metrics of the request. Paths which are not routes of the app are labelled "unmatched",
+    which keeps the number of label values bounded.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.endpoints = None
+
+    def get_endpoint(self, scope):
+        if self.endpoints is None:
+            self.endpoints = {route.path for route in scope["app"].routes}
+        return scope["path"] if scope["path"] in self.endpoints else "unmatched"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+        labels = {"endpoint": self.get_endpoint(scope), "language": ""}
+        token = request_labels.set(labels)
+        in_flight = requests_in_flight.labels(labels["endpoint"])
+        in_flight.inc()
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            request_labels.reset(token)
+            request_duration.labels(labels["endpoint"], labels["language"], str(status_code)).observe(time.perf_counter() - start_time)
@@ -1,39 +1,88 @@
+import asyncio
+import json
 import os
 from typing import (
     Any,
     List,
     Tuple
 )
-from openai import AzureOpenAI, RateLimitError, APIError, InternalServerError
+from starlette.concurrency import run_in_threadpool
+from openai import AsyncAzureOpenAI, RateLimitError, APIError, InternalServerError
 # from openai.types import ModerationCreateResponse
-import marqo
 from langchain.docstore.document import Document
-from langchain.vectorstores.marqo import Marqo
 from dotenv import load_dotenv
+from admission import UpstreamOverloadedError, upstream_slot
+from answer_cache import answer_cache, answer_cache_enabled
+from http_client import http_client
+from intent_classifier import intent_classifier, intent_classifier_enabled
 from logger import logger
+from metrics import track_stage
+from semantic_cache import semantic_cache, semantic_cache_enabled
+from settings import get_settings
+from tracing import get_trace_headers, span
 from config_util import get_config_value
 
 load_dotenv()
-client = AzureOpenAI(
+client = AsyncAzureOpenAI(
             azure_endpoint=os.environ["OPENAI_API_BASE"],
             api_key=os.environ["OPENAI_API_KEY"],
             api_version=os.environ["OPENAI_API_VERSION"]
         )
 marqo_url = get_config_value("database", "MARQO_URL", None)
-marqoClient = marqo.Client(url=marqo_url)
 
-def querying_with_langchain_gpt4(query):
+
+async def marqo_similarity_search_with_score(index_id, query, k=4, searchable_attributes=None) -> List[Tuple[Document, Any]]:
+    """Searches the Marqo index over its REST API and returns the hits as (Document, score) pairs.
+
+    This mirrors langchain's ``Marqo.similarity_search_with_score`` but uses the shared async
+    HTTP client instead of the blocking marqo client.
+    """
+    payload = {
+        "q": query,
+        "limit": k,
+        "searchableAttributes": searchable_attributes
+    }
+    with track_stage("marqo_search"):
+        async with upstream_slot("marqo"):
+            response = await http_client.post(f"{marqo_url.rstrip('/')}/indexes/{index_id}/search", json=payload,
+                                              headers=get_trace_headers())
+        response.raise_for_status()
+    documents: List[Tuple[Document, Any]] = []
+    for res in response.json()["hits"]:
+        metadata = json.loads(res.get("metadata", "{}"))
+        documents.append((Document(page_content=res["text"], metadata=metadata), res["_score"]))
+    return documents
+
+
+async def get_marqo_index_fingerprint(index_id):
+    """Returns the document and vector counts of the Marqo index, or None if they can not be fetched."""
+    try:
+        with span("marqo_index_stats"):
+            response = await http_client.get(f"{marqo_url.rstrip('/')}/indexes/{index_id}/stats", headers=get_trace_headers())
+        response.raise_for_status()
+        stats = response.json()
+        return stats.get("numberOfDocuments"), stats.get("numberOfVectors")
+    except Exception as e:
+        logger.warning(f"Unable to fetch stats of index {index_id}: {e}")
+        return None
+
+
+async def querying_with_langchain_gpt4(query):
     try:
         logger.debug(f"Query ===> {query}")
-        system_rules = get_config_value("llm", "story_prompt", "")
-        gpt_model = get_config_value("llm", "gpt_model", None)
-        res = client.chat.completions.create(
-            model=gpt_model,
-            messages=[
-                {"role": "system", "content": system_rules},
-                {"role": "user", "content": query},
-            ],
-        )
+        settings = get_settings()
+        system_rules = settings.story_prompt
+        gpt_model = settings.gpt_model
+        with track_stage("llm"):
+            async with upstream_slot("openai"):
+                res = await client.chat.completions.create(
+                    model=gpt_model,
+                    messages=[
+                        {"role": "system", "content": system_rules},
+                        {"role": "user", "content": query},
+                    ],
+                    extra_headers=get_trace_headers(),
+                )
         message = res.choices[0].message.model_dump()
         response = message["content"]
         logger.info({"label": "openai_response", "response": response})
@@ -42,6 +91,9 @@ def querying_with_langchain_gpt4(query):
         #     return None, None, None, error_message, 500
         # else:
         return response, "", "", None, 200
+    except UpstreamOverloadedError as e:
+        error_message = str(e)
+        status_code = e.status_code
     except RateLimitError as e:
         error_message = f"OpenAI API request exceeded rate limit: {e}"
         status_code = 500
@@ -77,87 +129,246 @@ def querying_with_langchain_gpt4(query):
 #         logger.error(f"Error moderating text: {error_message}")
 #         return None, error_message
 
-def query_rstory_gpt3(index_id, query):
-    load_dotenv()
+NOT_ENOUGH_INFORMATION_ANSWER = "I'm sorry, but I don't have enough information to provide a specific answer for your question. Please provide more information or context about what you are referring to."
+
+
+async def query_rstory_gpt3(index_id, query):
     logger.debug(f"Query ===> {query}")
-    gpt_model = get_config_value("llm", "gpt_model", None)
+    settings = get_settings()
+    gpt_model = settings.gpt_model
 
-    intent_response = "No"
-    enable_bot_intent = get_config_value("llm", "enable_bot_intent", None)
+    cached_answer, cache_context = await lookup_cached_answer(index_id, query, settings)
+    if cached_answer is not None:
+        return cached_answer, None, 200
 
-    if enable_bot_intent.lower() == "true":
-        # intent recognition using AI
-        intent_system_rules = get_config_value("llm", "intent_prompt", None)
-        logger.debug(f"intent_system_rules: {intent_system_rules}")
-        if intent_system_rules:
-            intent_res = client.chat.completions.create(
+    try:
+        system_rules, label = await get_rstory_system_rules(index_id, query, settings)
+        if system_rules is None:
+            return NOT_ENOUGH_INFORMATION_ANSWER, None, 200
+        with track_stage("llm"):
+            async with upstream_slot("openai"):
+                res = await client.chat.completions.create(
+                    model=gpt_model,
+                    messages=[
+                        {"role": "system", "content": system_rules},
+                        {"role": "user", "content": query},
+                    ],
+                    extra_headers=get_trace_headers(),
+                )
+        message = res.choices[0].message.model_dump()
+        response = message["content"]
+        logger.info({"label": label, "response": response})
+        # response, error_message = moderate_text(response)
+        # if error_message is not None:
+        #     return "", error_message, 500
+        cache_answer(cache_context, response)
+        return response, None, 200
+    except UpstreamOverloadedError as e:
+        error_message = str(e)
+        status_code = e.status_code
+    except RateLimitError as e:
+        error_message = f"OpenAI API request exceeded rate limit: {e}"
+        status_code = 500
+    except (APIError, InternalServerError):
+        error_message = "Server is overloaded or unable to answer your request at the moment. Please try again later"
+        status_code = 503
+    except Exception as e:
+        error_message = str(e.__context__) + " and " + e.__str__()
+        status_code = 500
+    return "", error_message, status_code
+
+
+async def stream_query_rstory_gpt3(index_id, query):
+    """
+    Streaming variant of query_rstory_gpt3: yields the English answer in chunks as the LLM generates it.
+
+    Cached answers and the fallback answer are yielded as a single chunk. Errors are raised to the caller.
+    """
+    logger.debug(f"Query ===> {query}")
+    settings = get_settings()
+    gpt_model = settings.gpt_model
+
+    cached_answer, cache_context = await lookup_cached_answer(index_id, query, settings)
+    if cached_answer is not None:
+        yield cached_answer
+        return
+
+    system_rules, label = await get_rstory_system_rules(index_id, query, settings)
+    if system_rules is None:
+        yield NOT_ENOUGH_INFORMATION_ANSWER
+        return
+    chunks = []
+    async for chunk in stream_chat_completion(gpt_model, system_rules, query):
+        chunks.append(chunk)
+        yield chunk
+    response = "".join(chunks)
+    logger.info({"label": label, "response": response})
+    cache_answer(cache_context, response)
+
+
+async def stream_querying_with_langchain_gpt4(query):
+    """Streaming variant of querying_with_langchain_gpt4: yields the answer in chunks as the LLM generates it."""
+    logger.debug(f"Query ===> {query}")
+    settings = get_settings()
+    system_rules = settings.story_prompt
+    gpt_model = settings.gpt_model
+    chunks = []
+    async for chunk in stream_chat_completion(gpt_model, system_rules, query):
+        chunks.append(chunk)
+        yield chunk
+    logger.info({"label": "openai_response", "response": "".join(chunks)})
+
+
+async def stream_chat_completion(gpt_model, system_rules, query):
+    # Timed until the last chunk is received, including the time the consumer takes between chunks
+    with track_stage("llm"):
+        async with upstream_slot("openai"):
+            stream = await client.chat.completions.create(
                 model=gpt_model,
                 messages=[
-                    {"role": "system", "content": intent_system_rules},
-                    {"role": "user", "content": query}
+                    {"role": "system", "content": system_rules},
+                    {"role": "user", "content": query},
                 ],
+                stream=True,
+                extra_headers=get_trace_headers(),
             )
-            intent_message = intent_res.choices[0].message.model_dump()
-            intent_response = intent_message["content"]
-            logger.info({"label": "openai_intent_response", "intent_response": intent_response})
+            # The slot is held until the whole answer is generated
+            async for chunk in stream:
+                # Azure sends content filter results in chunks without choices
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+
+async def lookup_cached_answer(index_id, query, settings):
+    """
+    Looks up the answer of the query in the exact and semantic answer caches.
+
+    Returns:
+        The cached answer or None, and the cache context to pass to cache_answer once the answer is computed.
+    """
+    answer_cache_key = None
+    query_embedding = None
+    answer_namespace = f"{index_id}:{settings.prompt_version}:{settings.gpt_model}"
+    if answer_cache_enabled or semantic_cache_enabled:
+        if answer_cache.needs_index_check(index_id):
+            if answer_cache.update_index_fingerprint(index_id, await get_marqo_index_fingerprint(index_id)):
+                semantic_cache.clear()
+    if answer_cache_enabled:
+        with span("answer_cache_lookup") as cache_span:
+            answer_cache_key = answer_cache.make_key(query, answer_namespace)
+            cached_answer = answer_cache.get(answer_cache_key)
+            if cache_span is not None:
+                cache_span.attributes["hit"] = cached_answer is not None
+        if cached_answer is not None:
+            logger.info({"label": "answer_cache_hit", "query": query})
+            return cached_answer, None
+    if semantic_cache_enabled:
+        with span("semantic_cache_lookup") as cache_span:
+            try:
+                query_embedding = await semantic_cache.embed(query)
+                cached_answer = await run_in_threadpool(semantic_cache.lookup, query_embedding, answer_namespace)
+            except Exception as e:
+                # The cache is optional, e.g. a model which cannot be loaded only disables it for this query
+                logger.error(f"Exception looking up the semantic cache: {e}", exc_info=True)
+                query_embedding = None
+                cached_answer = None
+            if cache_span is not None:
+                cache_span.attributes["hit"] = cached_answer is not None
+        if cached_answer is not None:
+            logger.info({"label": "semantic_cache_hit", "query": query})
+            return cached_answer, None
+    return None, (answer_cache_key, query_embedding, answer_namespace)
+
+
+async def get_rstory_system_rules(index_id, query, settings):
+    """
+    Prepares the system prompt of the rstory flow: the bot persona prompt when the query is about the bot,
+    else the story prompt filled with the contexts retrieved from Marqo.
+
+    The intent is decided by the local intent classifier when it is confident. Otherwise the LLM is asked;
+    retrieval does not depend on the intent, so it runs speculatively while the intent is detected and its
+    result is discarded when the query turns out to be about the bot.
+
+    Returns:
+        The system rules (None when no relevant contexts were found) and the log label of the answer.
+    """
+    intent_system_rules = None
+    if settings.enable_bot_intent:
+        intent_system_rules = settings.intent_prompt
+        logger.debug(f"intent_system_rules: {intent_system_rules}")
+    if not intent_system_rules:
+        return await get_rstory_context_system_rules(index_id, query, settings)
+
+    if intent_classifier_enabled:
+        with track_stage("intent"):
+            intent_response, confidence = intent_classifier.classify(query)
+        logger.info({"label": "local_intent_response", "intent_response": intent_response, "confidence": confidence})
+        if intent_response is not None:
+            if intent_response.lower() == "yes":
+                return get_bot_system_rules(settings)
+            return await get_rstory_context_system_rules(index_id, query, settings)
+
+    retrieval = asyncio.create_task(get_rstory_context_system_rules(index_id, query, settings))
+    # Mark a failed retrieval as handled when its result is discarded
+    retrieval.add_done_callback(lambda task: task.cancelled() or task.exception())
+    try:
+        intent_response = await get_bot_intent(intent_system_rules, query, settings.gpt_model)
+    except BaseException:
+        retrieval.cancel()
+        raise
 
     if intent_response.lower() == "yes":
-        system_rules = get_config_value("llm", "bot_prompt", "")
-        logger.debug("==== System Rules ====")
-        logger.debug(f"System Rules : {system_rules}")
-        res = client.chat.completions.create(
-            model=gpt_model,
-            messages=[
-                {"role": "system", "content": system_rules},
-                {"role": "user", "content": query}
-            ],
-        )
-        message = res.choices[0].message.model_dump()
-        response = message["content"]
-        logger.info({"label": "openai_bot_response", "bot_response": response})
-        return response, None, 200
-    else:
-        try:
-            search_index = Marqo(marqoClient, index_id, searchable_attributes=["text"])
-            top_docs_to_fetch = get_config_value("database", "top_docs_to_fetch", None)
-            documents = search_index.similarity_search_with_score(query, k=20)
-            logger.debug(f"Marqo documents : {str(documents)}")
-            min_score = get_config_value("database", "docs_min_score", None)
-            filtered_document = get_score_filtered_documents(documents, float(min_score))
-            filtered_document = filtered_document[:int(top_docs_to_fetch)]
-            logger.info(f"Score filtered documents : {str(filtered_document)}")
-            contexts = get_formatted_documents(filtered_document)
-            if not documents or not contexts:
-                return "I'm sorry, but I don't have enough information to provide a specific answer for your question. Please provide more information or context about what you are referring to.", None, 200
-            system_rules = get_config_value("llm", "r_story_prompt", "")
-            system_rules = system_rules.format(contexts=contexts)
-            logger.info("==== System Rules ====")
-            logger.debug(system_rules)
-
-            res = client.chat.completions.create(
+        retrieval.cancel()
+        return get_bot_system_rules(settings)
+    return await retrieval
+
+
+def get_bot_system_rules(settings):
+    system_rules = settings.bot_prompt
+    logger.debug("==== System Rules ====")
+    logger.debug(f"System Rules : {system_rules}")
+    return system_rules, "openai_bot_response"
+
+
+async def get_bot_intent(intent_system_rules, query, gpt_model):
+    # intent recognition using AI
+    with track_stage("intent"):
+        async with upstream_slot("openai"):
+            intent_res = await client.chat.completions.create(
                 model=gpt_model,
                 messages=[
-                    {"role": "system", "content": system_rules},
-                    {"role": "user", "content": query},
+                    {"role": "system", "content": intent_system_rules},
+                    {"role": "user", "content": query}
                 ],
+                extra_headers=get_trace_headers(),
             )
-            message = res.choices[0].message.model_dump()
-            response = message["content"]
-            logger.info({"label": "openai_response", "response": response})
-            # response, error_message = moderate_text(response)
-            # if error_message is not None:
-            #     return "", error_message, 500
-            return response, None, 200
-        except RateLimitError as e:
-            error_message = f"OpenAI API request exceeded rate limit: {e}"
-            status_code = 500
-        except (APIError, InternalServerError):
-            error_message = "Server is overloaded or unable to answer your request at the moment. Please try again later"
-            status_code = 503
-        except Exception as e:
-            error_message = str(e.__context__) + " and " + e.__str__()
-            status_code = 500
-        return "", error_message, status_code
+    intent_message = intent_res.choices[0].message.model_dump()
+    intent_response = intent_message["content"]
+    logger.info({"label": "openai_intent_response", "intent_response": intent_response})
+    return intent_response
+
+
+async def get_rstory_context_system_rules(index_id, query, settings):
+    documents = await marqo_similarity_search_with_score(index_id, query, k=20, searchable_attributes=["text"])
+    logger.debug(f"Marqo documents : {str(documents)}")
+    filtered_document = get_score_filtered_documents(documents, settings.docs_min_score)
+    filtered_document = filtered_document[:settings.top_docs_to_fetch]
+    logger.info(f"Score filtered documents : {str(filtered_document)}")
+    contexts = get_formatted_documents(filtered_document)
+    if not documents or not contexts:
+        return None, None
+    system_rules = settings.r_story_prompt.format(contexts=contexts)
+    logger.info("==== System Rules ====")
+    logger.debug(system_rules)
+    return system_rules, "openai_response"
+
+
+def cache_answer(cache_context, answer):
+    answer_cache_key, query_embedding, answer_namespace = cache_context
+    if answer_cache_key is not None:
+        answer_cache.set(answer_cache_key, answer)
+    if query_embedding is not None:
+        semantic_cache.add(query_embedding, answer_namespace, answer)
 
 
 def get_score_filtered_documents(documents: List[Tuple[Document, Any]], min_score=0.0):
@@ -0,0 +1,156 @@
+import asyncio
+
+import httpx
+from multipart.multipart import MultipartParser, parse_options_header
+
+from audio_transcoder import AudioDecodeError, AudioInputTooLargeError, decode_to_wav, limit_audio_size
+from cache import TTLCache
+from config_util import get_config_value
+from http_client import http_client
+from logger import logger
+
+audio_upload_max_bytes = int(get_config_value('audio', 'audio_upload_max_bytes', 10485760))
+audio_upload_field = get_config_value('audio', 'audio_upload_field', "audio")
+audio_fetch_max_bytes = int(get_config_value('audio', 'audio_fetch_max_bytes', 10485760))
+audio_fetch_timeout = float(get_config_value('audio', 'audio_fetch_timeout', 30))
+audio_fetch_content_types = get_config_value('audio', 'audio_fetch_content_types', "audio/,video/,application/ogg,application/octet-stream,binary/octet-stream").split(",")
+audio_fetch_cache_size = int(get_config_value('audio', 'audio_fetch_cache_size', 16))
+audio_fetch_cache_ttl = int(get_config_value('audio', 'audio_fetch_cache_ttl', 3600))
+
+# Decoded audio of recently fetched URLs with their ETag, revalidated with If-None-Match
+fetched_audio_cache = TTLCache(max_size=audio_fetch_cache_size, ttl=audio_fetch_cache_ttl)
+not_modified_responses = 0
+
+
+class UnsupportedAudioUploadError(Exception):
+    pass
+
+
+class AudioFetchError(AudioDecodeError):
+    pass
+
+
+class MissingAudioFieldError(Exception):
+    pass
+
+
+async def iter_multipart_audio(chunks, boundary, field_name):
+    """
+    Parses a multipart/form-data body incrementally and yields the content of the audio field as it arrives,
+    without spooling the upload to memory or disk first. Other fields are ignored.
+
+    Raises:
+        MissingAudioFieldError: If the body has no audio field.
+    """
+    part = {"header_field": b"", "header_value": b"", "is_audio": False, "has_audio": False}
+    audio_chunks = []
+
+    def on_part_begin():
+        part["is_audio"] = False
+
+    def on_header_field(data, start, end):
+        part["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["header_value"] += data[start:end]
+
+    def on_header_end():
+        if part["header_field"].lower() == b"content-disposition":
+            _, options = parse_options_header(part["header_value"])
+            part["is_audio"] = options.get(b"name", b"").decode("latin-1") == field_name
+            part["has_audio"] = part["has_audio"] or part["is_audio"]
+        part["header_field"] = b""
+        part["header_value"] = b""
+
+    def on_part_data(data, start, end):
+        if part["is_audio"]:
+            audio_chunks.append(data[start:end])
+
+    parser = MultipartParser(boundary, callbacks={
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_part_data": on_part_data
+    })
+    async for chunk in chunks:
+        parser.write(chunk)
+        for audio_chunk in audio_chunks:
+            yield audio_chunk
+        audio_chunks.clear()
+    parser.finalize()
+    if not part["has_audio"]:
+        raise MissingAudioFieldError(f"The multipart/form-data body has no '{field_name}' field")
+
+
+def get_request_audio(request, max_bytes=audio_upload_max_bytes):
+    """
+    Returns the audio of a raw ``audio/*`` body or of the audio field of a ``multipart/form-data`` body as an
+    async iterator of chunks. Reading stops with AudioInputTooLargeError once the body exceeds max_bytes.
+
+    Raises:
+        UnsupportedAudioUploadError: If the content type is neither audio/* nor multipart/form-data.
+        MissingAudioFieldError: While reading, if a multipart/form-data body has no audio field.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    body = limit_audio_size(request.stream(), max_bytes)
+    if content_type.startswith(b"audio/"):
+        return body
+    if content_type == b"multipart/form-data" and options.get(b"boundary"):
+        return iter_multipart_audio(body, options[b"boundary"], audio_upload_field)
+    raise UnsupportedAudioUploadError("The audio should be sent as an audio/* body or as multipart/form-data")
+
+
+def is_audio_content_type(content_type):
+    """Checks the media type against audio_fetch_content_types, where entries ending with "/" match a whole type."""
+    media_type = content_type.split(";")[0].strip().lower()
+    return any(media_type.startswith(allowed) if allowed.endswith("/") else media_type == allowed
+               for allowed in audio_fetch_content_types)
+
+
+async def fetch_and_decode_audio(url):
+    global not_modified_responses
+    cached = fetched_audio_cache.get(url)
+    headers = {"If-None-Match": cached[0]} if cached is not None else {}
+    async with http_client.stream("GET", url, headers=headers, follow_redirects=True) as response:
+        if response.status_code == 304 and cached is not None:
+            not_modified_responses += 1
+            return cached[1]
+        if response.status_code != 200:
+            raise AudioFetchError(f"Fetching the audio input returned HTTP {response.status_code}")
+        content_type = response.headers.get("content-type", "")
+        if content_type and not is_audio_content_type(content_type):
+            raise AudioFetchError(f"The audio input URL returned unsupported content type {content_type}")
+        content_length = response.headers.get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > audio_fetch_max_bytes:
+            raise AudioInputTooLargeError(f"Audio input exceeds the maximum size of {audio_fetch_max_bytes} bytes")
+        wav_file_content = await decode_to_wav(limit_audio_size(response.aiter_bytes(), audio_fetch_max_bytes))
+
+    etag = response.headers.get("etag")
+    if etag:
+        fetched_audio_cache.set(url, (etag, wav_file_content))
+    return wav_file_content
+
+
+async def fetch_audio(url):
+    """
+    Downloads the audio input from a URL with the shared connection pool and decodes it while it is streamed.
+
+    The download is capped at audio_fetch_max_bytes and, including decoding, at audio_fetch_timeout seconds.
+    Responses which are not audio are rejected before their body is read. Decoded audio of responses with an
+    ETag is kept for a while, so a retry of the same clip is answered by a 304 without downloading it again.
+
+    Returns:
+        The audio as 16 kHz mono PCM16 WAV.
+    """
+    try:
+        return await asyncio.wait_for(fetch_and_decode_audio(url), timeout=audio_fetch_timeout)
+    except asyncio.TimeoutError:
+        raise AudioFetchError(f"Fetching the audio input did not finish within {audio_fetch_timeout} seconds")
+    except httpx.HTTPError as e:
+        logger.error({"label": "audio_fetch_failed", "url": url, "error": str(e)})
+        raise AudioFetchError("Unable to fetch the audio input") from e
+
+
+def get_audio_fetch_stats():
+    return {"cache": fetched_audio_cache.stats(), "not_modified_responses": not_modified_responses}
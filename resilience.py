@@ -0,0 +1,230 @@
+import asyncio
+import time
+from collections import deque
+
+from admission import UpstreamOverloadedError, upstream_slot
+from config_util import get_config_value
+from logger import logger
+from metrics import circuit_breaker_state, upstream_fallbacks, upstream_hedges
+from tracing import span
+
+circuit_breaker_window = float(get_config_value('resilience', 'circuit_breaker_window', 60))
+circuit_breaker_min_requests = int(get_config_value('resilience', 'circuit_breaker_min_requests', 10))
+circuit_breaker_error_rate = float(get_config_value('resilience', 'circuit_breaker_error_rate', 0.5))
+circuit_breaker_slow_call_duration = float(get_config_value('resilience', 'circuit_breaker_slow_call_duration', 10))
+circuit_breaker_open_duration = float(get_config_value('resilience', 'circuit_breaker_open_duration', 30))
+hedging_enabled = get_config_value('resilience', 'hedging_enabled', "false").lower() == "true"
+hedge_percentile = float(get_config_value('resilience', 'hedge_percentile', 95))
+hedge_min_samples = int(get_config_value('resilience', 'hedge_min_samples', 20))
+google_fallback_stages = frozenset(stage.strip() for stage in get_config_value('resilience', 'google_fallback_stages', "asr").split(",") if stage.strip())
+stage_timeouts = {
+    stage: float(get_config_value('resilience', f'bhashini_{stage}_timeout', default))
+    for stage, default in (("asr", 10), ("translation", 5), ("tts", 15), ("asr_translation", 15), ("translation_tts", 20))
+}
+
+STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, upstream):
+        super().__init__(f"Circuit breaker of {upstream} is open")
+        self.upstream = upstream
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of an upstream with a rolling window of its recent calls.
+
+    The breaker opens when at least min_requests calls were made in the last `window` seconds and the share
+    of failed calls, or of calls slower than slow_call_duration seconds, reaches error_rate. While open, calls
+    are rejected for open_duration seconds; then a single trial call is let through (half open), which closes
+    the breaker when it succeeds and opens it again otherwise. The latencies of the successful calls in the
+    window are also used to decide when to hedge, see call_upstream.
+    """
+
+    def __init__(self, name, window, min_requests, error_rate, slow_call_duration, open_duration):
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_call_duration = slow_call_duration
+        self.open_duration = open_duration
+        self.calls = deque()
+        self.state = "closed"
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.opened = 0
+        self.rejected = 0
+        circuit_breaker_state.labels(name).set(0)
+
+    def set_state(self, state):
+        if state != self.state:
+            logger.warning({"label": "circuit_breaker", "upstream": self.name, "state": state, "previous_state": self.state})
+        self.state = state
+        circuit_breaker_state.labels(self.name).set(STATE_VALUES[state])
+
+    def prune(self, now):
+        while self.calls and self.calls[0][0] < now - self.window:
+            self.calls.popleft()
+
+    def allow(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.open_duration:
+                self.rejected += 1
+                return False
+            self.set_state("half_open")
+        if self.state == "half_open":
+            if self.trial_in_flight:
+                self.rejected += 1
+                return False
+            self.trial_in_flight = True
+        return True
+
+    def record(self, success, duration):
+        now = time.monotonic()
+        failed = not success or duration >= self.slow_call_duration
+        if self.state == "open":
+            # A call which started before the breaker opened
+            return
+        if self.state == "half_open":
+            self.trial_in_flight = False
+            if failed:
+                self.open(now)
+            else:
+                self.set_state("closed")
+                self.calls.append((now, failed, duration))
+            return
+        self.calls.append((now, failed, duration))
+        self.prune(now)
+        if len(self.calls) >= self.min_requests and sum(call[1] for call in self.calls) >= self.error_rate * len(self.calls):
+            self.open(now)
+
+    def release(self):
+        """Ends a call whose outcome is unknown, e.g. cancelled because the hedged fallback answered first."""
+        if self.state == "half_open":
+            self.trial_in_flight = False
+
+    def open(self, now):
+        self.opened_at = now
+        self.opened += 1
+        self.calls.clear()
+        self.set_state("open")
+
+    def latency_percentile(self, percentile, min_samples):
+        """Returns the percentile of the latencies of the successful calls in the window, or None with fewer than min_samples of them."""
+        self.prune(time.monotonic())
+        durations = sorted(call[2] for call in self.calls if not call[1])
+        if len(durations) < max(min_samples, 1):
+            return None
+        return durations[min(len(durations) - 1, int(len(durations) * percentile / 100))]
+
+    def stats(self):
+        self.prune(time.monotonic())
+        return {"state": self.state, "calls": len(self.calls), "failed": sum(call[1] for call in self.calls),
+                "opened": self.opened, "rejected": self.rejected,
+                "hedge_delay": self.latency_percentile(hedge_percentile, hedge_min_samples) if hedging_enabled else None}
+
+
+circuit_breakers = {}
+
+
+def get_circuit_breaker(upstream):
+    breaker = circuit_breakers.get(upstream)
+    if breaker is None:
+        breaker = CircuitBreaker(upstream, circuit_breaker_window, circuit_breaker_min_requests, circuit_breaker_error_rate,
+                                 circuit_breaker_slow_call_duration, circuit_breaker_open_duration)
+        circuit_breakers[upstream] = breaker
+    return breaker
+
+
+def get_stage_timeout(stage):
+    timeout = stage_timeouts.get(stage)
+    return timeout if timeout else None
+
+
+async def run_fallback(upstream, stage, fallback, reason):
+    upstream_fallbacks.labels(upstream, reason).inc()
+    with span("upstream_fallback", upstream=upstream, reason=reason):
+        return await asyncio.wait_for(fallback(), get_stage_timeout(stage))
+
+
+async def call_upstream(upstream, stage, primary, fallback=None, admission_upstream="bhashini"):
+    """
+    Calls an upstream with the timeout of the stage (resilience.bhashini_<stage>_timeout) and through its
+    circuit breaker, once admission control let the call through. The timeout, the latency recorded by the
+    breaker and the hedge delay start when the call is admitted, so that a wait in the admission queue is
+    not taken for a slow upstream.
+
+    The fallback, e.g. the Google equivalent of a Bhashini task, is used when the breaker is open and when
+    the upstream fails or times out. With hedging enabled, the fallback is also started once the upstream
+    takes longer than the hedge_percentile of its recent latencies, and whichever answers first is used.
+
+    Args:
+        upstream: Name of the circuit breaker, e.g. bhashini_asr.
+        stage: Stage of the timeout, e.g. asr.
+        primary: Function returning the coroutine calling the upstream.
+        fallback: Function returning the coroutine calling the fallback, or None.
+        admission_upstream: Name of the upstream whose call slot is held, see admission.upstream_slot.
+
+    Returns:
+        The result of the upstream or of the fallback.
+    """
+    breaker = get_circuit_breaker(upstream)
+    if not breaker.allow():
+        if fallback is None:
+            raise CircuitOpenError(upstream)
+        return await run_fallback(upstream, stage, fallback, "circuit_open")
+
+    start_time = None
+    admitted = asyncio.get_running_loop().create_future()
+
+    async def run_primary():
+        nonlocal start_time
+        async with upstream_slot(admission_upstream):
+            start_time = time.perf_counter()
+            admitted.set_result(None)
+            return await asyncio.wait_for(primary(), get_stage_timeout(stage))
+
+    primary_task = asyncio.ensure_future(run_primary())
+    fallback_task = None
+    try:
+        hedge_delay = breaker.latency_percentile(hedge_percentile, hedge_min_samples) if hedging_enabled and fallback is not None else None
+        if hedge_delay is not None:
+            await asyncio.wait({primary_task, admitted}, return_when=asyncio.FIRST_COMPLETED)
+        done, _ = await asyncio.wait({primary_task}, timeout=hedge_delay)
+        if not done:
+            upstream_hedges.labels(upstream).inc()
+            fallback_task = asyncio.ensure_future(run_fallback(upstream, stage, fallback, "hedge"))
+            done, _ = await asyncio.wait({primary_task, fallback_task}, return_when=asyncio.FIRST_COMPLETED)
+            if fallback_task in done and primary_task not in done and fallback_task.exception() is None:
+                breaker.release()
+                return fallback_task.result()
+        try:
+            result = await primary_task
+        except Exception as e:
+            if isinstance(e, UpstreamOverloadedError):
+                # Rejected by admission control before reaching the upstream, which says nothing about its health
+                breaker.release()
+                reason = "overloaded"
+            else:
+                breaker.record(False, time.perf_counter() - start_time)
+                reason = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+            if fallback is None:
+                raise
+            if fallback_task is not None:
+                # The hedged fallback is already running
+                return await fallback_task
+            return await run_fallback(upstream, stage, fallback, reason)
+        breaker.record(True, time.perf_counter() - start_time)
+        return result
+    finally:
+        for task in (primary_task, fallback_task):
+            if task is not None and not task.done():
+                task.cancel()
+        if not primary_task.done() or primary_task.cancelled():
+            breaker.release()
+
+
+def get_resilience_stats():
+    return {"hedging_enabled": hedging_enabled, "google_fallback_stages": sorted(google_fallback_stages),
+            "circuit_breakers": {name: breaker.stats() for name, breaker in circuit_breakers.items()}}
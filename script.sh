@@ -1,2 +1,5 @@
+# The uvicorn workers share their Prometheus metrics through files in this directory, see /metrics
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
 /opt/conda/bin/uvicorn main:app --host 0.0.0.0 --port 8000 --timeout-keep-alive 600 --workers 8
 tail -f /dev/null
\ No newline at end of file
@@ -0,0 +1,114 @@
+import threading
+import time
+import zlib
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from config_util import get_config_value
+from logger import logger
+
+semantic_cache_enabled = get_config_value('cache', 'semantic_cache_enabled', "false").lower() == "true"
+semantic_cache_model = get_config_value('cache', 'semantic_cache_model', "sentence-transformers/all-MiniLM-L6-v2")
+semantic_cache_threshold = float(get_config_value('cache', 'semantic_cache_threshold', 0.92))
+semantic_cache_size = int(get_config_value('cache', 'semantic_cache_size', 10000))
+semantic_cache_ttl = int(get_config_value('cache', 'semantic_cache_ttl', 3600))
+
+if semantic_cache_enabled:
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        logger.warning("semantic_cache_enabled is set but the 'sentence-transformers' package is not installed, disabling the semantic cache")
+        semantic_cache_enabled = False
+
+
+class SemanticCache:
+    """
+    Near-duplicate query cache over sentence embeddings.
+
+    Embeddings of recent English queries are kept L2-normalized in a fixed size NumPy matrix used as a
+    ring buffer, so a lookup is a single matrix-vector product followed by an argmax. An answer is served
+    when the cosine similarity of the best match within the same namespace (index, prompt version, model)
+    reaches the threshold.
+    """
+
+    def __init__(self, capacity, threshold, ttl, dimension=None, model_name=None):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.model_name = model_name
+        self.model = None
+        self.model_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.embeddings = None
+        self.namespaces = np.zeros(capacity, dtype=np.int64)
+        self.expires_at = np.zeros(capacity, dtype=np.float64)
+        self.answers = [None] * capacity
+        self.count = 0
+        self.next_slot = 0
+        self.hits = 0
+        self.misses = 0
+        if dimension is not None:
+            self.embeddings = np.zeros((capacity, dimension), dtype=np.float32)
+
+    @staticmethod
+    def namespace_id(namespace):
+        return zlib.crc32(namespace.encode("utf-8"))
+
+    def encode(self, text):
+        if self.model is None:
+            with self.model_lock:
+                if self.model is None:
+                    self.model = SentenceTransformer(self.model_name, device="cpu")
+        return self.model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+    async def embed(self, text):
+        return await run_in_threadpool(self.encode, text)
+
+    def lookup(self, embedding, namespace):
+        """Returns the cached answer most similar to the embedding, or None below the threshold."""
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self.lock:
+            if self.count == 0:
+                self.misses += 1
+                return None
+            scores = self.embeddings[:self.count] @ embedding
+            valid = (self.namespaces[:self.count] == self.namespace_id(namespace)) & (self.expires_at[:self.count] > time.monotonic())
+            scores = np.where(valid, scores, -1.0)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                self.hits += 1
+                return self.answers[best]
+            self.misses += 1
+            return None
+
+    def add(self, embedding, namespace, answer):
+        with self.lock:
+            if self.embeddings is None:
+                self.embeddings = np.zeros((self.capacity, embedding.shape[0]), dtype=np.float32)
+            slot = self.next_slot
+            self.embeddings[slot] = embedding
+            self.namespaces[slot] = self.namespace_id(namespace)
+            self.expires_at[slot] = time.monotonic() + self.ttl
+            self.answers[slot] = answer
+            self.next_slot = (slot + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+            self.next_slot = 0
+            self.answers = [None] * self.capacity
+
+    def stats(self):
+        return {
+            "enabled": semantic_cache_enabled,
+            "size": self.count,
+            "max_size": self.capacity,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+semantic_cache = SemanticCache(semantic_cache_size, semantic_cache_threshold, semantic_cache_ttl, model_name=semantic_cache_model)
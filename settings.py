@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import os
+import signal
+from configparser import ConfigParser
+from string import Formatter
+
+from dotenv import load_dotenv
+
+from config_util import config_file_path, get_config_value
+from logger import logger
+
+load_dotenv()
+settings_reload_interval = float(get_config_value('settings', 'settings_reload_interval', 5))
+
+
+class PromptTemplate:
+    """
+    A prompt with ``{name}`` placeholders, split into its literal parts and fields once, so that filling it in
+    per request is a single join. Doubled braces are literal braces, as with str.format.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.parts = []
+        for literal, field, format_spec, conversion in Formatter().parse(text):
+            if field is not None and (not field.isidentifier() or format_spec or conversion):
+                raise ValueError(f"Unsupported prompt placeholder {{{field}}}")
+            self.parts.append((literal, field))
+
+    def format(self, **values):
+        return "".join(literal if field is None else literal + str(values[field]) for literal, field in self.parts)
+
+
+class Settings:
+    """
+    Immutable snapshot of the configuration read on the request path. Values are looked up like
+    get_config_value does: an environment variable named after the key wins over config.ini.
+    """
+
+    def __init__(self, config):
+        def get(section, key, default=""):
+            value = os.getenv(key)
+            if value is None or value == "":
+                value = config.get(section, key, fallback=default)
+            return value
+
+        self.index_name: str = get("database", "index_name")
+        self.top_docs_to_fetch: int = int(get("database", "top_docs_to_fetch", 5))
+        self.docs_min_score: float = float(get("database", "docs_min_score", 0.4))
+        self.supported_lang_codes: frozenset = frozenset(get("request", "supported_lang_codes").split(","))
+        self.supported_response_formats: frozenset = frozenset(get("request", "support_response_format").split(","))
+        self.batch_max_queries: int = int(get("request", "batch_max_queries", 100))
+        self.batch_concurrency: int = int(get("request", "batch_concurrency", 8))
+        self.translation_batch_size: int = int(get("request", "translation_batch_size", 25))
+        self.gpt_model: str = get("llm", "gpt_model")
+        self.story_prompt: str = get("llm", "story_prompt")
+        self.enable_bot_intent: bool = get("llm", "enable_bot_intent", "false").lower() == "true"
+        self.intent_prompt: str = get("llm", "intent_prompt")
+        self.bot_prompt: str = get("llm", "bot_prompt")
+        self.r_story_prompt: PromptTemplate = PromptTemplate(get("llm", "r_story_prompt"))
+
+        # Short hash of the prompts and retrieval settings that shape an answer, part of the answer cache keys
+        prompt_settings = [self.enable_bot_intent, self.intent_prompt, self.bot_prompt, self.r_story_prompt.text,
+                           self.top_docs_to_fetch, self.docs_min_score]
+        self.prompt_version: str = hashlib.sha256("\x1f".join(str(value) for value in prompt_settings).encode("utf-8")).hexdigest()[:16]
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            raise AttributeError("Settings are immutable, reload them instead")
+        super().__setattr__(name, value)
+
+
+def load_settings():
+    config = ConfigParser()
+    config.read(config_file_path)
+    return Settings(config)
+
+
+def get_config_mtime():
+    try:
+        return os.stat(config_file_path).st_mtime_ns
+    except OSError:
+        return None
+
+
+config_mtime = get_config_mtime()
+settings = load_settings()
+reloads = 0
+failed_reloads = 0
+
+
+def get_settings():
+    """
+    Returns the current settings. A request should call it once and use the returned snapshot throughout,
+    so that a reload in the middle of the request does not mix old and new values.
+    """
+    return settings
+
+
+def reload_settings(reason):
+    """
+    Rebuilds the settings from the environment and config.ini and swaps them in with a single assignment.
+    An invalid config.ini is logged and the current settings are kept.
+    """
+    global settings, config_mtime, reloads, failed_reloads
+    config_mtime = get_config_mtime()
+    try:
+        new_settings = load_settings()
+    except Exception as e:
+        failed_reloads += 1
+        logger.error({"label": "settings_reload_failed", "reason": reason, "error": str(e)})
+        return False
+    settings = new_settings
+    reloads += 1
+    logger.info({"label": "settings_reloaded", "reason": reason, "prompt_version": new_settings.prompt_version})
+    return True
+
+
+async def watch_settings(interval=settings_reload_interval):
+    """Reloads the settings whenever the modification time of config.ini changes."""
+    while True:
+        await asyncio.sleep(interval)
+        if get_config_mtime() != config_mtime:
+            reload_settings("config_changed")
+
+
+def start_settings_watcher():
+    """
+    Starts watching config.ini and reloads the settings on SIGHUP. The signal has to be sent to the worker
+    processes, e.g. ``pkill -HUP -P <pid of the uvicorn main process>``, as the main process exits on SIGHUP.
+    Must be called from the event loop of the worker.
+
+    Returns:
+        The watcher task, or None when the reload interval is 0.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGHUP, reload_settings, "sighup")
+    except (NotImplementedError, RuntimeError, AttributeError) as e:
+        logger.warning(f"Unable to reload settings on SIGHUP: {e}")
+    if settings_reload_interval <= 0:
+        return None
+    return asyncio.create_task(watch_settings())
+
+
+def get_settings_stats():
+    return {"prompt_version": settings.prompt_version, "reloads": reloads, "failed_reloads": failed_reloads}
@@ -0,0 +1,146 @@
+import asyncio
+import io
+import re
+
+from pydub import AudioSegment
+from starlette.concurrency import run_in_threadpool
+
+from config_util import get_config_value
+from logger import logger
+from resilience import call_upstream
+from translator import text_to_speech, translation_to_speech
+from utils import sentence_boundary_pattern
+
+tts_chunking_enabled = get_config_value('tts', 'tts_chunking_enabled', "true").lower() == "true"
+tts_chunk_max_chars = int(get_config_value('tts', 'tts_chunk_max_chars', 300))
+tts_max_concurrency = int(get_config_value('tts', 'tts_max_concurrency', 4))
+tts_sample_rate = int(get_config_value('tts', 'tts_sample_rate', 22050))
+tts_bitrate = get_config_value('tts', 'tts_bitrate', "64k")
+bhashini_chaining_sentence_chunks = get_config_value('translation', 'bhashini_chaining_sentence_chunks', "false").lower() == "true"
+
+paragraph_separator_pattern = re.compile(r"(\n\s*\n)")
+
+markdown_patterns = [
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"\1"),  # images
+    (re.compile(r"\[([^\]]*)\]\([^)]*\)"), r"\1"),  # links
+    (re.compile(r"^\s{0,3}#{1,6}\s*", re.MULTILINE), ""),  # headings
+    (re.compile(r"^\s{0,3}>\s?", re.MULTILINE), ""),  # block quotes
+    (re.compile(r"^\s*[-*+]\s+", re.MULTILINE), ""),  # bullet list items
+    (re.compile(r"^\s*([-*_]\s*){3,}$", re.MULTILINE), ""),  # horizontal rules
+    (re.compile(r"(\*\*|__|\*|_|~~|`)(?=\S)(.+?)(?<=\S)\1"), r"\2"),  # emphasis and inline code
+    (re.compile(r"[*#`~]"), ""),  # left over markup characters
+]
+
+
+def strip_markdown(text):
+    """Removes markdown markup that should not be spoken."""
+    for pattern, replacement in markdown_patterns:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+def split_speech_chunks(text, max_chars=tts_chunk_max_chars):
+    """Splits the text into sentences and groups consecutive sentences into chunks of at most max_chars characters."""
+    chunks = []
+    current_chunk = ""
+    for sentence in sentence_boundary_pattern.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if current_chunk and len(current_chunk) + len(sentence) + 1 > max_chars:
+            chunks.append(current_chunk)
+            current_chunk = sentence
+        else:
+            current_chunk = f"{current_chunk} {sentence}" if current_chunk else sentence
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+
+def concatenate_audio(audio_chunks):
+    """Decodes the WAV chunks returned by Bhashini, joins them and encodes one MP3 with a fixed sample rate and bitrate."""
+    combined_audio = AudioSegment.empty()
+    for audio_chunk in audio_chunks:
+        segment = AudioSegment.from_file(io.BytesIO(audio_chunk), format="wav")
+        combined_audio += segment.set_frame_rate(tts_sample_rate).set_channels(1).set_sample_width(2)
+    output = io.BytesIO()
+    combined_audio.export(output, format="mp3", bitrate=tts_bitrate)
+    return output.getvalue()
+
+
+async def synthesize_speech_chunk(semaphore, language, text, gender):
+    async with semaphore:
+        return await text_to_speech(language=language, text=text, gender=gender)
+
+
+async def synthesize_speech(language, text, gender='female'):
+    """
+    Converts the text to speech, synthesizing sentence chunks concurrently.
+
+    Long answers are split into chunks of whole sentences which are sent to Bhashini in parallel (at most
+    tts_max_concurrency at a time) and stitched into one MP3, so the latency no longer grows with the length
+    of the story. Short answers are synthesized in a single request. Either way the audio is encoded by
+    concatenate_audio, so every object has the same format, sample rate and bitrate.
+
+    Returns:
+        The audio content, or None if the synthesis of any chunk failed.
+    """
+    text = strip_markdown(text)
+    chunks = split_speech_chunks(text) if tts_chunking_enabled else [text]
+    if len(chunks) <= 1:
+        audio_chunks = [await text_to_speech(language=language, text=text, gender=gender)]
+    else:
+        logger.info({"label": "tts_chunks", "chunks": len(chunks), "language": language})
+        semaphore = asyncio.Semaphore(tts_max_concurrency)
+        audio_chunks = await asyncio.gather(*[synthesize_speech_chunk(semaphore, language, chunk, gender) for chunk in chunks])
+    if any(audio_chunk is None for audio_chunk in audio_chunks):
+        return None
+    return await run_in_threadpool(concatenate_audio, audio_chunks)
+
+
+def is_chainable_speech(text):
+    """Whether the text can be translated and spoken by chained pipelines, which requires it to have no markup to leave out of the speech."""
+    return text.strip() != "" and strip_markdown(text) == text.strip()
+
+
+async def translate_speech_chunk(semaphore, text, language, gender):
+    async with semaphore:
+        return await call_upstream("bhashini_translation_tts", "translation_tts",
+                                   lambda: translation_to_speech(text, source='en', destination=language, gender=gender))
+
+
+async def synthesize_translated_speech(english_text, language, gender='female'):
+    """
+    Translates the English text and converts the translation to speech with chained Bhashini translation and TTS
+    pipelines, one request per paragraph sent in parallel. The paragraphs keep the separators of the English text.
+
+    With translation.bhashini_chaining_sentence_chunks, each paragraph is further split into sentence chunks
+    like in synthesize_speech. The speech is faster, but the chunks are translated without the context of the
+    rest of the paragraph, and the translated chunks are only joined with spaces.
+
+    Returns:
+        The translated text, the audio content and whether the text was translated in a single request, i.e.
+        whether the translation is one of the whole text.
+    """
+    parts = paragraph_separator_pattern.split(english_text.strip())
+    # The even parts are the paragraphs, the odd ones the separators between them
+    chunks_per_paragraph = [split_speech_chunks(paragraph) if bhashini_chaining_sentence_chunks and tts_chunking_enabled else [paragraph.strip()]
+                            for paragraph in parts[0::2]]
+    chunks = [chunk for paragraph_chunks in chunks_per_paragraph for chunk in paragraph_chunks]
+    if len(chunks) > 1:
+        logger.info({"label": "tts_chunks", "chunks": len(chunks), "language": language, "chained": True})
+    semaphore = asyncio.Semaphore(tts_max_concurrency)
+    results = iter(await asyncio.gather(*[translate_speech_chunk(semaphore, chunk, language, gender) for chunk in chunks]))
+
+    translated_parts = []
+    audio_chunks = []
+    for index, paragraph_chunks in enumerate(chunks_per_paragraph):
+        if index:
+            translated_parts.append(parts[2 * index - 1])
+        translated_chunks = []
+        for _ in paragraph_chunks:
+            translated_chunk, audio_chunk = next(results)
+            translated_chunks.append(translated_chunk)
+            audio_chunks.append(audio_chunk)
+        translated_parts.append(" ".join(translated_chunks))
+    return "".join(translated_parts), await run_in_threadpool(concatenate_audio, audio_chunks), len(chunks) == 1
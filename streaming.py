@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+from io_processing import process_outgoing_text, process_outgoing_voice_url
+from logger import logger
+from utils import sentence_boundary_pattern
+
+
+def format_sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def split_sentences(chunks):
+    """Groups streamed text chunks into sentences, yielding (sentence, separator) pairs as soon as a sentence is complete."""
+    buffer = ""
+    async for chunk in chunks:
+        buffer += chunk
+        start = 0
+        for match in sentence_boundary_pattern.finditer(buffer):
+            yield buffer[start:match.start()], match.group()
+            start = match.end()
+        buffer = buffer[start:]
+    if buffer:
+        yield buffer, ""
+
+
+async def translate_sentence(sentence, language):
+    if not sentence.strip():
+        return sentence, None
+    return await process_outgoing_text(sentence, language)
+
+
+async def stream_answer_events(answer_chunks, language, is_audio):
+    """
+    Converts the streamed English answer into Server-Sent Events.
+
+    English answers are forwarded token by token as ``token`` events. For other languages every sentence is
+    translated as soon as the LLM completes it, while the LLM keeps generating, and sent in order as a
+    ``sentence`` event. A final ``done`` event carries the full answer and, for audio output, the audio URL.
+    Failures are reported as an ``error`` event that ends the stream.
+    """
+    if language == "en":
+        chunks = []
+        try:
+            async for chunk in answer_chunks:
+                chunks.append(chunk)
+                yield format_sse_event("token", {"text": chunk})
+        except Exception as e:
+            logger.error(f"Exception occurred while streaming the answer: {e}", exc_info=True)
+            yield format_sse_event("error", {"detail": "Unable to generate the answer at the moment. Please try again later"})
+            return
+        regional_answer = "".join(chunks)
+    else:
+        translations = asyncio.Queue()
+
+        async def translate_sentences():
+            try:
+                async for sentence, separator in split_sentences(answer_chunks):
+                    translations.put_nowait((asyncio.create_task(translate_sentence(sentence, language)), separator))
+            except Exception as e:
+                logger.error(f"Exception occurred while streaming the answer: {e}", exc_info=True)
+                translations.put_nowait((None, "Unable to generate the answer at the moment. Please try again later"))
+            translations.put_nowait(None)
+
+        producer = asyncio.create_task(translate_sentences())
+        regional_parts = []
+        try:
+            while (item := await translations.get()) is not None:
+                translation, separator = item
+                if translation is None:
+                    yield format_sse_event("error", {"detail": separator})
+                    return
+                regional_sentence, error_message = await translation
+                if regional_sentence is None:
+                    yield format_sse_event("error", {"detail": error_message})
+                    return
+                regional_parts.append(regional_sentence + separator)
+                if regional_sentence.strip():
+                    yield format_sse_event("sentence", {"text": regional_sentence})
+        finally:
+            # Stop the LLM stream and pending translations when the client goes away or an error occurred
+            producer.cancel()
+            while not translations.empty():
+                item = translations.get_nowait()
+                if item is not None and item[0] is not None:
+                    item[0].cancel()
+        regional_answer = "".join(regional_parts)
+
+    audio_output_url = None
+    if is_audio:
+        audio_output_url, error_message = await process_outgoing_voice_url(regional_answer, language)
+        if audio_output_url is None:
+            yield format_sse_event("error", {"detail": error_message})
+            return
+    yield format_sse_event("done", {"text": regional_answer, "audio": audio_output_url, "language": language})
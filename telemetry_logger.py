@@ -1,3 +1,7 @@
+import gzip
+import json
+import queue
+import threading
 import time
 import uuid
 
@@ -15,20 +19,165 @@ actor_id = get_config_value('telemetry', 'actor_id', None)
 channel = get_config_value('telemetry', 'channel', None)
 pdata_id = get_config_value('telemetry', 'pdata_id', None)
 events_threshold = get_config_value('telemetry', 'events_threshold', None)
+telemetry_max_batch_size = int(get_config_value('telemetry', 'telemetry_max_batch_size', 500))
+telemetry_queue_size = int(get_config_value('telemetry', 'telemetry_queue_size', 10000))
+telemetry_flush_interval = float(get_config_value('telemetry', 'telemetry_flush_interval', 5))
+telemetry_max_retries = int(get_config_value('telemetry', 'telemetry_max_retries', 3))
+telemetry_retry_backoff = float(get_config_value('telemetry', 'telemetry_retry_backoff', 1))
+telemetry_request_timeout = float(get_config_value('telemetry', 'telemetry_request_timeout', 10))
+telemetry_gzip_enabled = get_config_value('telemetry', 'telemetry_gzip_enabled', "true").lower() == "true"
 
-class TelemetryLogger:
+
+class TelemetryExporter:
     """
-    A class to capture and send telemetry logs using the requests library with threshold limit.
+    Sends telemetry events to the telemetry service from a dedicated background thread.
+
+    Events are put on a bounded queue without blocking the caller; when the queue is full the event is dropped
+    and counted. The thread sends a batch as soon as batch_size events are queued or flush_interval seconds
+    after the first event of the batch, gzip compressed, retrying failed requests with exponential backoff.
+    Events which queued up meanwhile (e.g. while the service was slow) are added to the batch, up to
+    max_batch_size, so that a backlog is caught up with fewer requests.
     """
 
-    def __init__(self, url=telemetryURL, threshold=int(events_threshold)):
+    def __init__(self, url, batch_size, max_batch_size, queue_size, flush_interval, max_retries, retry_backoff, request_timeout,
+                 gzip_enabled):
         self.url = url
-        self.events = []  # Store multiple events before exceeding threshold
-        self.threshold = threshold
+        self.batch_size = batch_size
+        self.max_batch_size = max(batch_size, max_batch_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.request_timeout = request_timeout
+        self.gzip_enabled = gzip_enabled
+        self.events = queue.Queue(maxsize=queue_size)
+        self.session = requests.Session()
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.retried = 0
+
+    def start(self):
+        # Started on the first event rather than at import, so that every worker process runs its own thread
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="telemetry-exporter", daemon=True)
+                self.thread.start()
+
+    def enqueue(self, event):
+        if self.thread is None:
+            self.start()
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def next_batch(self):
+        """Waits for the first event, then collects events until the batch is full or the flush interval passed."""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if self.stopping.is_set():
+                timeout = 0
+            elif deadline is None:
+                timeout = None
+            else:
+                timeout = max(deadline - time.monotonic(), 0)
+            try:
+                event = self.events.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if event is None:
+                # Wake up call from close()
+                continue
+            batch.append(event)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch_size:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event is not None:
+                batch.append(event)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch:
+                self.send_batch(batch)
+            elif self.stopping.is_set():
+                return
+
+    def send_batch(self, events):
+        data = {
+            "id": telemetry_id,
+            "ver": telemetry_ver,
+            "params": {"msgid": str(uuid.uuid4())},
+            "ets": int(time.time() * 1000),
+            "events": events
+        }
+        body = json.dumps(data, default=str).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.gzip_enabled:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retried += 1
+                # Stop retrying when shutting down, the remaining batches should still get a chance
+                if self.stopping.wait(self.retry_backoff * 2 ** (attempt - 1)):
+                    break
+            try:
+                response = self.session.post(self.url + "/v1/telemetry", data=body, headers=headers, timeout=self.request_timeout)
+                response.raise_for_status()
+                self.sent += len(events)
+                self.batches += 1
+                logger.debug(f"Telemetry API request data: {data}")
+                logger.info("Telemetry logs sent successfully!")
+                return True
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error sending telemetry log: {e}")
+        self.failed += len(events)
+        return False
+
+    def close(self, timeout=10):
+        """Sends the queued events and stops the thread, waiting at most timeout seconds."""
+        if self.thread is None:
+            return
+        self.stopping.set()
+        try:
+            self.events.put_nowait(None)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {"enabled": TELEMETRY_LOG_ENABLED, "queued": self.events.qsize(), "sent": self.sent,
+                "dropped": self.dropped, "failed": self.failed, "batches": self.batches, "retried": self.retried}
+
+
+telemetry_exporter = TelemetryExporter(telemetryURL, int(events_threshold), telemetry_max_batch_size, telemetry_queue_size, telemetry_flush_interval,
+                                       telemetry_max_retries, telemetry_retry_backoff, telemetry_request_timeout,
+                                       telemetry_gzip_enabled)
+
+
+class TelemetryLogger:
+    """
+    A class to capture telemetry logs and hand them to the background telemetry exporter.
+    """
+
+    def __init__(self, exporter=telemetry_exporter):
+        self.exporter = exporter
 
     def add_event(self, event):
         """
-        Adds a telemetry event to the log.
+        Queues a telemetry event for the exporter, without blocking on the telemetry service.
 
         **kwargs:** Keyword arguments containing the event data.
         """
@@ -38,32 +187,7 @@ class TelemetryLogger:
         if not TELEMETRY_LOG_ENABLED:
             return
 
-        self.events.append(event)
-        # Send logs if exceeding threshold
-        if len(self.events) >= self.threshold:
-            self.send_logs()
-
-    def send_logs(self):
-        """
-        Sends the captured telemetry logs using the requests library.
-        """
-        try:
-            data = {
-                "id": telemetry_id,
-                "ver": telemetry_ver,
-                "params": {"msgid": str(uuid.uuid4())},
-                "ets": int(time.time() * 1000),
-                "events": self.events
-            }
-            headers = {"Content-Type": "application/json"}
-            response = requests.post(self.url + "/v1/telemetry", json=data, headers=headers)
-            response.raise_for_status()
-            logger.debug(f"Telemetry API request data: {data}")
-            logger.info("Telemetry logs sent successfully!")
-            # Reset captured events after sending
-            self.events = []
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error sending telemetry log: {e}", exc_info=True)
+        self.exporter.enqueue(event)
 
     def prepare_log_event(self, eventInput: dict, etype="api_access", elevel="INFO", message=""):
         """
@@ -1,64 +1,116 @@
-import time
 import json
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
+import time
+from urllib.parse import parse_qsl
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from config_util import get_config_value
 from telemetry_logger import TelemetryLogger
-from starlette.types import Message
 from logger import logger
 
+telemetryLogger = TelemetryLogger()
+telemetry_log_enabled = get_config_value('telemetry', 'telemetry_log_enabled', None).lower() == "true"
+telemetry_body_fields = get_config_value('telemetry', 'telemetry_body_fields', "input.language,input.text,output.format").split(",")
+telemetry_query_params = get_config_value('telemetry', 'telemetry_query_params', "language,format").split(",")
+telemetry_headers = get_config_value('telemetry', 'telemetry_headers', "x-request-id,x-device-id,x-consumer-id,x-source").split(",")
+telemetry_body_capture_bytes = int(get_config_value('telemetry', 'telemetry_body_capture_bytes', 4096))
+telemetry_field_max_chars = int(get_config_value('telemetry', 'telemetry_field_max_chars', 200))
 
-# https://github.com/tiangolo/fastapi/issues/394
-# Stream response does not work => https://github.com/tiangolo/fastapi/issues/394#issuecomment-994665859
-async def set_body(request: Request, body: bytes):
-    async def receive() -> Message:
-        return {"type": "http.request", "body": body}
 
-    request._receive = receive
+def truncate_value(value):
+    if isinstance(value, str) and len(value) > telemetry_field_max_chars:
+        return value[:telemetry_field_max_chars] + "..."
+    return value
 
 
-async def get_body(request: Request) -> bytes:
-    body = await request.body()
-    await set_body(request, body)
-    return body
+def get_body_fields(body_prefix, is_complete):
+    """
+    Picks the allow-listed fields (dotted paths, logged as e.g. ``input_language``) from a JSON request body.
 
+    Only the first telemetry_body_capture_bytes of a body are kept, so nothing is captured from larger bodies
+    such as base64 encoded audio.
+    """
+    if not is_complete or not body_prefix:
+        return {}
+    try:
+        body = json.loads(body_prefix)
+    except ValueError:
+        return {}
+    fields = {}
+    for field in telemetry_body_fields:
+        value = body
+        for key in field.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is not None and not isinstance(value, (dict, list)):
+            fields[field.replace(".", "_")] = truncate_value(value)
+    return fields
 
-telemetryLogger = TelemetryLogger()
-telemetry_log_enabled = get_config_value('telemetry', 'telemetry_log_enabled', None).lower() == "true"
 
+class TelemetryMiddleware:
+    """
+    Pure ASGI middleware logging one telemetry event per API call.
 
-class TelemetryMiddleware(BaseHTTPMiddleware):
-    def __init__(
-            self,
-            app
-    ):
-        super().__init__(app)
+    Request and response bodies pass through untouched, which keeps streaming responses and large uploads
+    streaming. The status code is taken from the response start message, where the X-Process-Time header is
+    added as well. Only allow-listed, length limited fields of the request are captured.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-    async def dispatch(self, request: Request, call_next):
         start_time = time.time()
-        await set_body(request, await request.body())
-        body = await get_body(request)
-        if body.decode("utf-8"):
-            body = json.loads(body)
-        response = await call_next(request)
-        process_time = time.time() - start_time
-        response.headers["X-Process-Time"] = str(process_time)
-        if "v1" in str(request.url):
-            event: dict = {
-                "status_code": response.status_code,
-                "duration": round(process_time * 1000),
-                "body": body,
-                "method": request.method,
-                "url": request.url
-            }
-            event.update(request.headers)
-            logger.info({"label": "api_call", "event": event})
-
-            if telemetry_log_enabled:
-                if response.status_code == 200:
-                    event = telemetryLogger.prepare_log_event(eventInput=event, message="success")
-                else:
-                    event = telemetryLogger.prepare_log_event(eventInput=event, elevel="ERROR", message="failed")
-                telemetryLogger.add_event(event)
-        return response
\ No newline at end of file
+        status_code = 500
+        headers = Headers(scope=scope)
+        capture_body = headers.get("content-type", "application/json").startswith("application/json")
+        body_prefix = bytearray()
+        body_state = {"size": 0, "complete": False}
+
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if capture_body and message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                body_state["size"] += len(chunk)
+                if body_state["size"] <= telemetry_body_capture_bytes:
+                    body_prefix.extend(chunk)
+                    body_state["complete"] = not message.get("more_body", False)
+            return message
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("X-Process-Time", str(time.time() - start_time))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            if scope["path"].startswith("/v1/"):
+                self.log_event(scope, headers, status_code, time.time() - start_time,
+                               get_body_fields(bytes(body_prefix), body_state["complete"]))
+
+    def log_event(self, scope, headers, status_code, process_time, body_fields):
+        query_params = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        body_fields.update({key: truncate_value(query_params[key]) for key in telemetry_query_params if key in query_params})
+        event: dict = {
+            "status_code": status_code,
+            "duration": round(process_time * 1000),
+            "body": body_fields,
+            "method": scope["method"],
+            "url": scope["path"]
+        }
+        event.update({key: headers[key] for key in telemetry_headers if key in headers})
+        logger.info({"label": "api_call", "event": event})
+
+        if telemetry_log_enabled:
+            if status_code == 200:
+                event = telemetryLogger.prepare_log_event(eventInput=event, message="success")
+            else:
+                event = telemetryLogger.prepare_log_event(eventInput=event, elevel="ERROR", message="failed")
+            telemetryLogger.add_event(event)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# config.ini is read relative to the working directory
+os.chdir(ROOT_DIR)
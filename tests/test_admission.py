@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+import pytest
+
+from admission import UpstreamLimiter, UpstreamOverloadedError, request_deadline
+
+
+async def hold_slot(limiter):
+    slot = limiter.slot()
+    await slot.__aenter__()
+    return slot
+
+
+async def enter_slot(limiter, shed=True):
+    async with limiter.slot(shed):
+        return limiter.in_flight
+
+
+def test_slot_is_handed_over_to_waiter():
+    async def main():
+        limiter = UpstreamLimiter("test", 1, 4)
+        slot = await hold_slot(limiter)
+        waiting = asyncio.create_task(enter_slot(limiter))
+        await asyncio.sleep(0)
+        assert len(limiter.waiters) == 1
+        await slot.__aexit__(None, None, None)
+        assert await waiting == 1
+        assert limiter.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_waiter_cancelled_after_handover_releases_slot():
+    async def main():
+        limiter = UpstreamLimiter("test", 1, 4)
+        slot = await hold_slot(limiter)
+        cancelled = asyncio.create_task(enter_slot(limiter))
+        next_waiting = asyncio.create_task(enter_slot(limiter))
+        await asyncio.sleep(0)
+        assert len(limiter.waiters) == 2
+        # The slot is handed over to the first waiter, which is cancelled before it runs
+        await slot.__aexit__(None, None, None)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        # Without the release the next waiter would never get the slot
+        assert await asyncio.wait_for(next_waiting, 1) == 1
+        assert limiter.in_flight == 0
+        assert not limiter.waiters
+
+    asyncio.run(main())
+
+
+def test_rejected_when_queue_is_full():
+    async def main():
+        limiter = UpstreamLimiter("test", 1, 1)
+        slot = await hold_slot(limiter)
+        waiting = asyncio.create_task(enter_slot(limiter))
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamOverloadedError) as error:
+            await enter_slot(limiter)
+        assert error.value.status_code == 429
+        assert error.value.reason == "queue_full"
+        await slot.__aexit__(None, None, None)
+        await waiting
+
+    asyncio.run(main())
+
+
+def test_rejected_when_estimated_wait_exceeds_deadline():
+    async def main():
+        limiter = UpstreamLimiter("test", 1, 4)
+        limiter.average_duration = 1.0
+        slot = await hold_slot(limiter)
+        request_deadline.set(time.monotonic() + 0.1)
+        with pytest.raises(UpstreamOverloadedError) as error:
+            await enter_slot(limiter)
+        assert error.value.status_code == 503
+        assert error.value.reason == "deadline"
+        assert error.value.retry_after == 1
+        assert not limiter.waiters
+        await slot.__aexit__(None, None, None)
+
+    asyncio.run(main())
+
+
+def test_rejected_when_still_queued_at_deadline():
+    async def main():
+        limiter = UpstreamLimiter("test", 1, 4)
+        slot = await hold_slot(limiter)
+        request_deadline.set(time.monotonic() + 0.05)
+        with pytest.raises(UpstreamOverloadedError) as error:
+            await enter_slot(limiter)
+        assert error.value.status_code == 503
+        assert not limiter.waiters
+        assert limiter.in_flight == 1
+        await slot.__aexit__(None, None, None)
+        assert limiter.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_unshed_call_waits_past_deadline_and_full_queue():
+    async def main():
+        limiter = UpstreamLimiter("test", 1, 0)
+        limiter.average_duration = 1.0
+        slot = await hold_slot(limiter)
+        request_deadline.set(time.monotonic() - 1)
+        waiting = asyncio.create_task(enter_slot(limiter, shed=False))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        await slot.__aexit__(None, None, None)
+        assert await waiting == 1
+        assert limiter.rejected == 0
+
+    asyncio.run(main())
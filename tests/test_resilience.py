@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+import pytest
+
+import resilience
+from admission import UpstreamOverloadedError, upstream_limiters
+from resilience import CircuitBreaker, CircuitOpenError, call_upstream, get_circuit_breaker
+
+
+def make_breaker(open_duration=0.05):
+    return CircuitBreaker("test", window=60, min_requests=4, error_rate=0.5, slow_call_duration=1, open_duration=open_duration)
+
+
+def test_breaker_opens_on_error_rate():
+    breaker = make_breaker()
+    for success in (True, False, True):
+        assert breaker.allow()
+        breaker.record(success, 0.01)
+    assert breaker.state == "closed"
+    breaker.allow()
+    breaker.record(False, 0.01)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+
+def test_breaker_counts_slow_calls_as_failed():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.allow()
+        breaker.record(True, 2)
+    assert breaker.state == "open"
+
+
+def test_breaker_half_open_trial_closes():
+    breaker = make_breaker()
+    breaker.open(time.monotonic())
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # Only a single trial call is let through
+    assert not breaker.allow()
+    breaker.record(True, 0.01)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_breaker_half_open_trial_failure_reopens():
+    breaker = make_breaker()
+    breaker.open(time.monotonic())
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False, 0.01)
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+    assert not breaker.allow()
+
+
+def test_breaker_release_frees_half_open_trial():
+    breaker = make_breaker()
+    breaker.open(time.monotonic())
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_record_while_open_is_ignored():
+    breaker = make_breaker()
+    breaker.open(time.monotonic())
+    breaker.record(True, 0.01)
+    assert breaker.state == "open"
+    assert len(breaker.calls) == 0
+
+
+async def sleep_and_return(delay, value):
+    await asyncio.sleep(delay)
+    return value
+
+
+async def fail():
+    raise RuntimeError("upstream failed")
+
+
+def enable_hedging(monkeypatch, upstream, delay):
+    monkeypatch.setattr(resilience, "hedging_enabled", True)
+    breaker = get_circuit_breaker(upstream)
+    for _ in range(resilience.hedge_min_samples):
+        breaker.record(True, delay)
+    return breaker
+
+
+def test_hedge_fallback_wins_when_primary_is_slow(monkeypatch):
+    breaker = enable_hedging(monkeypatch, "test_hedge_fallback", 0.01)
+    result = asyncio.run(call_upstream("test_hedge_fallback", "translation", lambda: sleep_and_return(1, "primary"),
+                                       lambda: sleep_and_return(0, "fallback")))
+    assert result == "fallback"
+    assert breaker.state == "closed"
+
+
+def test_hedge_primary_wins_when_fallback_is_slower(monkeypatch):
+    enable_hedging(monkeypatch, "test_hedge_primary", 0.01)
+    result = asyncio.run(call_upstream("test_hedge_primary", "translation", lambda: sleep_and_return(0.05, "primary"),
+                                       lambda: sleep_and_return(1, "fallback")))
+    assert result == "primary"
+
+
+def test_hedged_fallback_is_used_when_primary_fails(monkeypatch):
+    enable_hedging(monkeypatch, "test_hedge_failure", 0.01)
+
+    async def fail_later():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream failed")
+
+    result = asyncio.run(call_upstream("test_hedge_failure", "translation", fail_later, lambda: sleep_and_return(0.1, "fallback")))
+    assert result == "fallback"
+
+
+def test_failure_uses_fallback_and_is_recorded():
+    result = asyncio.run(call_upstream("test_failure", "translation", fail, lambda: sleep_and_return(0, "fallback")))
+    assert result == "fallback"
+    assert get_circuit_breaker("test_failure").stats()["failed"] == 1
+
+
+def test_open_breaker_without_fallback_raises():
+    get_circuit_breaker("test_open").open(time.monotonic())
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(call_upstream("test_open", "translation", lambda: sleep_and_return(0, "primary")))
+
+
+def test_overloaded_call_is_not_recorded_as_failure():
+    async def reject():
+        raise UpstreamOverloadedError("bhashini", 429, "queue_full", 1)
+
+    result = asyncio.run(call_upstream("test_overloaded", "translation", reject, lambda: sleep_and_return(0, "fallback")))
+    assert result == "fallback"
+    assert get_circuit_breaker("test_overloaded").stats()["calls"] == 0
+
+
+def test_admission_wait_is_not_part_of_the_timeout(monkeypatch):
+    monkeypatch.setitem(resilience.stage_timeouts, "translation", 0.3)
+    monkeypatch.setattr(upstream_limiters["bhashini"], "max_concurrency", 1)
+
+    async def main():
+        return await asyncio.gather(*[call_upstream("test_admission_wait", "translation", lambda: sleep_and_return(0.2, "primary"))
+                                      for _ in range(2)])
+
+    assert asyncio.run(main()) == ["primary", "primary"]
+    assert get_circuit_breaker("test_admission_wait").stats()["failed"] == 0
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from admission import UpstreamOverloadedError, request_deadline
+from translation_batcher import TranslationBatcher
+
+
+class FakeTranslator:
+    """Translates to upper case, failing for the texts in failing and recording the requests sent."""
+
+    def __init__(self, failing=(), error=None):
+        self.failing = set(failing)
+        self.error = error
+        self.requests = []
+        self.deadlines = []
+
+    async def __call__(self, texts, source, destination):
+        self.requests.append(list(texts))
+        self.deadlines.append(request_deadline.get())
+        if self.error is not None:
+            raise self.error
+        if self.failing.intersection(texts):
+            raise RuntimeError("translation failed")
+        return [text.upper() for text in texts]
+
+
+def translate_concurrently(batcher, texts):
+    async def main():
+        request_deadline.set(123.0)
+        return await asyncio.gather(*[batcher.translate(text, "en", "hi") for text in texts], return_exceptions=True)
+
+    return asyncio.run(main())
+
+
+def test_concurrent_translations_are_sent_together():
+    translator = FakeTranslator()
+    batcher = TranslationBatcher(translator, 0.01)
+    assert translate_concurrently(batcher, ["a", "b", "a"]) == ["A", "B", "A"]
+    assert translator.requests == [["a", "b"]]
+    assert batcher.stats()["batches"] == 1
+
+
+def test_failed_batch_is_retried_text_by_text():
+    translator = FakeTranslator(failing={"bad"})
+    batcher = TranslationBatcher(translator, 0.01)
+    results = translate_concurrently(batcher, ["a", "bad", "c", "bad"])
+    assert results[0] == "A" and results[2] == "C"
+    assert isinstance(results[1], RuntimeError) and isinstance(results[3], RuntimeError)
+    assert translator.requests == [["a", "bad", "c"], ["a"], ["bad"], ["c"]]
+    assert batcher.stats()["retried"] == 1
+    assert batcher.stats()["failed"] == 1
+
+
+def test_failed_single_text_fails_all_its_callers():
+    translator = FakeTranslator(failing={"bad"})
+    batcher = TranslationBatcher(translator, 0.01)
+    results = translate_concurrently(batcher, ["bad", "bad"])
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert translator.requests == [["bad"]]
+
+
+def test_overloaded_batch_is_not_retried():
+    translator = FakeTranslator(error=UpstreamOverloadedError("bhashini", 429, "queue_full", 1))
+    batcher = TranslationBatcher(translator, 0.01)
+    results = translate_concurrently(batcher, ["a", "b"])
+    assert all(isinstance(result, UpstreamOverloadedError) for result in results)
+    assert translator.requests == [["a", "b"]]
+
+
+def test_batch_is_sent_without_the_deadline_of_the_opener():
+    translator = FakeTranslator(failing={"bad"})
+    batcher = TranslationBatcher(translator, 0.01)
+    translate_concurrently(batcher, ["a", "bad"])
+    assert translator.deadlines == [None, None, None]
+
+
+def test_cancelled_batch_cancels_callers():
+    async def never_answers(texts, source, destination):
+        await asyncio.sleep(10)
+
+    async def main():
+        batcher = TranslationBatcher(never_answers, 0)
+        caller = asyncio.create_task(batcher.translate("a", "en", "hi"))
+        await asyncio.sleep(0.01)
+        for task in list(batcher.tasks):
+            task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+
+    asyncio.run(main())
@@ -0,0 +1,290 @@
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import requests
+
+from config_util import get_config_value
+from logger import logger
+
+tracing_enabled = get_config_value('tracing', 'tracing_enabled', "false").lower() == "true"
+tracing_exporter_type = get_config_value('tracing', 'tracing_exporter', "file")
+tracing_file_path = get_config_value('tracing', 'tracing_file_path', "traces.jsonl")
+tracing_otlp_endpoint = get_config_value('tracing', 'tracing_otlp_endpoint', "http://localhost:4318/v1/traces")
+tracing_service_name = get_config_value('tracing', 'tracing_service_name', "story-api-service")
+tracing_sample_rate = float(get_config_value('tracing', 'tracing_sample_rate', 0.1))
+tracing_slow_threshold = float(get_config_value('tracing', 'tracing_slow_threshold', 5))
+tracing_queue_size = int(get_config_value('tracing', 'tracing_queue_size', 1000))
+tracing_flush_interval = float(get_config_value('tracing', 'tracing_flush_interval', 5))
+tracing_request_timeout = float(get_config_value('tracing', 'tracing_request_timeout', 10))
+
+MAX_SPANS_PER_TRACE = 1000
+traceparent_pattern = re.compile(r"00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})")
+
+current_trace: ContextVar = ContextVar("current_trace", default=None)
+current_span: ContextVar = ContextVar("current_span", default=None)
+
+
+def new_span_id():
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self.error = None
+
+    def to_dict(self, trace_start_time):
+        return {"name": self.name, "span_id": self.span_id, "parent_id": self.parent_id,
+                "offset_ms": round((self.start_time - trace_start_time) / 1e6, 3),
+                "duration_ms": round((self.end_time - self.start_time) / 1e6, 3),
+                "attributes": self.attributes, "error": self.error}
+
+    def to_otlp(self, kind):
+        otlp_span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": kind,
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(self.end_time),
+            "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1}
+        }
+        if self.parent_id:
+            otlp_span["parentSpanId"] = self.parent_id
+        return otlp_span
+
+
+class Trace:
+    """
+    The spans of one request. Spans are recorded for every request while tracing is enabled; whether the
+    trace is exported is decided when the request ends, see finish_trace.
+    """
+
+    def __init__(self, request_id, name, attributes, traceparent=None):
+        self.request_id = request_id
+        self.recording = tracing_enabled
+        self.sampled = random.random() < tracing_sample_rate
+        trace_id, parent_id = uuid.uuid4().hex, None
+        match = traceparent_pattern.fullmatch(traceparent or "")
+        if match:
+            # Continue the trace of the caller, and keep it when the caller sampled it
+            trace_id, parent_id = match.group(1), match.group(2)
+            self.sampled = self.sampled or int(match.group(3), 16) & 1 == 1
+        self.root = Span(name, trace_id, parent_id, attributes)
+        self.spans = [self.root]
+        self.finished = False
+        self.dropped_spans = 0
+
+    @property
+    def trace_id(self):
+        return self.root.trace_id
+
+
+@contextmanager
+def start_trace(request_id, name, attributes, traceparent=None):
+    """Makes the request ID and, while tracing is enabled, the root span current for the block."""
+    trace = Trace(request_id, name, attributes, traceparent)
+    trace_token = current_trace.set(trace)
+    span_token = current_span.set(trace.root)
+    try:
+        yield trace
+    finally:
+        current_span.reset(span_token)
+        current_trace.reset(trace_token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Records a span of the current request around the block. Outside of a request, or when tracing is
+    disabled, nothing is recorded and None is yielded.
+    """
+    trace = current_trace.get()
+    if trace is None or not trace.recording:
+        yield None
+        return
+    parent = current_span.get()
+    new_span = Span(name, trace.trace_id, parent.span_id if parent is not None else trace.root.span_id, attributes)
+    token = current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current_span.reset(token)
+        new_span.end_time = time.time_ns()
+        # Spans ending after the request, e.g. of a background upload, are not part of its trace
+        if not trace.finished:
+            if len(trace.spans) < MAX_SPANS_PER_TRACE:
+                trace.spans.append(new_span)
+            else:
+                trace.dropped_spans += 1
+
+
+def set_trace_attributes(**attributes):
+    """Adds attributes to the root span of the current request."""
+    trace = current_trace.get()
+    if trace is not None and trace.recording:
+        trace.root.attributes.update(attributes)
+
+
+def get_request_id():
+    trace = current_trace.get()
+    return trace.request_id if trace is not None else None
+
+
+def get_trace_headers():
+    """
+    Returns the headers propagating the request to an upstream service: X-Request-ID and, while tracing is
+    enabled, a W3C traceparent pointing at the current span.
+    """
+    trace = current_trace.get()
+    if trace is None:
+        return {}
+    headers = {"X-Request-ID": trace.request_id}
+    if trace.recording:
+        parent = current_span.get() or trace.root
+        headers["traceparent"] = f"00-{trace.trace_id}-{parent.span_id}-{'01' if trace.sampled else '00'}"
+    return headers
+
+
+class TraceExporter:
+    """
+    Writes finished traces from a background thread, as JSON lines to a file or to an OTLP/HTTP (JSON)
+    collector. Traces are put on a bounded queue without blocking the request; when it is full they are
+    dropped and counted.
+    """
+
+    def __init__(self, exporter_type, file_path, otlp_endpoint, service_name, queue_size, flush_interval, request_timeout):
+        self.exporter_type = exporter_type
+        self.file_path = file_path
+        self.otlp_endpoint = otlp_endpoint
+        self.service_name = service_name
+        self.flush_interval = flush_interval
+        self.request_timeout = request_timeout
+        self.traces = queue.Queue(maxsize=queue_size)
+        self.session = requests.Session()
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="trace-exporter", daemon=True)
+                self.thread.start()
+
+    def enqueue(self, trace):
+        if self.thread is None:
+            self.start()
+        try:
+            self.traces.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            traces = []
+            try:
+                trace = self.traces.get(timeout=None if not self.stopping.is_set() else 0)
+            except queue.Empty:
+                return
+            if trace is not None:
+                traces.append(trace)
+            # Collect the traces finishing meanwhile, so that they are written or sent together
+            self.stopping.wait(self.flush_interval)
+            while True:
+                try:
+                    trace = self.traces.get_nowait()
+                except queue.Empty:
+                    break
+                if trace is not None:
+                    traces.append(trace)
+            if traces:
+                self.export(traces)
+
+    def export(self, traces):
+        try:
+            if self.exporter_type == "otlp":
+                response = self.session.post(self.otlp_endpoint, json=self.to_otlp(traces), timeout=self.request_timeout)
+                response.raise_for_status()
+            else:
+                lines = "".join(json.dumps(self.to_dict(trace), default=str) + "\n" for trace in traces)
+                # A single append per batch, so that the lines of several workers do not interleave
+                with open(self.file_path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            self.exported += len(traces)
+        except (OSError, requests.exceptions.RequestException) as e:
+            self.failed += len(traces)
+            logger.error(f"Error exporting traces: {e}")
+
+    @staticmethod
+    def to_dict(trace):
+        start_time = trace.root.start_time
+        return {"trace_id": trace.trace_id, "request_id": trace.request_id,
+                "duration_ms": round((trace.root.end_time - start_time) / 1e6, 3),
+                "timestamp": start_time // 1000000, "dropped_spans": trace.dropped_spans,
+                "spans": sorted((span.to_dict(start_time) for span in trace.spans), key=lambda span: span["offset_ms"])}
+
+    def to_otlp(self, traces):
+        # Kind 2 is SERVER for the root span of a request, 1 is INTERNAL
+        spans = [span.to_otlp(2 if span is trace.root else 1) for trace in traces for span in trace.spans]
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "story-api"}, "spans": spans}]
+        }]}
+
+    def close(self, timeout=10):
+        """Exports the queued traces and stops the thread, waiting at most timeout seconds."""
+        if self.thread is None:
+            return
+        self.stopping.set()
+        try:
+            self.traces.put_nowait(None)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {"enabled": tracing_enabled, "queued": self.traces.qsize(), "exported": self.exported,
+                "dropped": self.dropped, "failed": self.failed}
+
+
+trace_exporter = TraceExporter(tracing_exporter_type, tracing_file_path.replace("{pid}", str(os.getpid())),
+                               tracing_otlp_endpoint, tracing_service_name, tracing_queue_size, tracing_flush_interval,
+                               tracing_request_timeout)
+
+
+def finish_trace(trace, is_error):
+    """
+    Ends the root span and exports the trace when it was sampled, when the request failed or when it took
+    longer than tracing_slow_threshold seconds, so that slow and failed requests are always traced.
+    """
+    trace.root.end_time = time.time_ns()
+    trace.finished = True
+    if not trace.recording:
+        return
+    if is_error:
+        trace.root.error = trace.root.error or "request failed"
+    is_slow = (trace.root.end_time - trace.root.start_time) / 1e9 >= tracing_slow_threshold
+    if trace.sampled or is_error or is_slow:
+        trace_exporter.enqueue(trace)
@@ -0,0 +1,43 @@
+import uuid
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from tracing import finish_trace, start_trace
+
+
+class TracingMiddleware:
+    """
+    Pure ASGI middleware making a request ID and a trace current for every API call.
+
+    The request ID is taken from the X-Request-ID header, or generated, and returned in the X-Request-ID
+    response header. It is propagated to the upstream services together with the trace context, see
+    tracing.get_trace_headers.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith("/v1/"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        request_id = headers.get("x-request-id") or uuid.uuid4().hex
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)["X-Request-ID"] = request_id
+            await send(message)
+
+        with start_trace(request_id, f"{scope['method']} {scope['path']}", {"http.method": scope["method"], "http.target": scope["path"]},
+                         headers.get("traceparent")) as trace:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                trace.root.attributes["http.status_code"] = status_code
+                finish_trace(trace, status_code >= 500)
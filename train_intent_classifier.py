@@ -0,0 +1,149 @@
+import argparse
+import csv
+import os
+import time
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import make_pipeline, make_union
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from intent_classifier import IntentClassifier  # noqa: E402
+
+
+def load_samples(data_path):
+    with open(data_path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    texts = [row["text"].strip().lower() for row in rows]
+    labels = [row["label"].strip() for row in rows]
+    return texts, labels
+
+
+def build_model():
+    features = make_union(
+        TfidfVectorizer(analyzer="word", ngram_range=(1, 2), sublinear_tf=True),
+        TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4), sublinear_tf=True)
+    )
+    return make_pipeline(features, LogisticRegression(C=10, class_weight="balanced", max_iter=1000))
+
+
+def cross_validate(texts, labels, threshold, folds):
+    """Evaluates the full classifier (rules, then model) with stratified k-fold cross validation."""
+    texts = np.array(texts, dtype=object)
+    labels = np.array(labels)
+    model_correct = 0
+    local_decisions = 0
+    local_correct = 0
+    for train_index, test_index in StratifiedKFold(n_splits=folds, shuffle=True, random_state=0).split(texts, labels):
+        classifier = IntentClassifier(None, threshold)
+        classifier.model = build_model().fit(texts[train_index], labels[train_index])
+        model_correct += int((classifier.model.predict(texts[test_index]) == labels[test_index]).sum())
+        for text, label in zip(texts[test_index], labels[test_index]):
+            intent, _ = classifier.classify(text)
+            if intent is not None:
+                local_decisions += 1
+                local_correct += int(intent == label)
+    return {
+        "samples": len(texts),
+        "model_accuracy": model_correct / len(texts),
+        "local_coverage": local_decisions / len(texts),
+        "local_accuracy": local_correct / local_decisions if local_decisions else 0.0
+    }
+
+
+def measure_latency(classifier, texts, repeats):
+    latencies = []
+    for _ in range(repeats):
+        for text in texts:
+            start_time = time.perf_counter()
+            classifier.classify(text)
+            latencies.append(time.perf_counter() - start_time)
+    latencies_ms = np.array(latencies) * 1000
+    return {"p50_ms": float(np.percentile(latencies_ms, 50)), "p99_ms": float(np.percentile(latencies_ms, 99)), "max_ms": float(latencies_ms.max())}
+
+
+def format_report(data_path, threshold, folds, accuracy, latency):
+    return f"""# Intent classifier report
+
+Samples: {accuracy['samples']} from `{data_path}`, confidence threshold: {threshold}
+
+## Accuracy ({folds}-fold cross validation)
+
+| Metric                                         | Value |
+|:-----------------------------------------------|------:|
+| Model accuracy (without rules or threshold)    | {accuracy['model_accuracy']:.1%} |
+| Queries decided locally (rules or confident)   | {accuracy['local_coverage']:.1%} |
+| Accuracy of the locally decided queries        | {accuracy['local_accuracy']:.1%} |
+| Queries left to the LLM intent prompt          | {1 - accuracy['local_coverage']:.1%} |
+
+## Latency per query (rules and model, single thread)
+
+| p50 (ms) | p99 (ms) | max (ms) |
+|---------:|---------:|---------:|
+| {latency['p50_ms']:.3f} | {latency['p99_ms']:.3f} | {latency['max_ms']:.3f} |
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_path',
+                        type=str,
+                        required=False,
+                        help='CSV file with labelled queries (columns: text, label)',
+                        default="data/intent_samples.csv"
+                        )
+    parser.add_argument('--model_path',
+                        type=str,
+                        required=False,
+                        help='Path where the trained model is saved',
+                        default="models/intent_classifier.joblib"
+                        )
+    parser.add_argument('--threshold',
+                        type=float,
+                        required=False,
+                        help='Confidence threshold below which the LLM decides the intent',
+                        default=0.85
+                        )
+    parser.add_argument('--folds',
+                        type=int,
+                        required=False,
+                        help='Number of cross validation folds',
+                        default=5
+                        )
+    parser.add_argument('--report_path',
+                        type=str,
+                        required=False,
+                        help='Optional path of a markdown file to write the accuracy and latency report to',
+                        default=None
+                        )
+
+    args = parser.parse_args()
+
+    texts, labels = load_samples(args.data_path)
+    print(f"Loaded {len(texts)} samples from {args.data_path}")
+    accuracy = cross_validate(texts, labels, args.threshold, args.folds)
+
+    classifier = IntentClassifier(None, args.threshold)
+    classifier.model = build_model().fit(texts, labels)
+    latency = measure_latency(classifier, texts, repeats=10)
+
+    os.makedirs(os.path.dirname(args.model_path) or ".", exist_ok=True)
+    joblib.dump(classifier.model, args.model_path)
+    print(f"Model saved to {args.model_path}")
+
+    report = format_report(args.data_path, args.threshold, args.folds, accuracy, latency)
+    print(report)
+    if args.report_path:
+        with open(args.report_path, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
+
+# RUN
+# python3 train_intent_classifier.py --data_path=data/intent_samples.csv --model_path=models/intent_classifier.joblib --report_path=docs/intent_classifier_report.md
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+from admission import UpstreamOverloadedError, request_deadline
+from config_util import get_config_value
+from metrics import translation_batch_queue_delay, translation_batch_size
+from settings import get_settings
+from tracing import span
+
+translation_batching_enabled = get_config_value('translation', 'translation_batching_enabled', "true").lower() == "true"
+translation_batch_window = float(get_config_value('translation', 'translation_batch_window', 0.005))
+
+
+class TranslationBatcher:
+    """
+    Coalesces the translations requested concurrently for the same source and target language into one
+    multi-input Bhashini request.
+
+    The first pending text of a language pair opens a window of `window` seconds. The texts requested
+    meanwhile are sent together when it closes, or as soon as request.translation_batch_size texts are
+    pending. The translations are handed back to the waiting callers. When a request with several texts
+    fails, the texts are translated one by one, so that a text Bhashini cannot translate fails only its own
+    callers. The request is sent in the context of the caller which opened the window, so it is part of its
+    trace, but without its deadline: the texts of the other callers are not bound by it.
+    """
+
+    def __init__(self, translate_batch, window):
+        self.translate_batch = translate_batch
+        self.window = window
+        self.pending = {}
+        self.timers = {}
+        self.tasks = set()
+        self.batches = 0
+        self.texts = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def translate(self, text, source, destination):
+        loop = asyncio.get_running_loop()
+        key = (source, destination)
+        future = loop.create_future()
+        batch = self.pending.setdefault(key, [])
+        batch.append((text, future, time.perf_counter()))
+        if len(batch) >= get_settings().translation_batch_size:
+            self.flush(key)
+        elif len(batch) == 1:
+            self.timers[key] = loop.call_later(self.window, self.flush, key)
+        with span("translation_batch", source=source, destination=destination) as batch_span:
+            translated_text, batch_size = await future
+            if batch_span is not None:
+                batch_span.attributes["batch_size"] = batch_size
+        return translated_text
+
+    def flush(self, key):
+        batch = self.pending.pop(key, None)
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if batch:
+            task = asyncio.get_running_loop().create_task(self.send(key, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send(self, key, batch):
+        source, destination = key
+        request_deadline.set(None)
+        send_time = time.perf_counter()
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        translation_batch_size.observe(len(texts))
+        for _, _, enqueue_time in batch:
+            translation_batch_queue_delay.observe(send_time - enqueue_time)
+        self.batches += 1
+        self.texts += len(batch)
+        try:
+            try:
+                translated = dict(zip(texts, await self.translate_batch(texts, source, destination)))
+            except UpstreamOverloadedError:
+                raise
+            except Exception:
+                if len(texts) == 1:
+                    raise
+                self.retried += 1
+                translated = dict(zip(texts, await asyncio.gather(*[self.translate_one(text, source, destination) for text in texts],
+                                                                  return_exceptions=True)))
+            for text, future, _ in batch:
+                if not future.done():
+                    if isinstance(translated[text], Exception):
+                        future.set_exception(translated[text])
+                    else:
+                        future.set_result((translated[text], len(texts)))
+            if any(isinstance(translation, Exception) for translation in translated.values()):
+                self.failed += 1
+        except Exception as e:
+            self.failed += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # Only left when the request was cancelled, e.g. on shutdown
+            for _, future, _ in batch:
+                if not future.done():
+                    future.cancel()
+
+    async def translate_one(self, text, source, destination):
+        return (await self.translate_batch([text], source, destination))[0]
+
+    def stats(self):
+        return {"enabled": translation_batching_enabled, "window": self.window, "batches": self.batches,
+                "texts": self.texts, "failed": self.failed, "retried": self.retried, "pending": sum(len(batch) for batch in self.pending.values())}
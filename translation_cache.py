@@ -0,0 +1,55 @@
+import hashlib
+
+from starlette.concurrency import run_in_threadpool
+
+from cache import TTLCache, SQLiteCache
+from config_util import get_config_value
+from utils import normalize_text
+
+translation_cache_enabled = get_config_value('cache', 'translation_cache_enabled', "true").lower() == "true"
+translation_cache_size = int(get_config_value('cache', 'translation_cache_size', 10000))
+translation_cache_ttl = int(get_config_value('cache', 'translation_cache_ttl', 86400))
+translation_cache_db_path = get_config_value('cache', 'translation_cache_db_path', None)
+translation_cache_db_ttl = int(get_config_value('cache', 'translation_cache_db_ttl', 604800))
+
+
+class TranslationCache:
+    """
+    Two tier cache for Bhashini translations keyed by normalized text, source and target language.
+
+    The first tier is an in-process LRU with a TTL; the optional second tier is a SQLite file that
+    survives restarts. Hits on the second tier are promoted to the first one.
+    """
+
+    def __init__(self, max_size, ttl, db_path=None, db_ttl=None):
+        self.memory_cache = TTLCache(max_size=max_size, ttl=ttl)
+        self.persistent_cache = SQLiteCache(db_path, "translations", ttl=db_ttl) if db_path else None
+
+    @staticmethod
+    def make_key(text, source, destination):
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{source}:{destination}:{digest}"
+
+    async def get(self, text, source, destination):
+        key = self.make_key(text, source, destination)
+        value = self.memory_cache.get(key)
+        if value is None and self.persistent_cache is not None:
+            value = await run_in_threadpool(self.persistent_cache.get, key)
+            if value is not None:
+                self.memory_cache.set(key, value)
+        return value
+
+    async def set(self, text, source, destination, translated_text):
+        key = self.make_key(text, source, destination)
+        self.memory_cache.set(key, translated_text)
+        if self.persistent_cache is not None:
+            await run_in_threadpool(self.persistent_cache.set, key, translated_text)
+
+    def stats(self):
+        stats = {"enabled": translation_cache_enabled, "memory": self.memory_cache.stats()}
+        if self.persistent_cache is not None:
+            stats["persistent"] = self.persistent_cache.stats()
+        return stats
+
+
+translation_cache = TranslationCache(translation_cache_size, translation_cache_ttl, translation_cache_db_path, translation_cache_db_ttl)
@@ -1,15 +1,29 @@
+import asyncio
+import base64
 import json
 import os
 import time
 
-import requests
+import httpx
 from google.cloud import texttospeech, speech, translate
-from pydub import AudioSegment
+from starlette.concurrency import run_in_threadpool
 
+from audio_transcoder import decode_to_wav
+from config_util import get_config_value
+from http_client import http_client
+from logger import logger
+from metrics import track_stage
+from request_audio import fetch_audio
+from resilience import call_upstream, google_fallback_stages
+from settings import get_settings
 from telemetry_logger import TelemetryLogger
+from tracing import get_trace_headers, span
+from translation_batcher import TranslationBatcher, translation_batch_window, translation_batching_enabled
+from translation_cache import translation_cache, translation_cache_enabled
 from utils import *
 
 telemetryLogger = TelemetryLogger()
+bhashini_chaining_enabled = get_config_value('translation', 'bhashini_chaining_enabled', "true").lower() == "true"
 
 asr_mapping = {
     "bn": "ai4bharat/conformer-multilingual-indo_aryan-gpu--t4",
@@ -78,37 +92,40 @@ def log_failed_telemetry_event(url, method, payload, process_time, status_code,
     telemetryLogger.add_event(event)
 
 
-def get_encoded_string(audio):
-    if is_url(audio):
-        local_filename = generate_temp_filename("mp3")
-        with requests.get(audio) as r:
-            with open(local_filename, 'wb') as f:
-                f.write(r.content)
+def get_error_details(e):
+    """Returns the status code and body of a failed upstream call, if a response was received."""
+    response = getattr(e, "response", None)
+    if response is None:
+        return None, str(e)
+    return response.status_code, response.text
+
+
+async def get_encoded_string(audio):
+    """
+    Decodes the audio input (URL, base64 content, local file or the streamed body of an upload) to 16 kHz
+    mono PCM16 WAV in memory.
+
+    Returns:
+        The base64 encoded WAV for Bhashini and the WAV content for Google speech to text.
+    """
+    if not isinstance(audio, str):
+        wav_file_content = await decode_to_wav(audio)
+    elif is_url(audio):
+        wav_file_content = await fetch_audio(audio)
     elif is_base64(audio):
-        local_filename = generate_temp_filename("mp3")
-        decoded_audio_content = base64.b64decode(audio)
-        output_mp3_file = open(local_filename, "wb")
-        output_mp3_file.write(decoded_audio_content)
-        output_mp3_file.close()
+        wav_file_content = await decode_to_wav(base64.b64decode(audio))
     else:
-        local_filename = audio
-
-    output_file = AudioSegment.from_file(local_filename)
-    mp3_output_file = output_file.export(local_filename, format="mp3")
-    given_audio = AudioSegment.from_file(mp3_output_file)
-    given_audio = given_audio.set_frame_rate(16000)
-    given_audio = given_audio.set_channels(1)
-    tmp_wav_filename = generate_temp_filename("wav")
-    given_audio.export(tmp_wav_filename, format="wav", codec="pcm_s16le")
-    with open(tmp_wav_filename, "rb") as wav_file:
-        wav_file_content = wav_file.read()
-    encoded_string = base64.b64encode(wav_file_content)
-    encoded_string = str(encoded_string, 'ascii', 'ignore')
-    os.remove(local_filename)
-    os.remove(tmp_wav_filename)
+        wav_file_content = await decode_to_wav(await run_in_threadpool(read_file, audio))
+
+    encoded_string = base64.b64encode(wav_file_content).decode("ascii")
     return encoded_string, wav_file_content
 
 
+def read_file(file_name):
+    with open(file_name, "rb") as f:
+        return f.read()
+
+
 def google_speech_to_text(wav_file_content, input_language):
     client = speech.SpeechClient()
     audio = speech.RecognitionAudio(content=wav_file_content)
@@ -122,7 +139,7 @@ def google_speech_to_text(wav_file_content, input_language):
     return response.results[0].alternatives[0].transcript
 
 
-def speech_to_text(encoded_string, input_language):
+async def speech_to_text(encoded_string, input_language):
     start_time = time.time()
     url = os.environ['BHASHINI_ENDPOINT_URL']
     payload = {
@@ -147,42 +164,53 @@ def speech_to_text(encoded_string, input_language):
     }
     headers = {
         'Authorization': os.environ['BHASHINI_API_KEY'],
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        **get_trace_headers()
     }
 
     try:
-        response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
+        with span("bhashini_asr", language=input_language, audio_bytes=len(encoded_string)):
+            response = await http_client.post(url, headers=headers, content=json.dumps(payload))
         process_time = time.time() - start_time
         response.raise_for_status()
         log_success_telemetry_event(url, "POST",{"taskType": "asr"}, process_time, status_code=response.status_code)
         text = json.loads(response.text)[
             "pipelineResponse"][0]["output"][0]["source"]
         return text
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         process_time = time.time() - start_time
-        log_failed_telemetry_event(url, "POST",{"taskType": "asr"}, process_time, status_code=e.response.status_code, error=e.response.text)
-        raise RequestError(e.response) from e
+        status_code, error = get_error_details(e)
+        log_failed_telemetry_event(url, "POST",{"taskType": "asr"}, process_time, status_code=status_code, error=error)
+        raise RequestError(getattr(e, "response", None)) from e
 
 
 def google_translate_text(text, source, destination, project_id="indian-legal-bert"):
+    return google_translate_texts([text], source, destination, project_id)[0]
+
+
+def google_translate_texts(texts, source, destination, project_id="indian-legal-bert"):
     client = translate.TranslationServiceClient()
     location = "global"
     parent = f"projects/{project_id}/locations/{location}"
     response = client.translate_text(
         request={
             "parent": parent,
-            "contents": [text],
+            "contents": texts,
             "mime_type": "text/plain",
             "source_language_code": source,
             "target_language_code": destination,
         }
     )
-    return response.translations[0].translated_text
+    return [translation.translated_text for translation in response.translations]
 
 
-def indic_translation(text, source, destination):
-    if source == destination:
-        return text
+async def bhashini_translation(texts, source, destination):
+    """
+    Translates the texts with a single Bhashini request, as inputData.input is a list.
+
+    Returns:
+        The translations in the order of the texts.
+    """
     try:
         start_time = time.time()
         url = os.environ['BHASHINI_ENDPOINT_URL']
@@ -203,38 +231,105 @@ def indic_translation(text, source, destination):
                 "input": [
                     {
                         "source": text
-                    }
+                    } for text in texts
                 ]
             }
         }
         headers = {
             'Authorization': os.environ['BHASHINI_API_KEY'],
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            **get_trace_headers()
         }
 
-        response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
+        with span("bhashini_translation", source=source, destination=destination, inputs=len(texts),
+                  chars=sum(len(text) for text in texts)):
+            response = await http_client.post(url, headers=headers, content=json.dumps(payload))
         process_time = time.time() - start_time
         response.raise_for_status()
         log_success_telemetry_event(url, "POST",{"taskType": "translation"}, process_time, status_code=response.status_code)
-        indic_text = json.loads(response.text)["pipelineResponse"][0]["output"][0]["target"]
-    except requests.exceptions.RequestException as e:
+        outputs = json.loads(response.text)["pipelineResponse"][0]["output"]
+    except httpx.HTTPError as e:
         process_time = time.time() - start_time
-        log_failed_telemetry_event(url, "POST",{"taskType": "translation"}, process_time, status_code=e.response.status_code, error=e.response.text)
-        raise RequestError(e.response) from e
-        # indic_text = google_translate_text(text, source, destination)
+        status_code, error = get_error_details(e)
+        log_failed_telemetry_event(url, "POST",{"taskType": "translation"}, process_time, status_code=status_code, error=error)
+        raise RequestError(getattr(e, "response", None)) from e
+    if len(outputs) != len(texts):
+        raise RequestError(response)
+    return [output["target"] for output in outputs]
+
+
+async def google_translation(texts, source, destination):
+    with span("google_translation", source=source, destination=destination, inputs=len(texts)):
+        return await run_in_threadpool(google_translate_texts, texts, source, destination)
+
+
+async def translate_texts(texts, source, destination):
+    """Translates the texts with Bhashini through its circuit breaker, falling back to Google Translate when enabled."""
+    google_fallback = (lambda: google_translation(texts, source, destination)) if "translation" in google_fallback_stages else None
+    return await call_upstream("bhashini_translation", "translation", lambda: bhashini_translation(texts, source, destination), google_fallback)
+
+
+translation_batcher = TranslationBatcher(translate_texts, translation_batch_window)
+
+
+async def indic_translation(text, source, destination):
+    if source == destination:
+        return text
+    if translation_cache_enabled:
+        with span("translation_cache_lookup") as cache_span:
+            cached_text = await translation_cache.get(text, source, destination)
+            if cache_span is not None:
+                cache_span.attributes["hit"] = cached_text is not None
+        if cached_text is not None:
+            return cached_text
+    if translation_batching_enabled:
+        indic_text = await translation_batcher.translate(text, source, destination)
+    else:
+        indic_text = (await translate_texts([text], source, destination))[0]
+    if translation_cache_enabled:
+        await translation_cache.set(text, source, destination, indic_text)
     return indic_text
 
 
+async def indic_translation_batch(texts, source, destination):
+    """
+    Translates several texts from one language to another with as few Bhashini requests as possible.
+
+    Texts found in the translation cache are not sent and duplicates are sent once. The others are sent in
+    requests of at most translation_batch_size texts, which run concurrently.
+
+    Returns:
+        The translations in the order of the texts.
+    """
+    if source == destination:
+        return list(texts)
+    translations = [None] * len(texts)
+    if translation_cache_enabled:
+        with span("translation_cache_lookup", inputs=len(texts)):
+            translations = list(await asyncio.gather(*[translation_cache.get(text, source, destination) for text in texts]))
+    missing_texts = list(dict.fromkeys(text for text, translation in zip(texts, translations) if translation is None))
+    if missing_texts:
+        batch_size = get_settings().translation_batch_size
+        batches = [missing_texts[i:i + batch_size] for i in range(0, len(missing_texts), batch_size)]
+        results = await asyncio.gather(*[translate_texts(batch, source, destination) for batch in batches])
+        translated = dict(zip(missing_texts, [translation for result in results for translation in result]))
+        translations = [translation if translation is not None else translated[text] for text, translation in zip(texts, translations)]
+        if translation_cache_enabled:
+            await asyncio.gather(*[translation_cache.set(text, source, destination, translated[text]) for text in missing_texts])
+    return translations
+
+
 def google_text_to_speech(text, language):
     try:
         client = texttospeech.TextToSpeechClient()
         input_text = texttospeech.SynthesisInput(text=text)
         voice = texttospeech.VoiceSelectionParams(
-            language_code=language,
+            language_code=language + "-IN",
             ssml_gender=texttospeech.SsmlVoiceGender.FEMALE,
         )
+        # WAV like the audio of Bhashini, so that the chunks of both can be concatenated
         audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3
+            audio_encoding=texttospeech.AudioEncoding.LINEAR16
         )
         response = client.synthesize_speech(
             request={"input": input_text, "voice": voice,
@@ -246,7 +341,27 @@ def google_text_to_speech(text, language):
     return audio_content
 
 
-def text_to_speech(language, text, gender='female'):
+async def text_to_speech(language, text, gender='female'):
+    """
+    Converts the text to speech with Bhashini through its circuit breaker, falling back to Google text to
+    speech when enabled.
+
+    Returns:
+        The audio content, or None on failure.
+    """
+    google_fallback = (lambda: google_tts(text, language)) if "tts" in google_fallback_stages else None
+    try:
+        return await call_upstream("bhashini_tts", "tts", lambda: bhashini_text_to_speech(language, text, gender), google_fallback)
+    except Exception:
+        return None
+
+
+async def google_tts(text, language):
+    with span("google_tts", language=language, chars=len(text)):
+        return await run_in_threadpool(google_text_to_speech, text, language)
+
+
+async def bhashini_text_to_speech(language, text, gender='female'):
     try:
         start_time = time.time()
         url = os.environ['BHASHINI_ENDPOINT_URL']
@@ -278,26 +393,186 @@ def text_to_speech(language, text, gender='female'):
         }
         headers = {
             'Authorization': os.environ['BHASHINI_API_KEY'],
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            **get_trace_headers()
         }
-        response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
+        with span("bhashini_tts", language=language, chars=len(text)):
+            response = await http_client.post(url, headers=headers, content=json.dumps(payload))
         process_time = time.time() - start_time
         response.raise_for_status()
         log_success_telemetry_event(url, "POST",{"taskType": "tts"}, process_time, status_code=response.status_code)
         audio_content = response.json()["pipelineResponse"][0]['audio'][0]['audioContent']
         audio_content = base64.b64decode(audio_content)
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         process_time = time.time() - start_time
-        log_failed_telemetry_event(url, "POST",{"taskType": "tts"}, process_time, status_code=e.response.status_code, error=e.response.text)
-        audio_content = None
-        # audio_content = google_text_to_speech(text, language)
+        status_code, error = get_error_details(e)
+        log_failed_telemetry_event(url, "POST",{"taskType": "tts"}, process_time, status_code=status_code, error=error)
+        raise RequestError(getattr(e, "response", None)) from e
     return audio_content
 
 
-def audio_input_to_text(audio_file, input_language):
-    encoded_string, wav_file_content = get_encoded_string(audio_file)
+async def run_bhashini_pipeline(pipeline_tasks, input_data, task_type, span_name, **span_attributes):
+    """
+    Runs the chained tasks of a Bhashini pipeline in a single request.
+
+    Returns:
+        The pipelineResponse list, with one entry per task.
+    """
+    start_time = time.time()
+    url = os.environ['BHASHINI_ENDPOINT_URL']
+    payload = {
+        "pipelineTasks": pipeline_tasks,
+        "inputData": input_data
+    }
+    headers = {
+        'Authorization': os.environ['BHASHINI_API_KEY'],
+        'Content-Type': 'application/json',
+        **get_trace_headers()
+    }
     try:
-        indic_text = speech_to_text(encoded_string, input_language)
-    except:
-        indic_text = google_speech_to_text(wav_file_content, input_language)
-    return indic_text
+        with span(span_name, **span_attributes):
+            response = await http_client.post(url, headers=headers, content=json.dumps(payload))
+        process_time = time.time() - start_time
+        response.raise_for_status()
+        log_success_telemetry_event(url, "POST", {"taskType": task_type}, process_time, status_code=response.status_code)
+    except httpx.HTTPError as e:
+        process_time = time.time() - start_time
+        status_code, error = get_error_details(e)
+        log_failed_telemetry_event(url, "POST", {"taskType": task_type}, process_time, status_code=status_code, error=error)
+        raise RequestError(getattr(e, "response", None)) from e
+    pipeline_response = json.loads(response.text)["pipelineResponse"]
+    if len(pipeline_response) != len(pipeline_tasks):
+        raise RequestError(response)
+    return pipeline_response
+
+
+async def speech_to_english(encoded_string, input_language):
+    """
+    Converts speech to English with a single Bhashini pipeline chaining ASR and translation.
+
+    Returns:
+        The transcript in the input language and its English translation.
+    """
+    pipeline_tasks = [
+        {
+            "taskType": "asr",
+            "config": {
+                "language": {
+                    "sourceLanguage": input_language
+                },
+                "serviceId": asr_mapping[input_language]
+            }
+        },
+        {
+            "taskType": "translation",
+            "config": {
+                "language": {
+                    "sourceLanguage": input_language,
+                    "targetLanguage": "en"
+                },
+                "serviceId": translation_serviceId
+            }
+        }
+    ]
+    input_data = {
+        "audio": [
+            {
+                "audioContent": encoded_string
+            }
+        ]
+    }
+    pipeline_response = await run_bhashini_pipeline(pipeline_tasks, input_data, "asr+translation", "bhashini_asr_translation",
+                                                    language=input_language, audio_bytes=len(encoded_string))
+    regional_text = pipeline_response[0]["output"][0]["source"]
+    english_text = pipeline_response[1]["output"][0]["target"]
+    return regional_text, english_text
+
+
+async def translation_to_speech(text, source, destination, gender='female'):
+    """
+    Translates the text and converts the translation to speech with a single Bhashini pipeline chaining
+    translation and TTS.
+
+    Returns:
+        The translated text and its audio content.
+    """
+    pipeline_tasks = [
+        {
+            "taskType": "translation",
+            "config": {
+                "language": {
+                    "sourceLanguage": source,
+                    "targetLanguage": destination
+                },
+                "serviceId": translation_serviceId
+            }
+        },
+        {
+            "taskType": "tts",
+            "config": {
+                "language": {
+                    "sourceLanguage": destination
+                },
+                "serviceId": tts_mapping[destination],
+                "gender": gender
+            }
+        }
+    ]
+    input_data = {
+        "input": [
+            {
+                "source": text
+            }
+        ]
+    }
+    pipeline_response = await run_bhashini_pipeline(pipeline_tasks, input_data, "translation+tts", "bhashini_translation_tts",
+                                                    source=source, destination=destination, chars=len(text))
+    translated_text = pipeline_response[0]["output"][0]["target"]
+    audio_content = base64.b64decode(pipeline_response[1]["audio"][0]["audioContent"])
+    return translated_text, audio_content
+
+
+async def google_asr(wav_file_content, input_language):
+    with span("google_speech_to_text", language=input_language):
+        return await run_in_threadpool(google_speech_to_text, wav_file_content, input_language)
+
+
+async def transcribe(encoded_string, wav_file_content, input_language):
+    """Converts speech to text with Bhashini through its circuit breaker, falling back to Google speech to text when enabled."""
+    google_fallback = (lambda: google_asr(wav_file_content, input_language)) if "asr" in google_fallback_stages else None
+    with track_stage("asr"):
+        return await call_upstream("bhashini_asr", "asr", lambda: speech_to_text(encoded_string, input_language), google_fallback)
+
+
+async def audio_input_to_text(audio_file, input_language):
+    with track_stage("audio_decode"):
+        encoded_string, wav_file_content = await get_encoded_string(audio_file)
+    return await transcribe(encoded_string, wav_file_content, input_language)
+
+
+async def audio_input_to_english(audio_file, input_language):
+    """
+    Converts the audio input to text in the input language and, when Bhashini chaining is enabled, to English
+    in the same pipeline request. If the chained pipeline fails, only speech to text is done, as in
+    audio_input_to_text.
+
+    Returns:
+        The regional text, and the English text or None when it still has to be translated.
+    """
+    with track_stage("audio_decode"):
+        encoded_string, wav_file_content = await get_encoded_string(audio_file)
+    if bhashini_chaining_enabled and input_language != "en":
+        try:
+            with track_stage("asr_translation"):
+                regional_text, english_text = await call_upstream("bhashini_asr_translation", "asr_translation",
+                                                                  lambda: speech_to_english(encoded_string, input_language))
+            if translation_cache_enabled:
+                await translation_cache.set(regional_text, input_language, "en", english_text)
+            return regional_text, english_text
+        except Exception as e:
+            logger.warning(f"Chained ASR and translation failed, falling back to separate requests: {e!r}")
+    return await transcribe(encoded_string, wav_file_content, input_language), None
+
+
+async def is_translation_cached(text, source, destination):
+    return translation_cache_enabled and await translation_cache.get(text, source, destination) is not None
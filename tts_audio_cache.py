@@ -0,0 +1,59 @@
+import hashlib
+
+from starlette.concurrency import run_in_threadpool
+
+from cache import TTLCache, SQLiteCache
+from cloud_storage_oci import object_exists
+from config_util import get_config_value
+
+tts_cache_enabled = get_config_value('cache', 'tts_cache_enabled', "true").lower() == "true"
+tts_cache_prefix = get_config_value('cache', 'tts_cache_prefix', "tts")
+tts_cache_index_size = int(get_config_value('cache', 'tts_cache_index_size', 50000))
+tts_cache_index_ttl = int(get_config_value('cache', 'tts_cache_index_ttl', 86400))
+tts_cache_index_db_path = get_config_value('cache', 'tts_cache_index_db_path', None)
+
+
+class TTSAudioCache:
+    """
+    Content addressed index of synthesized audio stored in the OCI bucket.
+
+    Audio objects are named after a hash of (text, language, gender, serviceId), so identical answers map
+    to the same object. Known object names are remembered in a local index (in-process, optionally backed
+    by SQLite) so that a cached answer does not need a HEAD request to the bucket on every query.
+    """
+
+    def __init__(self, prefix, index_size, index_ttl, index_db_path=None):
+        self.prefix = prefix
+        self.known_objects = TTLCache(max_size=index_size, ttl=index_ttl)
+        self.persistent_index = SQLiteCache(index_db_path, "tts_objects", ttl=index_ttl) if index_db_path else None
+        self.bucket_hits = 0
+
+    def object_name(self, text, language, gender, service_id):
+        digest = hashlib.sha256("\x1f".join([text.strip(), language, gender, service_id]).encode("utf-8")).hexdigest()
+        return f"{self.prefix}/{digest}.mp3"
+
+    async def exists(self, object_name):
+        if self.known_objects.get(object_name) is not None:
+            return True
+        if self.persistent_index is not None and await run_in_threadpool(self.persistent_index.get, object_name) is not None:
+            self.known_objects.set(object_name, True)
+            return True
+        if await run_in_threadpool(object_exists, object_name):
+            self.bucket_hits += 1
+            await self.add(object_name)
+            return True
+        return False
+
+    async def add(self, object_name):
+        self.known_objects.set(object_name, True)
+        if self.persistent_index is not None:
+            await run_in_threadpool(self.persistent_index.set, object_name, "1")
+
+    def stats(self):
+        stats = {"enabled": tts_cache_enabled, "index": self.known_objects.stats(), "bucket_hits": self.bucket_hits}
+        if self.persistent_index is not None:
+            stats["persistent_index"] = self.persistent_index.stats()
+        return stats
+
+
+tts_audio_cache = TTSAudioCache(tts_cache_prefix, tts_cache_index_size, tts_cache_index_ttl, tts_cache_index_db_path)
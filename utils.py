@@ -1,16 +1,22 @@
-import base64
-import binascii
+import re
+import unicodedata
 import uuid
 from urllib.parse import urlparse
 
+whitespace_pattern = re.compile(r"\s+")
+base64_pattern = re.compile(r"[A-Za-z0-9+/]*={0,2}")
+
 
 def is_base64(base64_string):
-    try:
-        base64.b64decode(base64_string)
-        return True
-    except (binascii.Error, UnicodeDecodeError):
-        # If an error occurs during decoding, the string is not Base64
+    """Checks the alphabet, padding and length of a base64 string without decoding it."""
+    if not isinstance(base64_string, str):
         return False
+    if base64_pattern.fullmatch(base64_string) is None:
+        # Line wrapped payloads are accepted by the decoder as well
+        base64_string = whitespace_pattern.sub("", base64_string)
+        if base64_pattern.fullmatch(base64_string) is None:
+            return False
+    return len(base64_string) % 4 == 0
 
 
 def is_url(string):
@@ -22,4 +28,15 @@ def is_url(string):
 
 
 def generate_temp_filename(ext, prefix="temp"):
-    return f"{prefix}_{uuid.uuid4()}.{ext}"
\ No newline at end of file
+    return f"{prefix}_{uuid.uuid4()}.{ext}"
+
+
+# A sentence ends with an English or Indic full stop, question or exclamation mark followed by white space,
+# or with a line break (markdown paragraphs, headings and list items).
+sentence_boundary_pattern = re.compile(r"(?<=[.!?।॥])[ \t]+|\s*\n\s*")
+
+
+def normalize_text(text):
+    """Normalizes the text so that trivially different spellings of a query share a cache entry."""
+    text = unicodedata.normalize("NFC", text)
+    return whitespace_pattern.sub(" ", text).strip().casefold()